@@ -33,7 +33,22 @@ from .app import Application, AppException
 from .settings import (Settings, log_group_name, config_group_name,
                        perf_group_name, UnknownConfigVariable,
                        MalformedYamlConfig)
-from .runcmd import runcmd, runcmd_unchecked, shell_quote, ssh_runcmd
+from .admission import AdmissionController
+from .parallel import ForkPool
+from .runcmd import (runcmd, runcmd_unchecked, runcmd_batched, PyStage,
+                     runcmd_batched_unchecked, shell_quote, ssh_runcmd,
+                     ssh_runcmd_batched)
+from .compression import (
+    detect_compression, open_decompressed, open_compressed)
+from .prefetch import Prefetcher
+from .output import OutputWriter, ChunkedOutput
+from .checkpoint import Checkpoint
+from .incremental import InputIndex
+from .walk import walk_files, read_names
+from .lineindex import LineIndex
+from .records import RecordReader
+from .extsort import ExternalSorter
+from .mapreduce import write_batch, read_batch, merge_batches
 
 # The plugin system
 from .hook import Hook, FilterHook
@@ -0,0 +1,170 @@
+# Copyright (C) 2016  Lars Wirzenius
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along
+# with this program; if not, write to the Free Software Foundation, Inc.,
+# 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+
+
+import contextlib
+import errno
+import fcntl
+import logging
+import os
+import random
+import tempfile
+import time
+
+
+class AdmissionController(object):
+
+    '''Limit how many external commands run at once on a host.
+
+    This is a counting semaphore shared by all processes on the host
+    that use the same ``name``, such as many instances of the same
+    program started from cron. It is implemented with ``slots`` lock
+    files in a directory: a process holding a lock on one of them may
+    run a command. Locks are released by the kernel when a process
+    dies, so a crashed process never leaks a slot.
+
+    The directory defaults to ``$XDG_RUNTIME_DIR``, or ``/run/lock``
+    if that is not set, or the system temporary directory if neither
+    is writable.
+
+    Optionally, new commands are also delayed while the one-minute
+    load average is above ``max_load``, or while memory pressure, as
+    reported by the kernel in ``/proc/pressure/memory`` (the "some"
+    10-second average, in percent), is above ``max_memory_pressure``.
+
+    Use it with ``cliapp.runcmd`` via the ``admission`` keyword
+    argument, or directly::
+
+        with controller.admit():
+            ...
+
+    '''
+
+    def __init__(self, name, slots=0, directory=None, max_load=0,
+                 max_memory_pressure=0, poll_interval=1.0):
+        self.name = name
+        self.slots = slots
+        self.directory = directory or self._default_directory()
+        self.max_load = max_load
+        self.max_memory_pressure = max_memory_pressure
+        self.poll_interval = poll_interval
+
+        self.sleep = time.sleep
+        self.getloadavg = os.getloadavg
+        self.pressure_filename = '/proc/pressure/memory'
+
+    def _default_directory(self):  # pragma: no cover
+        for dirname in [os.environ.get('XDG_RUNTIME_DIR'), '/run/lock']:
+            if dirname and os.access(dirname, os.W_OK):
+                return dirname
+        return tempfile.gettempdir()
+
+    @contextlib.contextmanager
+    def admit(self):
+        '''Wait until it is OK to run a command, then hold a slot.'''
+
+        self.wait_for_resources()
+        lock = self.acquire()
+        try:
+            yield
+        finally:
+            self.release(lock)
+
+    def wait_for_resources(self):
+        '''Wait until load and memory pressure are below limits.'''
+
+        while self.overloaded():
+            self._pause()
+
+    def overloaded(self):
+        '''Is the host too busy to start new commands?'''
+
+        if self.max_load and self.getloadavg()[0] > self.max_load:
+            logging.debug('load average above %s', self.max_load)
+            return True
+        if self.max_memory_pressure:
+            pressure = self.memory_pressure()
+            if pressure is not None and pressure > self.max_memory_pressure:
+                logging.debug(
+                    'memory pressure above %s', self.max_memory_pressure)
+                return True
+        return False
+
+    def memory_pressure(self):
+        '''Return the "some avg10" memory pressure, or None if unknown.'''
+
+        try:
+            with open(self.pressure_filename) as f:
+                for line in f:
+                    words = line.split()
+                    if words and words[0] == 'some':
+                        for word in words[1:]:
+                            if word.startswith('avg10='):
+                                return float(word[len('avg10='):])
+        except (IOError, ValueError):
+            pass
+        return None
+
+    def acquire(self):
+        '''Acquire a slot and return an open file holding its lock.
+
+        Return None if the number of slots is not limited.
+
+        '''
+
+        if not self.slots:
+            return None
+
+        lock_dir = os.path.join(self.directory, '%s.slots' % self.name)
+        try:
+            os.mkdir(lock_dir)
+        except OSError as e:
+            if e.errno != errno.EEXIST:
+                raise
+
+        while True:
+            # Start at a random slot so that waiting processes don't all
+            # contend for the first one.
+            first = random.randrange(self.slots)
+            for i in range(self.slots):
+                slot = (first + i) % self.slots
+                lock = self._try_lock(os.path.join(lock_dir, str(slot)))
+                if lock is not None:
+                    return lock
+            self._pause()
+
+    def _try_lock(self, filename):
+        f = open(filename, 'a')
+        # Children must not inherit the lock, or it would stay locked
+        # after we release it, for as long as they run.
+        flags = fcntl.fcntl(f.fileno(), fcntl.F_GETFD)
+        fcntl.fcntl(f.fileno(), fcntl.F_SETFD, flags | fcntl.FD_CLOEXEC)
+        try:
+            fcntl.flock(f.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except IOError as e:
+            f.close()
+            if e.errno in (errno.EAGAIN, errno.EACCES):
+                return None
+            raise  # pragma: no cover
+        return f
+
+    def release(self, lock):
+        '''Release a slot returned by ``acquire``.'''
+        if lock is not None:
+            lock.close()
+
+    def _pause(self):
+        self.sleep(self.poll_interval * random.uniform(0.5, 1.5))
@@ -0,0 +1,117 @@
+# Copyright (C) 2016  Lars Wirzenius
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along
+# with this program; if not, write to the Free Software Foundation, Inc.,
+# 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+
+
+import os
+import shutil
+import tempfile
+import unittest
+
+import cliapp
+
+
+class AdmissionControllerTests(unittest.TestCase):
+
+    def setUp(self):
+        self.tempdir = tempfile.mkdtemp()
+        self.pauses = 0
+
+    def tearDown(self):
+        shutil.rmtree(self.tempdir)
+
+    def new_controller(self, **kwargs):
+        controller = cliapp.AdmissionController(
+            'test', directory=self.tempdir, **kwargs)
+        controller.sleep = self.pause
+        return controller
+
+    def pause(self, seconds):
+        self.pauses += 1
+        if self.pauses > 10:
+            raise Exception('waited too long')
+
+    def test_admits_without_limits(self):
+        controller = self.new_controller()
+        with controller.admit():
+            pass
+        self.assertEqual(self.pauses, 0)
+
+    def test_acquires_all_slots(self):
+        controller = self.new_controller(slots=2)
+        locks = [controller.acquire(), controller.acquire()]
+        self.assertEqual(len(set(lock.name for lock in locks)), 2)
+        for lock in locks:
+            controller.release(lock)
+
+    def test_waits_for_free_slot(self):
+        controller = self.new_controller(slots=1)
+        lock = controller.acquire()
+
+        def pause(seconds):
+            controller.release(lock)
+        controller.sleep = pause
+
+        other = controller.acquire()
+        self.assertNotEqual(other, None)
+        controller.release(other)
+
+    def test_slots_are_shared_between_controllers(self):
+        first = self.new_controller(slots=1)
+        second = self.new_controller(slots=1)
+        lock = first.acquire()
+        self.assertRaises(Exception, second.acquire)
+        first.release(lock)
+        second.release(second.acquire())
+
+    def test_waits_while_load_is_high(self):
+        controller = self.new_controller(max_load=4)
+        loads = [8.0, 5.0, 1.0]
+        controller.getloadavg = lambda: (loads.pop(0), 0.0, 0.0)
+        with controller.admit():
+            pass
+        self.assertEqual(self.pauses, 2)
+
+    def test_reads_memory_pressure(self):
+        filename = os.path.join(self.tempdir, 'memory')
+        with open(filename, 'w') as f:
+            f.write('some avg10=12.50 avg60=1.00 avg300=0.00 total=1\n')
+            f.write('full avg10=2.00 avg60=0.00 avg300=0.00 total=1\n')
+        controller = self.new_controller(max_memory_pressure=10)
+        controller.pressure_filename = filename
+        self.assertEqual(controller.memory_pressure(), 12.5)
+        self.assertTrue(controller.overloaded())
+
+    def test_ignores_missing_memory_pressure(self):
+        controller = self.new_controller(max_memory_pressure=10)
+        controller.pressure_filename = os.path.join(self.tempdir, 'nothere')
+        self.assertEqual(controller.memory_pressure(), None)
+        self.assertFalse(controller.overloaded())
+
+    def test_runcmd_holds_slot_while_running(self):
+        controller = self.new_controller(slots=1)
+        other = self.new_controller(slots=1)
+        seen = []
+
+        def check(data):
+            try:
+                other.acquire()
+            except Exception:
+                seen.append('busy')
+
+        cliapp.runcmd(['echo', 'foo'], admission=controller,
+                      stdout_callback=check)
+        self.assertEqual(seen, ['busy'])
+        other.release(other.acquire())
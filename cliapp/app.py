@@ -15,18 +15,28 @@
 # 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
 
 
+import ctypes
+import ctypes.util
 import errno
 import inspect
+import itertools
 import logging
 import logging.handlers
+import mmap
 import os
+import re
+import shutil
 import StringIO
+import subprocess
 import sys
+import tempfile
 import traceback
 import platform
 import textwrap
 
 import cliapp
+from cliapp.runcmd import _popen
+from cliapp.records import RecordReader
 
 
 class AppException(Exception):
@@ -93,11 +103,26 @@ class Application(object):
         self.fileno = 0
         self.global_lineno = 0
         self.lineno = 0
+        self._in_worker = False
+        self._chunked_output = None
+        self._shard_pool = None
+        self._keep_shard_pool = False
+        self._partials = None
+        self._opened_output = None
+        self._checkpoint = None
+        self._resume_point = None
+        self._input_index = 0
+        self._input_name = None
+        self._input_offset = 0
         self._description = description
         if not hasattr(self, 'arg_synopsis'):
             self.arg_synopsis = '[FILE]...'
         if not hasattr(self, 'cmd_synopsis'):
             self.cmd_synopsis = {}
+        if not hasattr(self, 'input_block_size'):
+            self.input_block_size = 1024**2
+        if not hasattr(self, 'input_filter'):
+            self.input_filter = None
 
         self.subcommands = {}
         self.subcommand_aliases = {}
@@ -181,14 +206,44 @@ class Application(object):
             self.setup_logging()
             self.log_config()
 
-            if self.settings['output']:
-                self.output = open(self.settings['output'], 'w')
+            filename = self.settings['output']
+            chunk_bytes = self.settings['output-chunk-size']
+            chunk_records = self.settings['output-chunk-records']
+            checkpoint = None
+            if filename:
+                checkpoint = self._load_checkpoint()
+            if checkpoint is not None and self._output_compression(filename):
+                raise AppException(
+                    'Cannot resume writing compressed output to %s' %
+                    filename)
+            if filename and (chunk_bytes or chunk_records):
+                self.output = cliapp.ChunkedOutput(
+                    filename, max_bytes=chunk_bytes,
+                    max_records=chunk_records, open_chunk=self.open_output)
+                if checkpoint is not None:
+                    self._check_resumable(checkpoint.get('output_chunks'))
+                    self.output.resume(checkpoint['output_chunks'])
+                self._chunked_output = self.output
+            elif checkpoint is not None:
+                self._check_resumable(checkpoint['output_size'])
+                self.output = self._reopen_output(
+                    filename, checkpoint['output_size'])
+            elif filename:
+                self.output = self.open_output(filename)
             else:
                 self.output = sys.stdout
-
-            self.process_args(args)
-            self.cleanup()
-            self.disable_plugins()
+            self.output = self.buffer_output(self.output)
+            self._opened_output = self.output
+
+            try:
+                self.process_args(args)
+                self.cleanup()
+                self.disable_plugins()
+            except BaseException:
+                exc_info = sys.exc_info()
+                self._close_output_after_error()
+                raise exc_info[0], exc_info[1], exc_info[2]
+            self.close_output()
         except cliapp.UnknownConfigVariable, e:  # pragma: no cover
             stderr.write('ERROR: %s\n' % str(e))
             sys.exit(1)
@@ -232,6 +287,132 @@ class Application(object):
             '%s version %s ends normally',
             self.settings.progname, self.settings.version)
 
+    def open_output(self, filename):
+        '''Open the file named with the ``output`` setting for writing.
+
+        The output is compressed according to the ``output-compression``
+        and ``output-compression-level`` settings. Compression happens
+        in a separate process, in parallel with the application.
+
+        '''
+
+        compression = self._output_compression(filename)
+        if compression is None:
+            return open(filename, 'w')
+        level = self.settings['output-compression-level'] or None
+        if level is not None and not 1 <= level <= 9:
+            raise AppException(
+                'Compression level must be from 1 to 9, not %d' % level)
+        return cliapp.compression.open_compressed(
+            filename, compression, level)
+
+    def _output_compression(self, filename):
+        compression = self.settings['output-compression']
+        if compression == 'auto':
+            compression = cliapp.compression.compression_for_filename(
+                filename)
+        if compression == 'none':
+            return None
+        return compression
+
+    def _check_resumable(self, position):
+        if position is None:
+            raise AppException(
+                'Cannot resume writing output to %s: the checkpoint '
+                'has no position in it' % self.settings['output'])
+
+    def _reopen_output(self, filename, size):
+        # Continue the output of an interrupted run, dropping whatever
+        # it wrote after its last checkpoint.
+        f = open(filename, 'r+')
+        f.truncate(size)
+        f.seek(size)
+        return f
+
+    def buffer_output(self, f):
+        '''Return a file object for writing output to f.
+
+        If the ``output-buffer-size`` or ``output-thread`` settings are
+        used, f is wrapped in a ``cliapp.OutputWriter``. Otherwise, f
+        is returned as is.
+
+        '''
+
+        size = self.settings['output-buffer-size']
+        threaded = self.settings['output-thread']
+        if not size and not threaded:
+            return f
+        return cliapp.OutputWriter(
+            f, buffer_size=size or 1024**2, threaded=threaded,
+            close_file=f is not sys.stdout)
+
+    def open_sorter(self, key=None):
+        '''Return a ``cliapp.ExternalSorter`` for sorting lines.
+
+        This is for applications that collect lines while processing
+        input, and write them out sorted at the end, possibly more
+        lines than fit in memory. For example::
+
+            def setup(self):
+                self.sorter = self.open_sorter()
+
+            def process_input_line(self, filename, line):
+                self.sorter.add(line)
+
+            def cleanup(self):
+                with self.sorter:
+                    self.sorter.write(self.output)
+
+        If ``key`` is None, lines are sorted according to the
+        ``sort-key`` and ``sort-numeric`` settings. The ``sort-unique``
+        setting drops lines with the same key, and ``sort-memory``,
+        ``sort-compress``, and ``sort-tempdir`` set how much is kept
+        in memory, and how and where the rest is spilled to disk.
+
+        '''
+
+        if key is None:
+            key = cliapp.extsort.field_key(
+                self.settings['sort-key'], self.settings['sort-numeric'])
+        compress = self.settings['sort-compress']
+        return cliapp.ExternalSorter(
+            key=key,
+            unique=self.settings['sort-unique'],
+            memory=self.settings['sort-memory'],
+            compress=None if compress == 'none' else compress,
+            tempdir=self.settings['sort-tempdir'] or None)
+
+    def close_output(self):
+        '''Flush and close the output opened by ``run``.
+
+        Standard output is flushed, but not closed.
+
+        '''
+
+        output = self._opened_output
+        if output is None:
+            return
+        self._opened_output = None
+        if output is sys.stdout:
+            output.flush()
+        else:
+            output.close()
+
+    def _close_output_after_error(self):
+        output = self._opened_output
+        if output is None:
+            return
+        if isinstance(output, (cliapp.OutputWriter, cliapp.ChunkedOutput)):
+            # The original error is what matters, and the buffered
+            # output may be what caused it, for example, if the reader
+            # of a pipe has gone away. Chunked output is marked as
+            # incomplete, so that it gets no manifest.
+            output.discard()
+        try:
+            self.close_output()
+        except (IOError, OSError), e:
+            logging.debug('error closing output: %s', e)
+
     def compute_setting_values(self, settings):
         '''Compute setting values after configs and options are parsed.
 
@@ -603,10 +784,540 @@ class Application(object):
         and count files and lines. The global line number is the
         line number as if all input files were one.
 
+        If the ``prefetch-files`` setting is larger than zero, that
+        many files after the current one are read ahead in the
+        background. See ``cliapp.Prefetcher``.
+
+        If the ``jobs`` setting is larger than one, the files are
+        processed in parallel instead, by that many worker processes,
+        forked from the application. See ``process_inputs_in_parallel``.
+
+        If the ``checkpoint`` setting is set, the files are processed
+        one by one instead, and checkpoints are saved regularly. See
+        ``process_inputs_with_checkpoints``.
+
+        If the ``incremental-index`` setting is set, files that have
+        not changed since they were last processed are skipped. See
+        ``process_inputs_incrementally``.
+
+        If the ``files-from`` setting is set, names of input files are
+        also read from that file, after those in ``args``. See
+        ``read_files_from``.
+
+        If the ``recursive-inputs`` setting is set, directories are
+        replaced by the files in them. See ``walk_inputs``.
+
+        If the application redefines ``map_line``, the files are
+        processed with map/combine/reduce instead. See
+        ``process_inputs_map_reduce``.
+
+        '''
+
+        # Files split into shards share one pool of workers.
+        self._keep_shard_pool = True
+        try:
+            self._process_inputs(args)
+        except BaseException:
+            self._close_shard_pool(failed=True)
+            raise
+        finally:
+            self._keep_shard_pool = False
+        self._close_shard_pool()
+
+    def _process_inputs(self, args):
+        if self.settings['files-from']:
+            args = itertools.chain(args, self.read_files_from())
+        else:
+            args = args or ['-']
+        if self.settings['recursive-inputs']:
+            args = self.walk_inputs(args)
+        if self._overrides('map_line'):
+            self.process_inputs_map_reduce(list(args))
+            return
+        if self.settings['checkpoint'] and self.settings['incremental-index']:
+            raise AppException(
+                '--checkpoint and --incremental-index cannot be used together')
+        if self.settings['checkpoint']:
+            self.process_inputs_with_checkpoints(list(args))
+            return
+        if self.settings['incremental-index']:
+            self.process_inputs_incrementally(args)
+            return
+
+        jobs = self.settings['jobs'] or cliapp.parallel.cpu_count()
+        if jobs > 1:
+            args = list(args)
+        if jobs > 1 and len(args) > 1:
+            self.process_inputs_in_parallel(args, jobs)
+        else:
+            for arg in self.prefetch_inputs(args):
+                self.process_input(arg)
+
+    def read_files_from(self):
+        '''Generate names of input files from the ``files-from`` file.
+
+        The names are separated by newlines, or by NUL bytes if the
+        ``null`` setting is set. ``-`` means standard input. The names
+        are read lazily, as they are needed, unless the files are
+        processed in parallel.
+
+        '''
+
+        filename = self.settings['files-from']
+        if filename == '-':
+            f = sys.stdin
+        else:
+            f = open(filename)
+        try:
+            for name in cliapp.walk.read_names(f, null=self.settings['null']):
+                yield name
+        finally:
+            if f is not sys.stdin:
+                f.close()
+
+    def walk_inputs(self, args):
+        '''Return an iterator over input files, walking directories.
+
+        Directories are walked recursively and lazily, using the
+        ``input-include``, ``input-exclude``, and ``walk-jobs``
+        settings. See ``cliapp.walk_files``.
+
         '''
 
-        for arg in args or ['-']:
+        return cliapp.walk_files(
+            args,
+            include=self.settings['input-include'],
+            exclude=self.settings['input-exclude'],
+            jobs=self.settings['walk-jobs'])
+
+    def process_inputs_with_checkpoints(self, args):
+        '''Process input files, saving checkpoints, or resume doing so.
+
+        A checkpoint is saved to the file named by the ``checkpoint``
+        setting about every ``checkpoint-lines`` lines or
+        ``checkpoint-interval`` seconds, and after each input file.
+        It records the position in the inputs, the line counters, and
+        whatever ``checkpoint_state`` returns. It is removed when all
+        inputs have been processed.
+
+        With the ``resume`` setting, processing continues from the
+        last checkpoint of an interrupted run, with the same inputs:
+        processed files are skipped, the current file is read from
+        where the checkpoint was made, and ``restore_checkpoint_state``
+        is called with the saved state. If ``output`` names a plain
+        file, the output written after the checkpoint is removed, and
+        new output is appended. Chunked output continues from the
+        chunk that was being written. Compressed output can't be
+        continued, so resuming with it is an error.
+
+        '''
+
+        self._checkpoint = cliapp.Checkpoint(
+            self.settings['checkpoint'],
+            lines=self.settings['checkpoint-lines'],
+            seconds=self.settings['checkpoint-interval'])
+        first = 0
+        checkpoint = self._load_checkpoint()
+        if checkpoint is not None:
+            first = checkpoint['input_index']
+            if first < len(args) and checkpoint['offset'] > 0:
+                if args[first] != checkpoint['filename']:
+                    raise AppException(
+                        '%s: checkpoint is for input %s, not %s' %
+                        (self.settings['checkpoint'],
+                         checkpoint['filename'], args[first]))
+                self._resume_point = (checkpoint['offset'],
+                                      checkpoint['lineno'])
+                # process_input counts the file again.
+                checkpoint['fileno'] -= 1
+            self.fileno = checkpoint['fileno']
+            self.global_lineno = checkpoint['global_lineno']
+            self.restore_checkpoint_state(checkpoint['state'])
+            logging.info('resuming from input %d', first)
+
+        for i, arg in enumerate(self.prefetch_inputs(args[first:])):
+            self._input_index = first + i
             self.process_input(arg)
+            self._input_index = first + i + 1
+            self._input_name = None
+            self._input_offset = 0
+            self.save_checkpoint()
+
+        self._checkpoint.remove()
+        self._checkpoint = None
+
+    def _load_checkpoint(self):
+        if not self.settings['resume'] or not self.settings['checkpoint']:
+            return None
+        if not hasattr(self, '_loaded_checkpoint'):
+            self._loaded_checkpoint = cliapp.Checkpoint(
+                self.settings['checkpoint']).load()
+        return self._loaded_checkpoint
+
+    def save_checkpoint(self):
+        '''Save a checkpoint now.
+
+        This is called automatically by ``process_inputs`` when the
+        ``checkpoint`` setting is used. The output is flushed first, so
+        that the checkpoint does not get ahead of it.
+
+        '''
+
+        if self._checkpoint is None:
+            return
+        self.output.flush()
+        self._checkpoint.save({
+            'input_index': self._input_index,
+            'filename': self._input_name,
+            'offset': self._input_offset,
+            'fileno': self.fileno,
+            'lineno': self.lineno,
+            'global_lineno': self.global_lineno,
+            'output_size': self._output_size(),
+            'output_chunks': self._output_chunks(),
+            'state': self.checkpoint_state(),
+        })
+
+    def _output_chunks(self):
+        if self._chunked_output is None:
+            return None
+        return self._chunked_output.state()
+
+    def _output_size(self):
+        if self.output is sys.stdout:
+            return None
+        try:
+            return self.output.tell()
+        except (AttributeError, IOError, ValueError):
+            return None
+
+    def checkpoint_state(self):
+        '''Return application state to save in a checkpoint.
+
+        The state must be something that can be stored as JSON. It is
+        given to ``restore_checkpoint_state`` when resuming. The
+        default is None.
+
+        '''
+
+        return None
+
+    def restore_checkpoint_state(self, state):
+        '''Restore application state saved in a checkpoint.'''
+
+    def process_inputs_incrementally(self, args):
+        '''Process input files that have changed since the last run.
+
+        An index of processed files is kept in the file named by the
+        ``incremental-index`` setting (see ``cliapp.InputIndex``).
+        After a file is processed, ``input_result`` is called, and
+        its return value is saved in the index. When a file has not
+        changed since then, it is not processed again: instead,
+        ``replay_input_result`` is called with the saved result, and
+        ``fileno``, ``lineno``, and ``global_lineno`` are updated as if
+        the file had been read. Standard input and other files that
+        are not regular files are always processed.
+
+        The files are processed one by one.
+
+        '''
+
+        index = cliapp.InputIndex(
+            self.settings['incremental-index'],
+            use_hash=self.settings['incremental-hash'])
+        index.load()
+        try:
+            for arg in args:
+                if arg == '-' or not os.path.isfile(arg):
+                    self.process_input(arg)
+                    continue
+                cached, st = index.lookup(arg)
+                if cached is None:
+                    global_lineno = self.global_lineno
+                    self.process_input(arg)
+                    index.record(arg, st, self.global_lineno - global_lineno,
+                                 self.input_result(arg))
+                else:
+                    logging.debug('%s has not changed, skipping it', arg)
+                    lines, result = cached
+                    self.fileno += 1
+                    self.lineno = lines
+                    self.global_lineno += lines
+                    self.replay_input_result(arg, result)
+        finally:
+            index.close()
+
+    def input_result(self, name):
+        '''Return the result of processing an input file.
+
+        This is called after ``process_input`` when processing inputs
+        incrementally. The result must be something that can be stored
+        as JSON. The default is None.
+
+        '''
+
+        return None
+
+    def replay_input_result(self, name, result):
+        '''Use the saved result of an input file that has not changed.
+
+        This is called instead of ``process_input`` when processing
+        inputs incrementally, with what ``input_result`` returned when
+        the file was last processed.
+
+        '''
+
+    def prefetch_inputs(self, names):
+        '''Return an iterator over names, reading files ahead.
+
+        Files are read ahead as configured with the ``prefetch-files``
+        and ``prefetch-max`` settings. If ``prefetch-files`` is zero,
+        names are returned as is.
+
+        '''
+
+        depth = self.settings['prefetch-files']
+        if depth <= 0:
+            return names
+        return cliapp.Prefetcher(names, depth, self.settings['prefetch-max'])
+
+    def parallel_map(self, func, iterable, jobs=None, chunksize=None,
+                     ordered=True):
+        '''Generate func(item) for each item, in worker processes.
+
+        The workers are forked from the application when the first
+        result is asked for, so they inherit its settings, plugins,
+        hooks, logging configuration, and other state, and ``func``
+        may be any callable, such as a bound method or a closure.
+        Items and results must be picklable. What the workers log is logged by
+        the application process. See ``cliapp.ForkPool``.
+
+        ``jobs`` is the number of workers; None means the ``jobs``
+        setting, and zero one per CPU. With one job, func is called in
+        the application process. Items are sent to the workers
+        ``chunksize`` at a time; None means a size that gives each
+        worker a few chunks, if the number of items is known, or one.
+        If ``ordered`` is false, results are generated as soon as they
+        are ready, instead of in the order of the items. The workers
+        are stopped when all results have been generated, or when the
+        generator is closed or garbage collected before that.
+
+        '''
+
+        if jobs is None:
+            jobs = self.settings['jobs']
+        jobs = jobs or cliapp.parallel.cpu_count()
+        if jobs == 1:
+            return (func(item) for item in iterable)
+        if chunksize is None:
+            try:
+                chunksize = max(1, len(iterable) // (jobs * 4))
+            except TypeError:
+                chunksize = 1
+        return self._parallel_map_results(
+            func, iterable, jobs, chunksize, ordered)
+
+    def _parallel_map_results(self, func, iterable, jobs, chunksize,
+                              ordered):
+        # The pool is created here, rather than in parallel_map, so
+        # that it only exists while the generator runs, and is always
+        # stopped when the generator finishes, one way or another.
+        pool = cliapp.ForkPool(func, jobs, log_to_parent=True)
+        finished = False
+        try:
+            for result in pool.imap(iterable, chunksize, ordered):
+                yield result
+            finished = True
+        finally:
+            if finished:
+                pool.close()
+            else:
+                pool.terminate()
+
+    def process_inputs_in_parallel(self, args, jobs):
+        '''Process input files in parallel, in worker processes.
+
+        Each worker calls ``process_input`` for one file at a time,
+        largest files first, so that a big file started last doesn't
+        keep everyone waiting. Whatever ``process_input`` writes to
+        ``self.output`` is collected in a temporary file, and copied
+        to the real output in the order in which the files were named.
+        Any other changes a worker makes to the application object are
+        lost.
+
+        In a worker, ``fileno`` and ``lineno`` are the same as when
+        processing files one by one. However, ``global_lineno``
+        counts lines only from the beginning of the current file,
+        since the lengths of earlier files are not yet known. After
+        all files are processed, all three have the values they
+        would have after processing the files one by one.
+
+        Standard input (``-``) is read by the application process
+        itself.
+
+        '''
+
+        self.output.flush()
+        tempdir = tempfile.mkdtemp()
+        global_lineno = self.global_lineno
+        fileno = self.fileno
+        lineno = self.lineno
+        try:
+            with cliapp.parallel.ForkPool(self._process_input_in_worker,
+                                          jobs) as pool:
+                results = self._run_in_workers(
+                    pool, args, self._process_input_in_parent, tempdir)
+                for output_name, lines in results:
+                    if output_name is not None:
+                        with open(output_name) as f:
+                            shutil.copyfileobj(f, self.output)
+                        os.remove(output_name)
+                    # The number of lines in a file is also its last
+                    # lineno.
+                    global_lineno += lines
+                    lineno = lines
+        finally:
+            shutil.rmtree(tempdir)
+
+        self.fileno = fileno + len(args)
+        self.lineno = lineno
+        self.global_lineno = global_lineno
+
+    def _run_in_workers(self, pool, args, in_parent, tempdir):
+        # Generate the results of calling the pool's function with
+        # (fileno, name, tempdir) for each input file, in the order of
+        # args. The largest files are started first. Standard input can
+        # only be read by this process, so in_parent is called for it
+        # instead, when its turn comes.
+        fileno = self.fileno
+        order = sorted(range(len(args)),
+                       key=lambda i: self._input_size(args[i]),
+                       reverse=True)
+        results = {}
+        for i in order:
+            if args[i] != '-':
+                results[i] = pool.apply_async((fileno + i, args[i], tempdir))
+        for i, arg in enumerate(args):
+            if arg == '-':
+                yield in_parent((fileno + i, arg, tempdir))
+            else:
+                yield results.pop(i).get()
+
+    def _process_input_in_parent(self, work):
+        fileno, name, tempdir = work
+        self.fileno = fileno
+        self.global_lineno = 0
+        self.process_input(name)
+        return None, self.global_lineno
+
+    def _process_input_in_worker(self, work):
+        fileno, name, tempdir = work
+        fd, output_name = tempfile.mkstemp(dir=tempdir)
+        self.output = self.buffer_output(os.fdopen(fd, 'w'))
+        self._in_worker = True
+        self.fileno = fileno
+        self.global_lineno = 0
+        self.process_input(name)
+        self.output.close()
+        return output_name, self.global_lineno
+
+    def process_inputs_map_reduce(self, args):
+        '''Process input files with ``map_line``, ``combine``, ``reduce``.
+
+        Each line of input is passed to ``map_line``, which returns
+        key/value pairs. The values of each key are aggregated with
+        ``combine``, and finally passed to ``reduce``, once per key, in
+        sorted order of keys.
+
+        If the ``jobs`` setting is larger than one, files are mapped in
+        parallel, by that many worker processes, largest files first,
+        and values are combined in each worker, across all the files it
+        maps. Each worker keeps values for up to ``map-reduce-keys``
+        keys in memory; then it writes them to a temporary file as a
+        compact pickled batch, for the application process, and starts
+        a new batch. The last batch is written when all files have been
+        mapped. The batches are merged by key, a few values and a
+        limited number of batches at a time, so that ``reduce`` is
+        called for each key without keeping all keys in memory.
+
+        The ``checkpoint``, ``incremental-index``, and ``input-shards``
+        settings are not used. The attributes ``fileno``, ``lineno``, and
+        ``global_lineno`` are set as with
+        ``process_inputs_in_parallel``. Output written by ``map_line``
+        or ``combine`` in a worker is lost.
+
+        '''
+
+        jobs = self.settings['jobs'] or cliapp.parallel.cpu_count()
+        tempdir = tempfile.mkdtemp()
+        global_lineno = self.global_lineno
+        fileno = self.fileno
+        lineno = self.lineno
+        filenames = []
+        try:
+            if jobs > 1 and len(args) > 1:
+                with cliapp.parallel.ForkPool(self._map_input_in_worker,
+                                              jobs) as pool:
+                    results = self._run_in_workers(
+                        pool, args, self._map_input, tempdir)
+                    for lines in results:
+                        global_lineno += lines
+                        lineno = lines
+                    for names in pool.broadcast(None):
+                        filenames += names
+            else:
+                for i, arg in enumerate(args):
+                    lineno = self._map_input((fileno + i, arg, tempdir))
+                    global_lineno += lineno
+            filenames += self._finish_map()
+
+            self.fileno = fileno + len(args)
+            self.lineno = lineno
+            self.global_lineno = global_lineno
+            for key, values in cliapp.mapreduce.merge_batches(filenames):
+                self.reduce(key, values)
+        finally:
+            self._partials = None
+            shutil.rmtree(tempdir)
+
+    def _map_input_in_worker(self, work):
+        # None means all files have been mapped.
+        if work is None:
+            return self._finish_map()
+        if not self._in_worker:
+            self._in_worker = True
+            self.output = open(os.devnull, 'w')
+        return self._map_input(work)
+
+    def _map_input(self, work):
+        fileno, name, tempdir = work
+
+        def new_filename():
+            fd, filename = tempfile.mkstemp(dir=tempdir)
+            os.close(fd)
+            return filename
+
+        if self._partials is None:
+            self._partials = cliapp.mapreduce.Partials(
+                self.combine, new_filename,
+                max_keys=self.settings['map-reduce-keys'])
+        self.fileno = fileno
+        self.global_lineno = 0
+        self.process_input(name)
+        return self.global_lineno
+
+    def _finish_map(self):
+        partials, self._partials = self._partials, None
+        if partials is None:
+            return []
+        partials.flush()
+        return partials.filenames
+
+    def _input_size(self, name):
+        try:
+            return os.path.getsize(name)
+        except OSError:
+            return 0
 
     def open_input(self, name, mode='r'):
         '''Open an input file for reading.
@@ -619,43 +1330,787 @@ class Application(object):
         gets opened. It should allow reading. Some files should perhaps
         be opened in binary mode ('rb') instead of the default text mode.
 
+        Compressed files are decompressed on the fly, according to the
+        ``input-compression`` setting. With ``auto``, the compression
+        format (gzip, bzip2, or xz) is recognized from the first bytes
+        of the file, if the file is seekable. Decompression happens in
+        a separate process, in parallel with processing the data.
+
         '''
 
         if name == '-':
-            return sys.stdin
+            f = sys.stdin
+        else:
+            f = open(name, mode)
+
+        compression = self._input_compression(f)
+        if compression is None:
+            return f
+        return cliapp.compression.open_decompressed(f, compression, mode)
+
+    def open_input_at_line(self, name, lineno):
+        '''Open an input file, positioned at the start of a line.
+
+        Lines are numbered from 1. For a plain file, the line is found
+        with a line index (see ``cliapp.LineIndex``), which is made
+        first if it doesn't exist or is out of date, and which records
+        the position of every ``line-index-interval``'th line. Other
+        inputs are read from the beginning to find the line.
+
+        '''
+
+        f = self.open_input(name)
+        current = 1
+        if self._is_plain_file(name):
+            index = cliapp.LineIndex.open(
+                name, every=self.settings['line-index-interval'])
+            offset, current = index.find(lineno)
+            f.seek(offset)
+        while current < lineno and f.readline():
+            current += 1
+        return f
+
+    def _input_compression(self, f):
+        compression = self.settings['input-compression']
+        if compression == 'none':
+            return None
+        elif compression == 'auto':
+            return cliapp.compression.detect_compression(f)
         else:
-            return open(name, mode)
+            return compression
+
+    def _is_compressed(self, name):
+        if self.settings['input-compression'] == 'none':
+            return False
+        with open(name, 'rb') as f:
+            return self._input_compression(f) is not None
 
     def process_input(self, name, stdin=sys.stdin):
         '''Process a particular input file.
 
+        If the ``input-shards`` setting is larger than one, a regular
+        file of at least ``input-shard-min-size`` bytes is split into
+        that many parts, which are processed in parallel. See
+        ``process_input_in_shards``.
+
         The ``stdin`` argument is meant for unit test only.
 
         '''
 
+        # Shards are not used for map-reduce: the values combined by
+        # map_line in a shard worker would not get back to _partials.
+        shards = self.settings['input-shards']
+        if (shards > 1 and not self._in_worker and not self._checkpoint and
+                self._partials is None):
+            if self._can_shard(name) and self._input_size(name) >= \
+                    self.settings['input-shard-min-size']:
+                self.process_input_in_shards(name, shards)
+                return
+            logging.debug('not splitting %s into shards', name)
+
         self.fileno += 1
         self.lineno = 0
-        f = self.open_input(name)
+        offset = 0
+        if self._resume_point is not None:
+            offset, self.lineno = self._resume_point
+            self._resume_point = None
+        self._input_name = name
+        self._input_offset = offset
+
+        if self._can_use_grep(name):
+            self._process_input_with_grep(name)
+        elif self._use_mapping(name):
+            mapping = self.open_input_mapping(name)
+            try:
+                mapping.seek(offset)
+                self.process_input_mapping(name, mapping)
+            finally:
+                mapping.close()
+        else:
+            f = self.open_input(name)
+            if offset:
+                self._skip_input(f, offset)
+            self._process_lines(name, f)
+            if f != stdin:
+                f.close()
+
+    def _skip_input(self, f, offset):
+        try:
+            f.seek(offset)
+            return
+        except (AttributeError, IOError):
+            pass
+        # Pipes and decompressed inputs need to be read up to offset.
+        while offset > 0:
+            data = f.read(min(offset, 1024**2))
+            if not data:
+                break
+            offset -= len(data)
+
+    def _use_mapping(self, name):
+        if self._record_mode() != 'lines':
+            return False
+        if not (self.settings['mmap-input'] or
+                self._overrides('process_input_mapping')):
+            return False
+        # Empty files can't be mapped, but also have no lines.
+        return self._is_plain_file(name) and os.path.getsize(name) > 0
+
+    def open_input_mapping(self, name):
+        '''Return a read-only memory mapping of an input file.
+
+        The kernel is advised that the mapping will be read
+        sequentially, and soon, with ``madvise``. Python 2's ``mmap``
+        has no ``madvise`` method, so the C library's is called via
+        ``ctypes``; where that can't be done, no advice is given.
+
+        '''
+
+        with open(name, 'rb') as f:
+            mapping = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        _madvise(mapping, _MADV_SEQUENTIAL, _MADV_WILLNEED)
+        return mapping
+
+    def process_input_mapping(self, name, mapping):
+        '''Process an input file that has been memory mapped.
+
+        This is called by ``process_input`` instead of reading the file
+        with ``open_input``, if the ``mmap-input`` setting is set, or if
+        this method is redefined, and the input is a regular, non-empty
+        file. Standard input, pipes, and other files are read normally.
+
+        The default implementation processes the lines in the mapping,
+        as ``process_input`` does with an open file, but finds the
+        lines directly in the mapping, without going through Python's
+        file buffering. Applications that parse fixed formats can
+        redefine this method to use the mapping directly, for example
+        by slicing it.
+
+        '''
+
+        self._process_lines(name, _MappedLines(mapping))
+
+    def _process_lines(self, name, f, length=None):
+        '''Process lines from an open input file.
+
+        If ``length`` is not None, stop after the line that reaches
+        that many bytes from the current position.
+
+        '''
+
+        if self._record_mode() != 'lines':
+            self._process_records(name, f)
+            return
+        if self.input_filter:
+            self._process_filtered_lines(name, f, length)
+            return
+        if self._overrides('process_input_lines'):
+            self._process_line_blocks(name, f, length)
+            return
+        if self._checkpoint is not None:
+            self._process_lines_with_checkpoints(name, f)
+            return
+
+        pos = 0
+        for line in f:
+            self.global_lineno += 1
+            self.lineno += 1
+            self.process_input_line(name, line)
+            if length is not None:
+                pos += len(line)
+                if pos >= length:
+                    break
+
+    def _record_mode(self):
+        return self.settings['input-records']
+
+    def open_input_records(self, f):
+        '''Return a ``cliapp.RecordReader`` for an open input file.
+
+        The reader is set up according to the ``input-records``,
+        ``input-record-size``, ``input-record-delimiter``, and
+        ``input-record-byteorder`` settings.
+
+        '''
+
+        delimiter = self.settings['input-record-delimiter']
+        try:
+            delimiter = delimiter.decode('string_escape')
+        except ValueError as e:
+            raise AppException('Bad --input-record-delimiter: %s' % e)
+        return RecordReader(
+            f, self._record_mode(),
+            size=self.settings['input-record-size'],
+            delimiter=delimiter,
+            byteorder=self.settings['input-record-byteorder'],
+            block_size=self.input_block_size)
+
+    def _process_records(self, name, f):
+        reader = self.open_input_records(f)
+        offset = self._input_offset
+        for records in reader.blocks():
+            for record in records:
+                self.global_lineno += 1
+                self.lineno += 1
+                self.process_input_record(name, record)
+            if self._checkpoint is not None:
+                self._input_offset = offset + reader.offset
+                if self._checkpoint.due(len(records)):
+                    self.save_checkpoint()
+
+    def _input_filter_regexps(self):
+        patterns = self.input_filter
+        if isinstance(patterns, basestring) or hasattr(patterns, 'search'):
+            patterns = [patterns]
+        return [re.compile(p, re.MULTILINE) if isinstance(p, basestring)
+                else p
+                for p in patterns]
+
+    def _process_filtered_lines(self, name, f, length):
+        # Search whole blocks of input for the filter, and only look
+        # at the lines that match.
+        regexps = self._input_filter_regexps()
+        remaining = length
+        while remaining is None or remaining > 0:
+            size = self.input_block_size
+            if remaining is not None:
+                size = min(size, remaining)
+            block = f.read(size)
+            if not block:
+                break
+            if not block.endswith('\n'):
+                block += f.readline()
+            if remaining is not None:
+                remaining -= len(block)
+
+            lineno = self.lineno
+            global_lineno = self.global_lineno
+            counted = 0
+            for start in self._matching_line_starts(regexps, block):
+                end = block.find('\n', start) + 1 or len(block)
+                newlines = block.count('\n', counted, start) + 1
+                self.lineno += newlines
+                self.global_lineno += newlines
+                counted = end
+                self.process_input_line(name, block[start:end])
+
+            lines = block.count('\n') + (not block.endswith('\n'))
+            self.lineno = lineno + lines
+            self.global_lineno = global_lineno + lines
+            if self._checkpoint is not None:
+                self._input_offset += len(block)
+                if self._checkpoint.due(lines):
+                    self.save_checkpoint()
+
+    def _matching_line_starts(self, regexps, block):
+        if len(regexps) == 1:
+            return self._search_lines(regexps[0], block)
+        starts = set()
+        for regexp in regexps:
+            starts.update(self._search_lines(regexp, block))
+        return sorted(starts)
+
+    def _search_lines(self, regexp, block):
+        pos = 0
+        while True:
+            m = regexp.search(block, pos)
+            if m is None:
+                break
+            start = block.rfind('\n', 0, m.start()) + 1
+            yield start
+            pos = block.find('\n', m.start()) + 1
+            if pos == 0:
+                break
+
+    def _process_input_with_grep(self, name):
+        # Let grep find the matching lines. Count all lines separately,
+        # since grep doesn't.
+        size = os.path.getsize(name)
+        if size == 0:
+            return
+        lines = self._count_lines_in_range(name, 0, size)
+        with open(name, 'rb') as f:
+            f.seek(size - 1)
+            ends_with_newline = f.read(1) == '\n'
+
+        argv = ['grep', '-a', '-n', '-P']
+        regexps = self._input_filter_regexps()
+        if regexps[0].flags & re.IGNORECASE:
+            argv.append('-i')
+        argv += ['-e', '|'.join('(?:%s)' % r.pattern for r in regexps),
+                 '--', name]
+        env = dict(os.environ, LC_ALL='C')
+        p = _popen(argv, stdout=subprocess.PIPE, stderr=subprocess.PIPE,
+                   close_fds=True, env=env)
+        global_lineno = self.global_lineno
+        for line in p.stdout:
+            number, line = line.split(':', 1)
+            self.lineno = int(number)
+            self.global_lineno = global_lineno + self.lineno
+            if self.lineno == lines and not ends_with_newline:
+                # grep adds a newline to the last line.
+                line = line[:-1]
+            self.process_input_line(name, line)
+        err = p.stderr.read()
+        p.stdout.close()
+        p.stderr.close()
+        if p.wait() > 1:
+            raise AppException('%s: grep failed: %s' % (name, err.strip()))
+        self.lineno = lines
+        self.global_lineno = global_lineno + lines
+
+    def _can_use_grep(self, name):
+        if not self.settings['input-filter-grep'] or not self.input_filter:
+            return False
+        if self._record_mode() != 'lines':
+            return False
+        if self._checkpoint is not None or not self._is_plain_file(name):
+            return False
+        # grep matches each line separately, so MULTILINE and DOTALL
+        # make no difference, and IGNORECASE can be passed on. Other
+        # flags need Python to do the matching.
+        allowed = re.IGNORECASE | re.MULTILINE | re.DOTALL
+        flags = set()
+        for regexp in self._input_filter_regexps():
+            if regexp.flags & ~allowed:
+                return False
+            flags.add(regexp.flags & re.IGNORECASE)
+        return len(flags) == 1
+
+    def _process_lines_with_checkpoints(self, name, f):
+        checkpoint = self._checkpoint
+        # Only look at the clock every so often, it's not free.
+        step = min(checkpoint.lines or 1000, 1000)
+        left = step
+        pos = self._input_offset
         for line in f:
             self.global_lineno += 1
             self.lineno += 1
             self.process_input_line(name, line)
-        if f != stdin:
-            f.close()
+            pos += len(line)
+            left -= 1
+            if left == 0:
+                left = step
+                if checkpoint.due(step):
+                    self._input_offset = pos
+                    self.save_checkpoint()
+
+    def _process_line_blocks(self, name, f, length):
+        while length is None or length > 0:
+            lines = f.readlines(self.input_block_size)
+            if not lines:
+                break
+            if length is not None:
+                for i, line in enumerate(lines):
+                    length -= len(line)
+                    if length <= 0:
+                        del lines[i + 1:]
+                        break
+            first_lineno = self.lineno + 1
+            self.lineno += len(lines)
+            self.global_lineno += len(lines)
+            self.process_input_lines(name, lines, first_lineno)
+            if self._checkpoint is not None:
+                self._input_offset += sum(len(line) for line in lines)
+                if self._checkpoint.due(len(lines)):
+                    self.save_checkpoint()
+
+    def _overrides(self, method_name):
+        '''Has the method been redefined for this application?'''
+        default = getattr(Application, method_name).im_func
+        method = getattr(self, method_name)
+        return getattr(method, 'im_func', None) is not default
+
+    def _is_plain_file(self, name):
+        # Byte offsets and mappings only make sense for a plain local
+        # file, read as is by the default open_input.
+        return (name != '-' and
+                os.path.isfile(name) and
+                not self._overrides('open_input') and
+                not self._is_compressed(name))
+
+    def _can_shard(self, name):
+        return (self._is_plain_file(name) and
+                self._record_mode() == 'lines' and
+                not self._overrides('process_input_mapping'))
+
+    def process_input_in_shards(self, name, shards):
+        '''Process a large input file in parallel, in parts.
+
+        The file is split into ``shards`` byte ranges of about equal
+        size, each ending at the end of a line. Each range is processed
+        in a separate worker process, which calls
+        ``process_input_line`` for each line in its range. Output
+        written to ``self.output`` is merged in order, as with
+        ``process_inputs_in_parallel``.
+
+        To give each worker correct ``lineno`` and ``global_lineno``
+        values, lines in each range are counted first, in parallel,
+        and the line numbers where each range starts computed from
+        the counts. The counting is cheap compared to processing,
+        and the second pass usually reads the file from the cache.
+
+        Within ``process_inputs``, the worker processes are forked for
+        the first file that is split, and used for all later ones, so
+        they don't see changes the application makes to itself after
+        that, other than to ``fileno``, ``lineno``, and
+        ``global_lineno``.
+
+        '''
+
+        self.fileno += 1
+        self.output.flush()
+        ranges = self._shard_ranges(name, shards)
+        tempdir = tempfile.mkdtemp()
+        pool = self._get_shard_pool(shards)
+        try:
+            counts = [pool.apply_async(('count', name, start, end))
+                      for start, end in ranges]
+
+            results = []
+            lineno = 0
+            for (start, end), count in zip(ranges, counts):
+                results.append(pool.apply_async(
+                    ('process', name, start, end, self.fileno, lineno,
+                     self.global_lineno + lineno, tempdir)))
+                lineno += count.get()
+
+            for result in results:
+                output_name = result.get()
+                with open(output_name) as f:
+                    shutil.copyfileobj(f, self.output)
+                os.remove(output_name)
+        except BaseException:
+            self._close_shard_pool(failed=True)
+            raise
+        finally:
+            shutil.rmtree(tempdir)
+        if not self._keep_shard_pool:
+            self._close_shard_pool()
+
+        self.lineno = lineno
+        self.global_lineno += lineno
+
+    def _get_shard_pool(self, shards):
+        if self._shard_pool is None:
+            self._shard_pool = cliapp.parallel.ForkPool(
+                self._process_shard_in_worker, shards)
+        return self._shard_pool
+
+    def _close_shard_pool(self, failed=False):
+        pool = self._shard_pool
+        if pool is None:
+            return
+        self._shard_pool = None
+        if failed:
+            pool.terminate()
+        else:
+            pool.close()
+
+    def _shard_ranges(self, name, shards):
+        size = os.path.getsize(name)
+        offsets = [0]
+        with open(name, 'rb') as f:
+            for i in range(1, shards):
+                offset = max(size * i // shards, offsets[-1])
+                if offset > 0:
+                    # Move offset to just after the end of the line
+                    # that contains the byte before it.
+                    f.seek(offset - 1)
+                    f.readline()
+                    offset = f.tell()
+                offsets.append(min(offset, size))
+        offsets.append(size)
+        return [(start, end)
+                for start, end in zip(offsets, offsets[1:])
+                if start < end]
+
+    def _process_shard_in_worker(self, work):
+        if work[0] == 'count':
+            _, name, start, end = work
+            return self._count_lines_in_range(name, start, end)
+
+        _, name, start, end, fileno, lineno, global_lineno, tempdir = work
+        fd, output_name = tempfile.mkstemp(dir=tempdir)
+        self.output = self.buffer_output(os.fdopen(fd, 'w'))
+        # The worker may have been forked for an earlier file.
+        self.fileno = fileno
+        self.lineno = lineno
+        self.global_lineno = global_lineno
+        if self._use_mapping(name):
+            f = self.open_input_mapping(name)
+            f.seek(start)
+            self._process_lines(name, _MappedLines(f), end - start)
+        else:
+            f = self.open_input(name)
+            f.seek(start)
+            self._process_lines(name, f, end - start)
+        f.close()
+        self.output.close()
+        return output_name
+
+    def _count_lines_in_range(self, name, start, end):
+        count = 0
+        last = ''
+        with open(name, 'rb') as f:
+            f.seek(start)
+            remaining = end - start
+            while remaining > 0:
+                data = f.read(min(1024**2, remaining))
+                if not data:
+                    break  # pragma: no cover
+                count += data.count('\n')
+                remaining -= len(data)
+                last = data[-1]
+        if last and last != '\n':
+            # Last line of the file has no newline at the end.
+            count += 1
+        return count
+
+    def map_line(self, filename, line):
+        '''Return key/value pairs for one line of input.
+
+        Redefine this, and ``reduce`` and possibly ``combine``, to
+        aggregate values over all input lines, in parallel if the
+        ``jobs`` setting is larger than one; see
+        ``process_inputs_map_reduce``. The result may be any iterable
+        of pairs, such as a list or a generator. Keys must be sortable,
+        and keys and values must be picklable.
+
+        '''
+
+        return []
+
+    def combine(self, key, values):
+        '''Combine a list of values of a key into one value.
+
+        This is called in worker processes, to keep partial results
+        small, and may be called again with values it has returned
+        itself. A key with a single value may not be combined at all.
+
+        The default implementation adds the values together, as for
+        counting or computing totals.
+
+        '''
+
+        return sum(values)
+
+    def reduce(self, key, values):
+        '''Process the final values of one key.
+
+        This is called in the application process, once for each key
+        returned by ``map_line``, in sorted order of keys, with a list
+        of partial results from ``combine``.
+
+        The default implementation combines the values and writes the
+        key and the result to the output, separated by a tab.
+
+        '''
+
+        self.output.write('%s\t%s\n' % (key, self.combine(key, values)))
 
     def process_input_line(self, filename, line):
         '''Process one line of the input file.
 
+        If the ``input_filter`` attribute is set, this is only called
+        for lines that match it. It may be a regular expression, as a
+        string or compiled, or a list of them. Lines that match any of
+        them are processed. The input is searched in large blocks, so
+        lines that don't match cost very little. Patterns given as
+        strings are compiled with ``re.MULTILINE``, so that ``^`` and
+        ``$`` match at the beginning and end of each line; use that
+        flag when compiling patterns that use them. The line counters
+        are correct for each matching line. ``process_input_lines`` is
+        not used when there is a filter.
+
+        If the ``input-filter-grep`` setting is set, the filter is
+        applied by running ``grep -P``, in parallel with the
+        application, when the input is a plain file and the patterns
+        have no flags other than ``re.IGNORECASE``. Perl regular
+        expressions are mostly the same as Python ones.
+
         Applications that are line-oriented can redefine only this method in
         a subclass, and should not need to care about the other methods.
 
+        The default implementation passes the line to ``map_line``,
+        when processing inputs with ``process_inputs_map_reduce``.
+
+        '''
+
+        if self._partials is not None:
+            self._partials.add(self.map_line(filename, line))
+
+    def process_input_record(self, filename, record):
+        '''Process one binary record of the input file.
+
+        This is called instead of ``process_input_line`` if the
+        ``input-records`` setting is other than ``lines``. The record
+        is a ``memoryview`` of part of a large buffer the input is read
+        into, so that records are not copied one by one; use
+        ``record.tobytes()`` to get a string. Buffers are not reused,
+        so the record may be kept. ``lineno`` and ``global_lineno``
+        count records instead of lines. See ``cliapp.RecordReader``
+        for the record formats.
+
+        The default implementation does nothing.
+
+        '''
+
+    def process_input_lines(self, filename, lines, first_lineno):
+        '''Process a block of lines of the input file.
+
+        ``lines`` is a list of consecutive lines, read in one large
+        chunk of about ``input_block_size`` bytes, and ``first_lineno``
+        is the line number of the first one in the file. The attributes
+        ``lineno`` and ``global_lineno`` have already been updated for
+        the whole block, and refer to its last line.
+
+        Applications that process many short lines can redefine this
+        method instead of ``process_input_line``, to avoid the cost of
+        a method call and counter updates for every line. It is only
+        called if it is redefined. The default implementation calls
+        ``process_input_line`` for each line.
+
         '''
 
+        self.global_lineno -= self.lineno - first_lineno + 1
+        self.lineno = first_lineno - 1
+        for line in lines:
+            self.global_lineno += 1
+            self.lineno += 1
+            self.process_input_line(filename, line)
+
     def runcmd(self, *args, **kwargs):  # pragma: no cover
+        self.add_child_settings(kwargs)
         return cliapp.runcmd(*args, **kwargs)
 
     def runcmd_unchecked(self, *args, **kwargs):  # pragma: no cover
+        self.add_child_settings(kwargs)
         return cliapp.runcmd_unchecked(*args, **kwargs)
 
+    def add_child_settings(self, kwargs):
+        '''Add keyword arguments for runcmd from settings.
+
+        This sets the resource limits and scheduling of external
+        commands run via the ``runcmd`` and ``runcmd_unchecked``
+        methods from the child-* settings, and the host-wide admission
+        control, unless the caller gives them explicitly. The
+        ``cliapp.runcmd`` function does not look at settings.
+
+        '''
+
+        rlimits = {}
+        for name, rlimit in [('child-max-cpu-time', 'cpu'),
+                             ('child-max-memory', 'as'),
+                             ('child-max-open-files', 'nofile')]:
+            if self.settings[name]:
+                rlimits[rlimit] = self.settings[name]
+        if rlimits:
+            kwargs.setdefault('rlimits', rlimits)
+
+        if self.settings['child-nice']:
+            kwargs.setdefault('nice', self.settings['child-nice'])
+        if self.settings['child-ionice-class'] != 'none':
+            kwargs.setdefault(
+                'ionice_class', self.settings['child-ionice-class'])
+            kwargs.setdefault(
+                'ionice_priority', self.settings['child-ionice-priority'])
+        if self.settings['child-cpu-affinity']:
+            kwargs.setdefault(
+                'cpu_affinity', self.settings['child-cpu-affinity'])
+
+        admission = self.get_admission_controller()
+        if admission is not None:
+            kwargs.setdefault('admission', admission)
+
+    def get_admission_controller(self):
+        '''Return the host-wide admission controller for runcmd, or None.
+
+        The controller is created from the max-host-commands,
+        max-host-load, max-memory-pressure, and admission-dir settings,
+        and is shared by all instances of the program on the host.
+
+        '''
+
+        slots = self.settings['max-host-commands']
+        max_load = self.settings['max-host-load']
+        max_pressure = self.settings['max-memory-pressure']
+        if not (slots or max_load or max_pressure):
+            return None
+
+        if getattr(self, '_admission_controller', None) is None:
+            self._admission_controller = cliapp.AdmissionController(
+                self.settings.progname or 'cliapp',
+                slots=slots,
+                directory=self.settings['admission-dir'] or None,
+                max_load=max_load,
+                max_memory_pressure=max_pressure)
+        return self._admission_controller
+
     def dump_memory_profile(self, msg):  # pragma: no cover
         self.memory_profile_dumper.dump_memory_profile(msg)
+
+
+# The values of these are the same on Linux and the BSDs.
+_MADV_SEQUENTIAL = 2
+_MADV_WILLNEED = 3
+
+# The C library, once _madvise has loaded it, or False if it can't be.
+_libc = None
+
+
+def _madvise(mapping, *advice):
+    # Give the kernel advice about a memory mapping, and return True,
+    # or return False if that isn't possible. The address of the
+    # mapping is found via the buffer interface, which read-only
+    # mappings support.
+    global _libc
+    if _libc is None:
+        name = ctypes.util.find_library('c')
+        try:
+            _libc = ctypes.CDLL(name) if name else False
+        except OSError:  # pragma: no cover
+            _libc = False
+    if not _libc or not hasattr(_libc, 'madvise'):  # pragma: no cover
+        return False
+
+    address = ctypes.c_void_p()
+    size = ctypes.c_ssize_t()
+    try:
+        ctypes.pythonapi.PyObject_AsReadBuffer(
+            ctypes.py_object(mapping), ctypes.byref(address),
+            ctypes.byref(size))
+    except (AttributeError, TypeError):  # pragma: no cover
+        return False
+    for value in advice:
+        _libc.madvise(address, ctypes.c_size_t(size.value), value)
+    return True
+
+
+class _MappedLines(object):
+
+    '''Read lines from a memory mapping, like from a file.
+
+    ``mmap.readline`` finds the end of each line in the mapping, and
+    copies the line out, without Python's file buffering in between.
+
+    '''
+
+    def __init__(self, mapping):
+        self._readline = mapping.readline
+        self.readline = mapping.readline
+        self.read = mapping.read
+
+    def __iter__(self):
+        return iter(self._readline, '')
+
+    def readlines(self, sizehint):
+        lines = []
+        size = 0
+        while size < sizehint:
+            line = self._readline()
+            if not line:
+                break
+            lines.append(line)
+            size += len(line)
+        return lines
@@ -15,8 +15,14 @@
 # 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
 
 
+import multiprocessing
+import os
+import re
+import resource
+import shutil
 import StringIO
 import sys
+import tempfile
 import unittest
 
 import cliapp
@@ -110,6 +116,29 @@ class ApplicationTests(unittest.TestCase):
         self.app.run(args=['--output=/dev/null'])
         self.assertEqual(self.app.output.name, '/dev/null')
 
+    def test_run_closes_output_file(self):
+        self.app.process_args = lambda args: None
+        self.app.run(args=['--output=/dev/null'])
+        self.assertTrue(self.app.output.closed)
+
+    def test_run_buffers_output_if_requested(self):
+        tempdir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, tempdir)
+        filename = os.path.join(tempdir, 'output')
+
+        def process_args(args):
+            for i in range(1000):
+                self.app.output.write('%d\n' % i)
+
+        self.app.process_args = process_args
+        self.app.run(args=['--output', filename,
+                           '--output-buffer-size=100', '--output-thread'])
+        self.assertTrue(isinstance(self.app.output, cliapp.OutputWriter))
+        self.assertTrue(self.app.output.closed)
+        with open(filename) as f:
+            self.assertEqual(f.read(),
+                             ''.join('%d\n' % i for i in range(1000)))
+
     def test_run_calls_parse_args(self):
         class DummyOptions(object):
             def __init__(self):
@@ -276,6 +305,85 @@ class ApplicationTests(unittest.TestCase):
                           (2, 3, 1),
                           (2, 4, 2)])
 
+    def test_adds_no_child_settings_by_default(self):
+        kwargs = {}
+        self.app.add_child_settings(kwargs)
+        self.assertEqual(kwargs, {})
+
+    def test_adds_child_settings_for_runcmd(self):
+        self.app.parse_args(
+            ['--child-nice=5', '--child-max-open-files=100',
+             '--child-ionice-class=idle', '--child-cpu-affinity=0-1'])
+        kwargs = {'nice': 1}
+        self.app.add_child_settings(kwargs)
+        self.assertEqual(
+            kwargs,
+            {
+                'nice': 1,
+                'rlimits': {'nofile': 100},
+                'ionice_class': 'idle',
+                'ionice_priority': 4,
+                'cpu_affinity': '0-1',
+            })
+
+    def test_has_no_admission_controller_by_default(self):
+        self.assertEqual(self.app.get_admission_controller(), None)
+
+    def test_creates_admission_controller_from_settings(self):
+        self.app.settings.progname = 'foo'
+        self.app.parse_args(
+            ['--max-host-commands=3', '--max-host-load=1.5',
+             '--admission-dir=/tmp'])
+        controller = self.app.get_admission_controller()
+        self.assertEqual(controller.name, 'foo')
+        self.assertEqual(controller.slots, 3)
+        self.assertEqual(controller.max_load, 1.5)
+        self.assertEqual(controller.directory, '/tmp')
+        self.assertEqual(self.app.get_admission_controller(), controller)
+
+    def test_process_input_lines_gets_blocks_of_lines(self):
+        blocks = []
+
+        class Foo(cliapp.Application):
+
+            input_block_size = 10
+
+            def open_input(self, name, mode=None):
+                return StringIO.StringIO(''.join('%s%d\n' % (name, i)
+                                                 for i in range(5)))
+
+            def process_input_lines(self, name, lines, first_lineno):
+                blocks.append(
+                    (lines, first_lineno, self.lineno, self.global_lineno))
+
+        foo = Foo()
+        foo.run(args=['foo', 'bar'])
+        self.assertEqual(
+            [''.join(lines) for lines, _, _, _ in blocks],
+            ['foo0\nfoo1\n', 'foo2\nfoo3\n', 'foo4\n',
+             'bar0\nbar1\n', 'bar2\nbar3\n', 'bar4\n'])
+        self.assertEqual(
+            [counters for _, counters, _, _ in blocks],
+            [1, 3, 5, 1, 3, 5])
+        self.assertEqual(
+            [(lineno, global_lineno) for _, _, lineno, global_lineno
+             in blocks],
+            [(2, 2), (4, 4), (5, 5), (2, 7), (4, 9), (5, 10)])
+
+    def test_default_process_input_lines_calls_process_input_line(self):
+        counters = []
+
+        class Foo(cliapp.Application):
+
+            def process_input_line(self, name, line):
+                counters.append((self.lineno, self.global_lineno, line))
+
+        foo = Foo()
+        foo.lineno = 4
+        foo.global_lineno = 14
+        foo.process_input_lines('foo', ['a\n', 'b\n'], 3)
+        self.assertEqual(counters, [(3, 13, 'a\n'), (4, 14, 'b\n')])
+
     def test_run_prints_out_error_for_appexception(self):
         def raise_error(args):
             raise cliapp.AppException('xxx')
@@ -307,6 +415,703 @@ class ApplicationTests(unittest.TestCase):
         self.assertRaises(SystemExit, self.app.run, [], stderr=f, log=devnull)
 
 
+class ParallelInputTests(unittest.TestCase):
+
+    def setUp(self):
+        self.tempdir = tempfile.mkdtemp()
+        self.filenames = []
+        for i, count in enumerate([1, 5, 2, 3]):
+            filename = os.path.join(self.tempdir, 'input%d' % i)
+            with open(filename, 'w') as f:
+                f.write(''.join('%d-%d\n' % (i, j) for j in range(count)))
+            self.filenames.append(filename)
+        self.output = os.path.join(self.tempdir, 'output')
+
+    def tearDown(self):
+        shutil.rmtree(self.tempdir)
+
+    def run_app(self, jobs):
+
+        class App(cliapp.Application):
+
+            def process_input_line(self, name, line):
+                self.output.write(
+                    '%d %d %s' % (self.fileno, self.lineno, line))
+
+            def cleanup(self):
+                self.output.write('%d %d %d\n' % (
+                    self.fileno, self.lineno, self.global_lineno))
+
+        app = App()
+        app.run(args=['--jobs=%d' % jobs, '--output', self.output] +
+                self.filenames)
+        app.output.close()
+        with open(self.output) as f:
+            return f.read()
+
+    def test_parallel_output_is_same_as_serial(self):
+        serial = self.run_app(1)
+        self.assertEqual(serial.splitlines()[-1], '4 3 11')
+        self.assertEqual(self.run_app(3), serial)
+
+    def test_raises_worker_errors_in_parent(self):
+
+        class App(cliapp.Application):
+
+            def process_input_line(self, name, line):
+                raise cliapp.AppException('bad line %s' % line)
+
+        app = App()
+        app.settings['jobs'] = 2
+        app.output = StringIO.StringIO()
+        self.assertRaises(
+            cliapp.AppException, app.process_inputs, self.filenames)
+
+
+class ShardedInputTests(unittest.TestCase):
+
+    def setUp(self):
+        self.tempdir = tempfile.mkdtemp()
+        self.input = os.path.join(self.tempdir, 'input')
+        with open(self.input, 'w') as f:
+            f.write(''.join('line %d\n' % i for i in range(1000)))
+            f.write('no newline')
+        self.output = os.path.join(self.tempdir, 'output')
+
+    def tearDown(self):
+        shutil.rmtree(self.tempdir)
+
+    def run_app(self, *args):
+
+        class App(cliapp.Application):
+
+            def process_input_line(self, name, line):
+                self.output.write('%d %d %d %s\n' % (
+                    self.fileno, self.lineno, self.global_lineno,
+                    line.rstrip('\n')))
+
+            def cleanup(self):
+                self.output.write('%d %d %d\n' % (
+                    self.fileno, self.lineno, self.global_lineno))
+
+        app = App()
+        app.run(args=['--output', self.output] + list(args))
+        app.output.close()
+        with open(self.output) as f:
+            return f.read()
+
+    def test_sharded_output_is_same_as_serial(self):
+        serial = self.run_app(self.input, self.input)
+        self.assertEqual(serial.splitlines()[-1], '2 1001 2002')
+        sharded = self.run_app('--input-shards=7', '--input-shard-min-size=0',
+                               self.input, self.input)
+        self.assertEqual(sharded, serial)
+
+    def test_shares_one_pool_between_files(self):
+        pools = []
+
+        class App(cliapp.Application):
+
+            def _get_shard_pool(self, shards):
+                pool = cliapp.Application._get_shard_pool(self, shards)
+                pools.append(pool)
+                return pool
+
+        app = App()
+        app.run(args=['--output', self.output, '--input-shards=3',
+                      '--input-shard-min-size=0', self.input, self.input])
+        self.assertEqual(len(pools), 2)
+        self.assertTrue(pools[0] is pools[1])
+        self.assertEqual(app._shard_pool, None)
+
+    def test_does_not_shard_small_files(self):
+
+        class App(cliapp.Application):
+
+            def process_input_in_shards(self, name, shards):
+                raise AssertionError('file was sharded')
+
+        app = App()
+        app.run(args=['--output', self.output, '--input-shards=3',
+                      '--input-shard-min-size=1M', self.input])
+
+    def test_sharded_blocks_cover_all_lines_once(self):
+
+        class App(cliapp.Application):
+
+            input_block_size = 100
+
+            def process_input_lines(self, name, block, first_lineno):
+                self.output.write('%d %d\n' % (first_lineno, len(block)))
+
+        app = App()
+        app.run(args=['--output', self.output, '--input-shards=3',
+                      '--input-shard-min-size=0', self.input])
+        app.output.close()
+        with open(self.output) as f:
+            expected = 1
+            for line in f:
+                first_lineno, count = map(int, line.split())
+                self.assertEqual(first_lineno, expected)
+                expected += count
+        self.assertEqual(expected, 1002)
+
+    def test_splits_file_at_line_boundaries(self):
+        app = cliapp.Application()
+        ranges = app._shard_ranges(self.input, 7)
+        self.assertEqual(len(ranges), 7)
+        with open(self.input) as f:
+            data = f.read()
+        self.assertEqual(ranges[0][0], 0)
+        self.assertEqual(ranges[-1][1], len(data))
+        for (start, end), (next_start, _) in zip(ranges, ranges[1:]):
+            self.assertEqual(end, next_start)
+            self.assertEqual(data[end - 1], '\n')
+
+    def test_does_not_shard_stdin(self):
+        app = cliapp.Application()
+        self.assertFalse(app._can_shard('-'))
+        self.assertFalse(app._can_shard('/dev/null'))
+        self.assertTrue(app._can_shard(self.input))
+
+
+class FilteredInputTests(unittest.TestCase):
+
+    def setUp(self):
+        self.tempdir = tempfile.mkdtemp()
+        self.lines = ['line %d %s\n' % (i, 'foo' if i % 7 == 0 else 'bar')
+                      for i in range(200)]
+        self.lines.append('last foo')
+        self.input = os.path.join(self.tempdir, 'input')
+        with open(self.input, 'w') as f:
+            f.write(''.join(self.lines))
+
+    def tearDown(self):
+        shutil.rmtree(self.tempdir)
+
+    def process(self, input_filter, *args, **kwargs):
+
+        class App(cliapp.Application):
+
+            input_block_size = kwargs.get('block_size', 100)
+
+            def process_input_line(self, name, line):
+                self.output.write(
+                    '%d %d %r\n' % (self.lineno, self.global_lineno, line))
+
+            def cleanup(self):
+                self.output.write(
+                    '%d %d\n' % (self.lineno, self.global_lineno))
+
+        app = App()
+        app.input_filter = input_filter
+        app.settings.parse_args(list(args))
+        app.output = StringIO.StringIO()
+        app.process_inputs([self.input, self.input])
+        app.cleanup()
+        return app.output.getvalue().splitlines()
+
+    def expected(self, *words):
+        result = []
+        for offset in [0, len(self.lines)]:
+            for i, line in enumerate(self.lines):
+                if any(word in line for word in words):
+                    result.append(
+                        '%d %d %r' % (i + 1, offset + i + 1, line))
+        result.append('%d %d' % (len(self.lines), 2 * len(self.lines)))
+        return result
+
+    def test_passes_only_matching_lines(self):
+        self.assertEqual(self.process('foo'), self.expected('foo'))
+
+    def test_works_with_any_block_size(self):
+        for size in [1, 7, 10**6]:
+            self.assertEqual(self.process('foo', block_size=size),
+                             self.expected('foo'))
+
+    def test_matches_any_of_several_patterns(self):
+        self.assertEqual(
+            self.process([re.compile('foo'), r'^line 1\b']),
+            self.expected('foo', 'line 1 '))
+
+    def test_filters_shards_and_mapped_inputs(self):
+        self.assertEqual(
+            self.process('foo', '--input-shards=3',
+                         '--input-shard-min-size=0', '--mmap-input'),
+            self.expected('foo'))
+
+    def test_filters_with_grep(self):
+        self.assertEqual(
+            self.process(['foo', r'^line 1\b'], '--input-filter-grep'),
+            self.expected('foo', 'line 1 '))
+
+
+class RecordInputTests(unittest.TestCase):
+
+    def setUp(self):
+        self.tempdir = tempfile.mkdtemp()
+        self.inputs = []
+        for i in range(2):
+            filename = os.path.join(self.tempdir, 'input%d' % i)
+            with open(filename, 'w') as f:
+                f.write(''.join('%d:%02d\0' % (i, j) for j in range(40)))
+            self.inputs.append(filename)
+
+    def tearDown(self):
+        shutil.rmtree(self.tempdir)
+
+    def process(self, *args):
+
+        class App(cliapp.Application):
+
+            input_block_size = 16
+
+            def process_input_record(self, name, record):
+                self.output.write('%d %d %d %s\n' % (
+                    self.fileno, self.lineno, self.global_lineno,
+                    record.tobytes()))
+
+        app = App()
+        app.settings.parse_args(list(args))
+        app.output = StringIO.StringIO()
+        app.process_inputs(self.inputs)
+        return app.output.getvalue().splitlines()
+
+    def expected(self):
+        return ['%d %d %d %d:%02d' % (i + 1, j + 1, i * 40 + j + 1, i, j)
+                for i in range(2)
+                for j in range(40)]
+
+    def test_processes_delimited_records(self):
+        self.assertEqual(
+            self.process('--input-records=delimited',
+                         r'--input-record-delimiter=\0',
+                         '--input-shards=2', '--input-shard-min-size=0',
+                         '--mmap-input'),
+            self.expected())
+
+    def test_processes_fixed_size_records(self):
+        result = self.process('--input-records=fixed',
+                              '--input-record-size=5')
+        self.assertEqual(result, [line + '\0' for line in self.expected()])
+
+
+class SorterTests(unittest.TestCase):
+
+    def setUp(self):
+        self.tempdir = tempfile.mkdtemp()
+        self.input = os.path.join(self.tempdir, 'input')
+
+    def tearDown(self):
+        shutil.rmtree(self.tempdir)
+
+    def sort(self, lines, *args):
+        with open(self.input, 'w') as f:
+            f.write(''.join(lines))
+
+        class App(cliapp.Application):
+
+            def setup(self):
+                self.sorter = self.open_sorter()
+
+            def process_input_line(self, name, line):
+                self.sorter.add(line)
+
+            def cleanup(self):
+                with self.sorter:
+                    self.sorter.write(self.output)
+
+        app = App()
+        app.settings.parse_args(list(args))
+        app.output = StringIO.StringIO()
+        app.setup()
+        app.process_inputs([self.input])
+        app.cleanup()
+        return app.output.getvalue()
+
+    def test_sorts_by_settings(self):
+        lines = ['b 10\n', 'a 9\n', 'c 9\n', 'd 100\n']
+        self.assertEqual(self.sort(lines), 'a 9\nb 10\nc 9\nd 100\n')
+        self.assertEqual(
+            self.sort(lines, '--sort-key=2', '--sort-numeric',
+                      '--sort-unique', '--sort-memory=100'),
+            'a 9\nb 10\nd 100\n')
+
+
+class MapReduceTests(unittest.TestCase):
+
+    def setUp(self):
+        self.tempdir = tempfile.mkdtemp()
+        self.inputs = []
+        for i in range(4):
+            filename = os.path.join(self.tempdir, 'input%d' % i)
+            with open(filename, 'w') as f:
+                f.write(''.join('%s word%d\n' % ('foo' * i, j % 7)
+                                for j in range(100 * (i + 1))))
+            self.inputs.append(filename)
+
+    def tearDown(self):
+        shutil.rmtree(self.tempdir)
+
+    def count_words(self, *args):
+
+        class App(cliapp.Application):
+
+            def map_line(self, filename, line):
+                return [(word, 1) for word in line.split()]
+
+        app = App()
+        app.settings.parse_args(list(args))
+        app.output = StringIO.StringIO()
+        app.process_inputs(self.inputs)
+        return (app.output.getvalue(), app.fileno, app.lineno,
+                app.global_lineno)
+
+    def expected(self):
+        counts = {}
+        lines = 0
+        for name in self.inputs:
+            with open(name) as f:
+                data = f.read()
+            for word in data.split():
+                counts[word] = counts.get(word, 0) + 1
+            lines += data.count('\n')
+        output = ''.join('%s\t%d\n' % pair for pair in sorted(counts.items()))
+        return output, len(self.inputs), data.count('\n'), lines
+
+    def test_counts_words(self):
+        self.assertEqual(self.count_words(), self.expected())
+
+    def test_counts_words_in_parallel(self):
+        self.assertEqual(
+            self.count_words('--jobs=3', '--map-reduce-keys=3'),
+            self.expected())
+
+    def test_counts_words_in_more_files_than_can_be_open(self):
+        for i in range(300):
+            filename = os.path.join(self.tempdir, 'small%d' % i)
+            with open(filename, 'w') as f:
+                f.write('small%d word%d\n' % (i, i % 7))
+            self.inputs.append(filename)
+        soft, hard = resource.getrlimit(resource.RLIMIT_NOFILE)
+        resource.setrlimit(resource.RLIMIT_NOFILE, (100, hard))
+        try:
+            self.assertEqual(self.count_words(), self.expected())
+            self.assertEqual(self.count_words('--jobs=3'), self.expected())
+        finally:
+            resource.setrlimit(resource.RLIMIT_NOFILE, (soft, hard))
+
+    def test_ignores_input_shards(self):
+        self.assertEqual(
+            self.count_words('--jobs=1', '--input-shards=3',
+                             '--input-shard-min-size=0'),
+            self.expected())
+
+
+class ParallelMapTests(unittest.TestCase):
+
+    def setUp(self):
+        self.app = cliapp.Application()
+        self.app.settings.parse_args(['--jobs=3'])
+        self.app.offset = 100
+
+    def add_offset(self, x):
+        return os.getpid(), x + self.app.offset
+
+    def test_maps_in_workers_with_application_state(self):
+        results = list(self.app.parallel_map(self.add_offset, range(50)))
+        self.assertEqual([x for _, x in results], range(100, 150))
+        self.assertFalse(os.getpid() in [pid for pid, _ in results])
+
+    def test_maps_in_any_order(self):
+        results = self.app.parallel_map(
+            self.add_offset, iter(range(50)), ordered=False)
+        self.assertEqual(sorted(x for _, x in results), range(100, 150))
+
+    def test_maps_in_process_with_one_job(self):
+        results = list(self.app.parallel_map(self.add_offset, range(5),
+                                             jobs=1))
+        self.assertEqual(results, [(os.getpid(), x) for x in range(100, 105)])
+
+    def test_forks_workers_only_while_iterating(self):
+        results = self.app.parallel_map(self.add_offset, range(50))
+        self.assertEqual(multiprocessing.active_children(), [])
+        self.assertEqual(results.next()[1], 100)
+        self.assertNotEqual(multiprocessing.active_children(), [])
+        results.close()
+        self.assertEqual(multiprocessing.active_children(), [])
+
+
+class MappedInputTests(unittest.TestCase):
+
+    def setUp(self):
+        self.tempdir = tempfile.mkdtemp()
+        self.input = os.path.join(self.tempdir, 'input')
+        with open(self.input, 'w') as f:
+            f.write(''.join('line %d\n' % i for i in range(100)))
+            f.write('no newline')
+        self.empty = os.path.join(self.tempdir, 'empty')
+        with open(self.empty, 'w'):
+            pass
+
+    def tearDown(self):
+        shutil.rmtree(self.tempdir)
+
+    def process(self, app_class, *args):
+
+        class App(app_class):
+
+            def process_input_line(self, name, line):
+                self.output.write(
+                    '%d %d %r\n' % (self.lineno, self.global_lineno, line))
+
+        app = App()
+        app.settings.parse_args(list(args))
+        app.output = StringIO.StringIO()
+        app.process_inputs([self.input, self.empty, self.input])
+        return app.output.getvalue().splitlines()
+
+    def test_mapped_lines_are_same_as_read_lines(self):
+        lines = self.process(cliapp.Application)
+        self.assertEqual(len(lines), 202)
+        self.assertEqual(
+            self.process(cliapp.Application, '--mmap-input'), lines)
+
+    def test_mapped_blocks_are_same_as_read_blocks(self):
+
+        class BlockApp(cliapp.Application):
+
+            input_block_size = 64
+
+            def process_input_lines(self, name, lines, first_lineno):
+                cliapp.Application.process_input_lines(
+                    self, name, lines, first_lineno)
+
+        lines = self.process(BlockApp)
+        self.assertEqual(self.process(BlockApp, '--mmap-input'), lines)
+
+    def test_mapped_shards_are_same_as_read_lines(self):
+        self.assertEqual(
+            self.process(cliapp.Application,
+                         '--mmap-input', '--input-shards=3',
+                         '--input-shard-min-size=0'),
+            self.process(cliapp.Application))
+
+    def test_calls_process_input_mapping_for_regular_files_only(self):
+        mappings = []
+
+        class App(cliapp.Application):
+
+            def process_input_mapping(self, name, mapping):
+                mappings.append((name, mapping[:4], len(mapping)))
+
+        app = App()
+        app.output = StringIO.StringIO()
+        app.process_input(self.input)
+        app.process_input(self.empty)
+        self.assertEqual(
+            mappings,
+            [(self.input, 'line', os.path.getsize(self.input))])
+
+    def test_advises_kernel_to_read_mapping_sequentially(self):
+        calls = []
+
+        class Libc(object):
+
+            def madvise(self, address, size, advice):
+                calls.append((size.value, advice))
+                return 0
+
+        libc = cliapp.app._libc
+        cliapp.app._libc = Libc()
+        try:
+            mapping = cliapp.Application().open_input_mapping(self.input)
+        finally:
+            cliapp.app._libc = libc
+        size = os.path.getsize(self.input)
+        self.assertEqual(calls, [(size, cliapp.app._MADV_SEQUENTIAL),
+                                 (size, cliapp.app._MADV_WILLNEED)])
+        self.assertTrue(cliapp.app._madvise(mapping, 0))
+        mapping.close()
+
+
+class ResumeTests(unittest.TestCase):
+
+    def setUp(self):
+        self.tempdir = tempfile.mkdtemp()
+        self.inputs = []
+        for i in range(3):
+            filename = os.path.join(self.tempdir, 'input%d' % i)
+            with open(filename, 'w') as f:
+                f.write(''.join('line %d\n' % j for j in range(50)))
+            self.inputs.append(filename)
+        self.output = os.path.join(self.tempdir, 'output')
+        self.checkpoint = os.path.join(self.tempdir, 'checkpoint')
+
+    def tearDown(self):
+        shutil.rmtree(self.tempdir)
+
+    def run_app(self, args, fail_at=None, app_class=cliapp.Application):
+
+        class App(app_class):
+
+            count = 0
+
+            def process_input_line(self, name, line):
+                if self.global_lineno == fail_at:
+                    raise cliapp.AppException('failing on purpose')
+                self.count += 1
+                self.output.write('%d %d %d %s' % (
+                    self.fileno, self.lineno, self.global_lineno, line))
+
+            def checkpoint_state(self):
+                return {'count': self.count}
+
+            def restore_checkpoint_state(self, state):
+                self.count = state['count']
+
+            def cleanup(self):
+                self.output.write('%d\n' % self.count)
+
+        app = App()
+        try:
+            app.run(args=['--output', self.output, '--log=none'] +
+                    args + self.inputs, stderr=StringIO.StringIO())
+        except SystemExit:
+            pass
+        if not os.path.exists(self.output):
+            return None
+        with open(self.output) as f:
+            return f.read()
+
+    def assert_resumes(self, *args, **kwargs):
+        expected = self.run_app(list(args), **kwargs)
+        args = ['--checkpoint', self.checkpoint,
+                '--checkpoint-lines=7'] + list(args)
+        self.run_app(args, fail_at=120, **kwargs)
+        self.assertTrue(os.path.exists(self.checkpoint))
+        self.assertEqual(self.run_app(args + ['--resume'], **kwargs),
+                         expected)
+        self.assertFalse(os.path.exists(self.checkpoint))
+
+    def test_resumes_interrupted_run(self):
+        self.assert_resumes()
+
+    def test_resumes_interrupted_run_with_mapped_inputs(self):
+        self.assert_resumes('--mmap-input')
+
+    def test_resumes_interrupted_run_with_line_blocks(self):
+
+        class BlockApp(cliapp.Application):
+
+            input_block_size = 64
+
+            def process_input_lines(self, name, lines, first_lineno):
+                cliapp.Application.process_input_lines(
+                    self, name, lines, first_lineno)
+
+        self.assert_resumes(app_class=BlockApp)
+
+    def test_resumes_after_last_complete_file(self):
+        args = ['--checkpoint', self.checkpoint, '--checkpoint-lines=0',
+                '--checkpoint-interval=0']
+        self.run_app(args, fail_at=120)
+        self.assertEqual(self.run_app(args + ['--resume']),
+                         self.run_app([]))
+
+    def read_chunks(self):
+        with open(self.output + '.manifest') as f:
+            manifest = f.read()
+        data = ''
+        for line in manifest.splitlines():
+            with open(os.path.join(self.tempdir, line.split()[0])) as f:
+                data += f.read()
+        names = sorted(os.listdir(self.tempdir))
+        for name in names:
+            if name.startswith('output'):
+                os.remove(os.path.join(self.tempdir, name))
+        return manifest, data, names
+
+    def test_resumes_interrupted_run_with_chunked_output(self):
+        chunking = ['--output-chunk-records=17', '--output-buffer-size=100']
+        self.run_app(chunking)
+        expected = self.read_chunks()
+        args = ['--checkpoint', self.checkpoint,
+                '--checkpoint-lines=7'] + chunking
+        self.run_app(args, fail_at=120)
+        self.assertFalse(os.path.exists(self.output + '.manifest'))
+        self.run_app(args + ['--resume'])
+        self.assertEqual(self.read_chunks(), expected)
+
+    def test_refuses_to_resume_compressed_output(self):
+        args = ['--checkpoint', self.checkpoint, '--checkpoint-lines=7',
+                '--output-compression=gzip']
+        self.run_app(args, fail_at=120)
+        size = os.path.getsize(self.output)
+        app = cliapp.Application()
+        stderr = StringIO.StringIO()
+        self.assertRaises(
+            SystemExit, app.run,
+            args=['--output', self.output, '--log=none', '--resume'] +
+            args + self.inputs,
+            stderr=stderr)
+        self.assertTrue('compressed' in stderr.getvalue())
+        self.assertEqual(os.path.getsize(self.output), size)
+
+
+class IncrementalInputTests(unittest.TestCase):
+
+    def setUp(self):
+        self.tempdir = tempfile.mkdtemp()
+        self.inputs = []
+        for i in range(3):
+            filename = os.path.join(self.tempdir, 'input%d' % i)
+            with open(filename, 'w') as f:
+                f.write('line\n' * (i + 1))
+            self.inputs.append(filename)
+        self.index = os.path.join(self.tempdir, 'index')
+
+    def tearDown(self):
+        shutil.rmtree(self.tempdir)
+
+    def run_app(self):
+        events = []
+
+        class App(cliapp.Application):
+
+            def process_input(self, name):
+                events.append(('process', name))
+                cliapp.Application.process_input(self, name)
+
+            def input_result(self, name):
+                return self.lineno * 10
+
+            def replay_input_result(self, name, result):
+                events.append(('replay', name, result))
+
+            def cleanup(self):
+                events.append((self.fileno, self.global_lineno))
+
+        App().run(args=['--incremental-index', self.index] + self.inputs)
+        return events
+
+    def test_skips_unchanged_files(self):
+        first = self.run_app()
+        self.assertEqual(
+            first,
+            [('process', name) for name in self.inputs] + [(3, 6)])
+
+        with open(self.inputs[1], 'a') as f:
+            f.write('more\n')
+        os.utime(self.inputs[1], (1, 1))
+        self.assertEqual(
+            self.run_app(),
+            [('replay', self.inputs[0], 10),
+             ('process', self.inputs[1]),
+             ('replay', self.inputs[2], 30),
+             (3, 7)])
+
+
 class DummySubcommandApp(cliapp.Application):
 
     def cmd_foo(self, args):
@@ -0,0 +1,174 @@
+# Copyright (C) 2016  Lars Wirzenius
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along
+# with this program; if not, write to the Free Software Foundation, Inc.,
+# 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+
+
+import itertools
+import os
+
+import cliapp
+
+
+def read_separated(f, separator=None, keep_empty=False):
+    '''Generate the strings in a file separated by ``separator``.
+
+    If ``separator`` is None, it is a NUL byte if there are any in
+    the first block read, and a newline otherwise. Empty lines are
+    skipped, and so are empty NUL separated strings unless
+    ``keep_empty`` is true. A separator at the end of the file does
+    not start another string. The file is read lazily, in blocks, so
+    memory use does not depend on the number of strings.
+
+    '''
+
+    rest = ''
+    while True:
+        data = f.read(64 * 1024)
+        if not data:
+            break
+        if separator is None:
+            separator = '\0' if '\0' in data else '\n'
+        items = (rest + data).split(separator)
+        rest = items.pop()
+        for item in items:
+            if item or (keep_empty and separator == '\0'):
+                yield item
+    if rest:
+        yield rest
+
+
+def _read_response_file(filename):
+    # Arguments are one per line, or NUL terminated if there are any
+    # NUL bytes at the start of the file. Blank lines are ignored.
+    with open(filename, 'rb') as f:
+        for arg in read_separated(f, keep_empty=True):
+            yield arg
+
+
+def expand_response_files(args):
+    '''Generate arguments, replacing ``@FILE`` with the contents of FILE.
+
+    A response file contains one argument per line, or arguments
+    terminated by NUL bytes, as written by ``find -print0``. Response
+    files may name other response files. A response file that names
+    itself, directly or indirectly, is an error. An argument ``@FILE``
+    is kept as is if FILE does not exist, and so are all arguments
+    after ``--``.
+
+    The files are read lazily, as the arguments are needed.
+
+    '''
+
+    state = {'options_ended': False}
+    return _expand(args, [], state)
+
+
+def _expand(args, stack, state):
+    for arg in args:
+        if (state['options_ended'] or not arg.startswith('@') or
+                not os.path.exists(arg[1:])):
+            if arg == '--':
+                state['options_ended'] = True
+            yield arg
+            continue
+
+        filename = os.path.realpath(arg[1:])
+        if filename in stack:
+            raise cliapp.AppException(
+                'Response file %s includes itself' % arg[1:])
+        stack.append(filename)
+        for expanded in _expand(_read_response_file(arg[1:]), stack, state):
+            yield expanded
+        stack.pop()
+
+
+def split_options(args):
+    '''Split expanded arguments into options and the rest.
+
+    Return a list of arguments up to and including the first ``--``,
+    and an iterator over the arguments after it, which have not been
+    read yet. If there is no ``--``, the iterator is None.
+
+    '''
+
+    args = iter(args)
+    head = []
+    for arg in args:
+        head.append(arg)
+        if arg == '--':
+            return head, args
+    return head, None
+
+
+class LazyArgs(object):
+
+    '''A list of command line arguments, read only when needed.
+
+    This is what ``Settings.parse_args`` returns when there are more
+    arguments in response files after a ``--``, typically names of
+    input files. Iterating over it reads the arguments one by one,
+    without keeping them in memory, which means it can be iterated
+    over only once. Getting its length, or indexing it, reads and
+    keeps the arguments that are needed for that; once all have been
+    read, it can be iterated over any number of times.
+
+    '''
+
+    def __init__(self, args, rest):
+        self._args = list(args)
+        self._rest = rest
+
+    def _read(self, count=None):
+        if self._rest is None:
+            return
+        if count is not None and len(self._args) >= count:
+            return
+        for arg in self._rest:
+            self._args.append(arg)
+            if count is not None and len(self._args) >= count:
+                return
+        self._rest = None
+
+    def __iter__(self):
+        if self._rest is None:
+            return iter(self._args)
+        args, self._args = self._args, []
+        rest, self._rest = self._rest, iter([])
+        return itertools.chain(args, rest)
+
+    def __len__(self):
+        self._read()
+        return len(self._args)
+
+    def __nonzero__(self):
+        self._read(1)
+        return bool(self._args)
+
+    def __getitem__(self, index):
+        if isinstance(index, slice) or index < 0:
+            self._read()
+        else:
+            self._read(index + 1)
+        return self._args[index]
+
+    def __eq__(self, other):
+        self._read()
+        return self._args == list(other)
+
+    def __ne__(self, other):
+        return not self == other
+
+    def __repr__(self):
+        return 'LazyArgs(%r, ...)' % self._args
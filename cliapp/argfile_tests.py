@@ -0,0 +1,139 @@
+# Copyright (C) 2016  Lars Wirzenius
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along
+# with this program; if not, write to the Free Software Foundation, Inc.,
+# 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+
+
+import os
+import shutil
+import tempfile
+import unittest
+
+import cliapp
+from cliapp.argfile import (
+    expand_response_files, read_separated, LazyArgs)
+
+
+class ResponseFileTests(unittest.TestCase):
+
+    def setUp(self):
+        self.tempdir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.tempdir)
+
+    def make_file(self, name, data):
+        filename = os.path.join(self.tempdir, name)
+        with open(filename, 'w') as f:
+            f.write(data)
+        return filename
+
+    def test_expands_lines(self):
+        a = self.make_file('a', '--foo\n\nbar baz\n')
+        self.assertEqual(list(expand_response_files(['x', '@' + a, 'y'])),
+                         ['x', '--foo', 'bar baz', 'y'])
+
+    def test_expands_nul_separated_arguments(self):
+        a = self.make_file('a', '--foo\0multi\nline\0\0')
+        self.assertEqual(list(expand_response_files(['@' + a])),
+                         ['--foo', 'multi\nline', ''])
+
+    def test_reads_nul_separated_arguments_in_small_blocks(self):
+
+        class SmallReads(object):
+
+            def __init__(self, data):
+                self.data = data
+
+            def read(self, size):
+                data, self.data = self.data[:3], self.data[3:]
+                return data
+
+        f = SmallReads('foo\0\0new\nline\0bar')
+        self.assertEqual(list(read_separated(f, '\0', keep_empty=True)),
+                         ['foo', '', 'new\nline', 'bar'])
+
+    def test_expands_nested_files(self):
+        b = self.make_file('b', 'bar\n')
+        a = self.make_file('a', 'foo\n@%s\n' % b)
+        self.assertEqual(list(expand_response_files(['@' + a, '@' + b])),
+                         ['foo', 'bar', 'bar'])
+
+    def test_keeps_nonexistent_files_and_arguments_after_dashdash(self):
+        a = self.make_file('a', 'foo\n')
+        self.assertEqual(
+            list(expand_response_files(['@/nonexistent', '--', '@' + a])),
+            ['@/nonexistent', '--', '@' + a])
+
+    def test_detects_cycles(self):
+        a = os.path.join(self.tempdir, 'a')
+        self.make_file('b', '@%s\n' % a)
+        self.make_file('a', '@%s\n' % os.path.join(self.tempdir, 'b'))
+        self.assertRaises(
+            cliapp.AppException, list, expand_response_files(['@' + a]))
+
+    def test_settings_parse_options_from_response_file(self):
+        a = self.make_file('a', '--output=foo\nbar\n')
+        settings = cliapp.Settings('appname', '1.0')
+        self.assertEqual(settings.parse_args(['@' + a]), ['bar'])
+        self.assertEqual(settings['output'], 'foo')
+
+    def test_settings_return_lazy_arguments_after_dashdash(self):
+        a = self.make_file('a', '--output=foo\n--\nbar\n--null\n')
+        settings = cliapp.Settings('appname', '1.0')
+        args = settings.parse_args(['first', '@' + a])
+        self.assertTrue(isinstance(args, LazyArgs))
+        self.assertEqual(list(args), ['first', 'bar', '--null'])
+        self.assertEqual(settings['output'], 'foo')
+        self.assertFalse(settings['null'])
+
+    def test_settings_read_response_file_only_once(self):
+        read_fd, write_fd = os.pipe()
+        os.write(write_fd, '--output=foo\n--\nbar\n')
+        os.close(write_fd)
+        self.addCleanup(os.close, read_fd)
+        args = ['@/dev/fd/%d' % read_fd]
+        settings = cliapp.Settings('appname', '1.0')
+        settings.parse_args(args, configs_only=True)
+        self.assertEqual(list(settings.parse_args(args)), ['bar'])
+        self.assertEqual(settings['output'], 'foo')
+
+    def test_settings_can_disable_response_files(self):
+        a = self.make_file('a', '--output=foo\n')
+        settings = cliapp.Settings('appname', '1.0')
+        settings.response_files = False
+        self.assertEqual(settings.parse_args(['@' + a]), ['@' + a])
+
+
+class LazyArgsTests(unittest.TestCase):
+
+    def test_reads_only_what_is_needed(self):
+        rest = iter(['b', 'c', 'd'])
+        args = LazyArgs(['a'], rest)
+        self.assertTrue(args)
+        self.assertEqual(args[1], 'b')
+        self.assertEqual(list(rest), ['c', 'd'])
+
+    def test_streams_when_iterated(self):
+        args = LazyArgs(['a'], iter(['b', 'c']))
+        self.assertEqual(list(args), ['a', 'b', 'c'])
+        self.assertEqual(list(args), [])
+
+    def test_behaves_like_a_list_when_read(self):
+        args = LazyArgs(['a'], iter(['b', 'c']))
+        self.assertEqual(len(args), 3)
+        self.assertEqual(args[1:], ['b', 'c'])
+        self.assertEqual(args, ['a', 'b', 'c'])
+        self.assertEqual(list(args), ['a', 'b', 'c'])
+        self.assertFalse(LazyArgs([], iter([])))
@@ -0,0 +1,108 @@
+# Copyright (C) 2016  Lars Wirzenius
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along
+# with this program; if not, write to the Free Software Foundation, Inc.,
+# 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+
+
+import errno
+import json
+import os
+import tempfile
+import time
+
+import cliapp
+
+
+def write_atomically(filename, data):
+    '''Replace the contents of a file, so that it is never half-written.
+
+    The data is written to a temporary file in the same directory,
+    synced to disk, and then renamed over ``filename``.
+
+    '''
+
+    dirname = os.path.dirname(os.path.abspath(filename))
+    fd, temp = tempfile.mkstemp(dir=dirname, prefix='.tmp-')
+    try:
+        with os.fdopen(fd, 'w') as f:
+            f.write(data)
+            f.flush()
+            os.fsync(f.fileno())
+        os.rename(temp, filename)
+    except BaseException:
+        os.remove(temp)
+        raise
+
+
+class Checkpoint(object):
+
+    '''A file that records how far a long computation has got.
+
+    The checkpoint is a JSON object, which is written atomically with
+    ``save``, and read back with ``load``. ``due`` tells if it is time
+    to save a new checkpoint: after ``lines`` lines, or ``seconds``
+    seconds, since the previous one. Zero means no limit of that kind.
+
+    '''
+
+    def __init__(self, filename, lines=0, seconds=0):
+        self.filename = filename
+        self.lines = lines
+        self.seconds = seconds
+        self.time = time.time
+        self._lines_done = 0
+        self._next_time = None
+
+    def load(self):
+        '''Return the saved checkpoint, or None if there isn't one.'''
+
+        try:
+            with open(self.filename) as f:
+                data = f.read()
+        except IOError as e:
+            if e.errno == errno.ENOENT:
+                return None
+            raise
+        try:
+            return json.loads(data)
+        except ValueError as e:
+            raise cliapp.AppException(
+                '%s: corrupt checkpoint: %s' % (self.filename, e))
+
+    def save(self, checkpoint):
+        '''Save a checkpoint.'''
+        write_atomically(self.filename, json.dumps(checkpoint))
+        self._lines_done = 0
+        self._next_time = self.time() + self.seconds
+
+    def due(self, lines):
+        '''Count lines done; is it time to save a checkpoint?'''
+
+        self._lines_done += lines
+        if self.lines and self._lines_done >= self.lines:
+            return True
+        if not self.seconds:
+            return False
+        if self._next_time is None:
+            self._next_time = self.time() + self.seconds
+        return self.time() >= self._next_time
+
+    def remove(self):
+        '''Remove the checkpoint file, if it exists.'''
+
+        try:
+            os.remove(self.filename)
+        except OSError as e:
+            if e.errno != errno.ENOENT:
+                raise
@@ -0,0 +1,69 @@
+# Copyright (C) 2016  Lars Wirzenius
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along
+# with this program; if not, write to the Free Software Foundation, Inc.,
+# 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+
+
+import os
+import shutil
+import tempfile
+import unittest
+
+import cliapp
+
+
+class CheckpointTests(unittest.TestCase):
+
+    def setUp(self):
+        self.tempdir = tempfile.mkdtemp()
+        self.filename = os.path.join(self.tempdir, 'checkpoint')
+        self.now = 0
+        self.checkpoint = cliapp.Checkpoint(
+            self.filename, lines=10, seconds=60)
+        self.checkpoint.time = lambda: self.now
+
+    def tearDown(self):
+        shutil.rmtree(self.tempdir)
+
+    def test_loads_none_if_there_is_no_checkpoint(self):
+        self.assertEqual(self.checkpoint.load(), None)
+
+    def test_loads_what_was_saved(self):
+        self.checkpoint.save({'foo': [1, 2]})
+        self.assertEqual(self.checkpoint.load(), {'foo': [1, 2]})
+        self.assertEqual(os.listdir(self.tempdir), ['checkpoint'])
+
+    def test_raises_error_for_corrupt_checkpoint(self):
+        with open(self.filename, 'w') as f:
+            f.write('{')
+        self.assertRaises(cliapp.AppException, self.checkpoint.load)
+
+    def test_is_due_after_lines(self):
+        self.assertFalse(self.checkpoint.due(9))
+        self.assertTrue(self.checkpoint.due(1))
+        self.checkpoint.save({})
+        self.assertFalse(self.checkpoint.due(1))
+
+    def test_is_due_after_seconds(self):
+        self.assertFalse(self.checkpoint.due(1))
+        self.now = 59
+        self.assertFalse(self.checkpoint.due(1))
+        self.now = 60
+        self.assertTrue(self.checkpoint.due(1))
+
+    def test_removes_checkpoint(self):
+        self.checkpoint.save({})
+        self.checkpoint.remove()
+        self.checkpoint.remove()
+        self.assertEqual(self.checkpoint.load(), None)
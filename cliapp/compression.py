@@ -0,0 +1,198 @@
+# Copyright (C) 2016  Lars Wirzenius
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along
+# with this program; if not, write to the Free Software Foundation, Inc.,
+# 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+
+
+import signal
+import subprocess
+import sys
+
+import cliapp
+from cliapp.runcmd import _popen
+
+
+# Supported compression formats: the magic bytes at the start of a
+# compressed file, and the program that decompresses it.
+formats = {
+    'gzip': ('\x1f\x8b', 'gzip'),
+    'bzip2': ('BZh', 'bzip2'),
+    'xz': ('\xfd7zXZ\x00', 'xz'),
+}
+
+# Filename extensions of compressed files, for each format.
+extensions = {
+    '.gz': 'gzip',
+    '.bz2': 'bzip2',
+    '.xz': 'xz',
+}
+
+
+def compression_for_filename(filename):
+    '''Return the compression format for a filename, or None.
+
+    The format is recognized from the filename extension.
+
+    '''
+
+    for ext, name in extensions.items():
+        if filename.endswith(ext):
+            return name
+    return None
+
+
+def detect_compression(f):
+    '''Return the compression format of an open file, or None.
+
+    The format is recognized from the first bytes of the file. The
+    file must be seekable: its position is restored afterwards. Return
+    None if it is not seekable.
+
+    '''
+
+    try:
+        pos = f.tell()
+        magic = f.read(8)
+        f.seek(pos)
+    except IOError:
+        return None
+    for name, (prefix, _) in formats.items():
+        if magic.startswith(prefix):
+            return name
+    return None
+
+
+def _restore_sigpipe():
+    # Python ignores SIGPIPE, and children inherit that. We want the
+    # decompressor to die quietly if we stop reading early.
+    signal.signal(signal.SIGPIPE, signal.SIG_DFL)
+
+
+def open_decompressed(f, compression, mode='r'):
+    '''Return a file object that reads the decompressed contents of f.
+
+    The decompression is done by a separate process (e.g., ``gzip
+    -dc``), so that it runs in parallel with whatever the caller does
+    with the data, on another CPU. ``f`` is closed, unless it is
+    ``sys.stdin``.
+
+    '''
+
+    program = formats[compression][1]
+    p = _popen([program, '-dc'], stdin=f, stdout=subprocess.PIPE,
+               close_fds=True, preexec_fn=_restore_sigpipe)
+    if f is not sys.stdin:
+        f.close()
+    return DecompressedFile(p, getattr(f, 'name', None), program)
+
+
+class DecompressedFile(object):
+
+    '''Read-only file object for the output of a decompressor process.
+
+    Closing the file waits for the process to finish. If it failed,
+    ``cliapp.AppException`` is raised, unless the file was closed
+    before all of it was read.
+
+    '''
+
+    def __init__(self, process, name, program):
+        self._process = process
+        self._file = process.stdout
+        self.name = name
+        self._program = program
+        self.closed = False
+
+    def __getattr__(self, attr):
+        return getattr(self._file, attr)
+
+    def __iter__(self):
+        return iter(self._file)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def close(self):
+        if self.closed:
+            return
+        self.closed = True
+        self._file.close()
+        returncode = self._process.wait()
+        # A negative return code means the decompressor was killed by
+        # a signal, usually SIGPIPE because we stopped reading early.
+        if returncode > 0:
+            raise cliapp.AppException(
+                '%s: %s failed to decompress input (exit code %d)' %
+                (self.name, self._program, returncode))
+
+
+def open_compressed(filename, compression, level=None):
+    '''Return a file object that writes a compressed file.
+
+    The compression is done by a separate process (e.g., ``gzip -c``),
+    so that it runs in parallel with the caller, on another CPU.
+    ``level`` is the compression level, from 1 (fastest) to 9
+    (smallest); None means the program's default.
+
+    '''
+
+    program = formats[compression][1]
+    argv = [program, '-c']
+    if level is not None:
+        argv.append('-%d' % level)
+    with open(filename, 'wb') as f:
+        p = _popen(argv, stdin=subprocess.PIPE, stdout=f, close_fds=True)
+    return CompressedFile(p, filename, program)
+
+
+class CompressedFile(object):
+
+    '''Write-only file object for the input of a compressor process.
+
+    Closing the file waits for the process to finish. If it failed,
+    ``cliapp.AppException`` is raised.
+
+    '''
+
+    def __init__(self, process, name, program):
+        self._process = process
+        self._file = process.stdin
+        self.name = name
+        self._program = program
+        self.closed = False
+
+    def __getattr__(self, attr):
+        return getattr(self._file, attr)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def close(self):
+        if self.closed:
+            return
+        self.closed = True
+        try:
+            self._file.close()
+        finally:
+            returncode = self._process.wait()
+        if returncode != 0:
+            raise cliapp.AppException(
+                '%s: %s failed to compress output (exit code %d)' %
+                (self.name, self._program, returncode))
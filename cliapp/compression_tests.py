@@ -0,0 +1,147 @@
+# Copyright (C) 2016  Lars Wirzenius
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along
+# with this program; if not, write to the Free Software Foundation, Inc.,
+# 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+
+
+import os
+import shutil
+import subprocess
+import tempfile
+import unittest
+
+import cliapp
+
+
+class DecompressionTests(unittest.TestCase):
+
+    def setUp(self):
+        self.tempdir = tempfile.mkdtemp()
+        self.data = ''.join('line %d\n' % i for i in range(10000))
+
+    def tearDown(self):
+        shutil.rmtree(self.tempdir)
+
+    def make_file(self, program):
+        filename = os.path.join(self.tempdir, program)
+        with open(filename, 'w') as f:
+            if program == 'plain':
+                f.write(self.data)
+            else:
+                p = subprocess.Popen([program, '-c'], stdin=subprocess.PIPE,
+                                     stdout=f)
+                p.communicate(self.data)
+        return filename
+
+    def test_detects_formats(self):
+        for program in ['gzip', 'bzip2', 'xz']:
+            with open(self.make_file(program)) as f:
+                self.assertEqual(cliapp.detect_compression(f), program)
+                self.assertEqual(f.tell(), 0)
+
+    def test_detects_uncompressed_file(self):
+        with open(self.make_file('plain')) as f:
+            self.assertEqual(cliapp.detect_compression(f), None)
+
+    def test_decompresses(self):
+        for program in ['gzip', 'bzip2', 'xz']:
+            f = cliapp.open_decompressed(
+                open(self.make_file(program)), program)
+            self.assertEqual(list(f), self.data.splitlines(True))
+            f.close()
+
+    def test_can_be_closed_early(self):
+        f = cliapp.open_decompressed(open(self.make_file('gzip')), 'gzip')
+        self.assertEqual(f.readline(), 'line 0\n')
+        f.close()
+
+    def test_raises_error_for_corrupt_input(self):
+        filename = self.make_file('gzip')
+        with open(filename, 'r+') as f:
+            f.seek(20)
+            f.write('garbage' * 10)
+        f = cliapp.open_decompressed(open(filename), 'gzip')
+        f.read()
+        self.assertRaises(cliapp.AppException, f.close)
+
+    def test_application_reads_compressed_inputs(self):
+        lines = []
+
+        class App(cliapp.Application):
+
+            def process_input_line(self, name, line):
+                lines.append(line)
+
+        filenames = [self.make_file(x) for x in ['plain', 'gzip', 'xz']]
+        app = App()
+        app.run(args=['--input-compression=auto'] + filenames)
+        self.assertEqual(''.join(lines), self.data * 3)
+
+    def test_application_does_not_decompress_by_default(self):
+        app = cliapp.Application()
+        f = app.open_input(self.make_file('gzip'))
+        self.assertTrue(f.read().startswith('\x1f\x8b'))
+        f.close()
+
+
+class CompressionTests(unittest.TestCase):
+
+    def setUp(self):
+        self.tempdir = tempfile.mkdtemp()
+        self.data = ''.join('line %d\n' % i for i in range(1000))
+
+    def tearDown(self):
+        shutil.rmtree(self.tempdir)
+
+    def decompress(self, filename, program):
+        f = cliapp.open_decompressed(open(filename), program)
+        data = f.read()
+        f.close()
+        return data
+
+    def test_recognizes_compression_from_filename(self):
+        self.assertEqual(
+            cliapp.compression.compression_for_filename('foo.gz'), 'gzip')
+        self.assertEqual(
+            cliapp.compression.compression_for_filename('foo.xz'), 'xz')
+        self.assertEqual(
+            cliapp.compression.compression_for_filename('foo.txt'), None)
+
+    def test_compresses(self):
+        for program in ['gzip', 'bzip2', 'xz']:
+            filename = os.path.join(self.tempdir, program)
+            f = cliapp.open_compressed(filename, program, level=1)
+            f.write(self.data)
+            f.close()
+            self.assertEqual(self.decompress(filename, program), self.data)
+
+    def test_application_compresses_output_by_extension(self):
+
+        class App(cliapp.Application):
+
+            def process_args(app, args):
+                app.output.write(self.data)
+
+        filename = os.path.join(self.tempdir, 'output.xz')
+        App().run(args=['--output', filename, '--output-compression=auto',
+                        '--output-compression-level=1'])
+        self.assertEqual(self.decompress(filename, 'xz'), self.data)
+
+    def test_application_does_not_compress_by_default(self):
+        filename = os.path.join(self.tempdir, 'output.gz')
+        app = cliapp.Application()
+        app.process_args = lambda args: app.output.write('foo')
+        app.run(args=['--output', filename])
+        with open(filename) as f:
+            self.assertEqual(f.read(), 'foo')
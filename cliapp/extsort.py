@@ -0,0 +1,275 @@
+# Copyright (C) 2016  Lars Wirzenius
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along
+# with this program; if not, write to the Free Software Foundation, Inc.,
+# 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+
+
+import heapq
+import itertools
+import os
+import Queue
+import shutil
+import sys
+import tempfile
+import threading
+
+import cliapp
+from cliapp.parallel import _forever
+
+
+def field_key(field, numeric=False):
+    '''Return a sort key function for a whitespace-separated field.
+
+    Fields are numbered from 1; field 0 is the whole line. Lines with
+    fewer fields sort as if the field were empty. If ``numeric`` is
+    true, the field is compared as a number, and fields that are not
+    numbers as zero, as with ``sort -n``.
+
+    '''
+
+    def key(line):
+        if field == 0:
+            value = line.rstrip('\n')
+        else:
+            fields = line.split(None, field)
+            value = fields[field - 1] if len(fields) >= field else ''
+        if numeric:
+            try:
+                return float(value)
+            except ValueError:
+                return 0.0
+        return value
+
+    if field == 0 and not numeric:
+        return None
+    return key
+
+
+class ExternalSorter(object):
+
+    '''Sort more lines than fit in memory.
+
+    Lines are added with ``add`` or ``extend``, and are kept in memory
+    until they take about ``memory`` bytes. Then they are sorted and
+    written to a temporary file, a "run", by a background thread,
+    while new lines are collected. Iterating over the sorter merges
+    the runs, and the lines still in memory, with ``heapq.merge``, and
+    generates all lines in sorted order. ``write`` writes them to a
+    file. A newline is added to lines that don't end in one.
+
+    The sorted lines can be iterated over only once.
+
+    ``key`` is a function that returns the sort key for a line, as
+    for ``sorted``; lines with the same key stay in the order they were
+    added. If ``unique`` is true, only the first line with each key is
+    kept. If ``compress`` is a compression format, such as ``gzip``,
+    runs are compressed by a separate process, which saves disk space
+    and I/O at the cost of CPU. Runs are put in a temporary directory
+    in ``tempdir``, or the system default. At most ``fan_in`` runs are
+    merged at once; if there are more, they are first merged into
+    fewer, larger runs.
+
+    Close the sorter to remove the temporary files. It can be used as
+    a context manager.
+
+    '''
+
+    def __init__(self, key=None, unique=False, memory=256 * 1024**2,
+                 compress=None, tempdir=None, fan_in=64):
+        self.key = key
+        self.unique = unique
+        self.memory = memory
+        self.compress = compress
+        self.tempdir = tempdir
+        self.fan_in = max(fan_in, 2)
+        self.runs = []
+        self.closed = False
+
+        self._lines = []
+        self._size = 0
+        self._dirname = None
+        self._numbers = itertools.count()
+        self._error = None
+        self._queue = None
+        self._thread = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def add(self, line):
+        '''Add a line to be sorted.'''
+        if not line.endswith('\n'):
+            line += '\n'
+        self._lines.append(line)
+        # Lines being written by the spill thread use memory as well,
+        # so a run gets half of the memory.
+        self._size += sys.getsizeof(line) + 8
+        if self._size * 2 >= self.memory:
+            self._spill()
+
+    def extend(self, lines):
+        '''Add many lines to be sorted.'''
+        for line in lines:
+            self.add(line)
+
+    def __iter__(self):
+        self._raise_error()
+        lines = self._sorted_lines()
+        if not self.runs and self._thread is None:
+            return self._unique(iter(lines))
+        self._finish_spilling()
+        while len(self.runs) >= self.fan_in:
+            self._merge_runs()
+        return self._unique(self._merge(
+            [self._read_run(name) for name in self.runs] + [lines]))
+
+    def write(self, f):
+        '''Write the sorted lines to an open file.'''
+        _write_lines(f, iter(self))
+
+    def close(self):
+        '''Remove the temporary files.'''
+        if self.closed:
+            return
+        self.closed = True
+        self._lines = []
+        if self._thread is not None:
+            self._queue.put(None)
+            self._thread.join()
+            self._thread = None
+        if self._dirname is not None:
+            shutil.rmtree(self._dirname, ignore_errors=True)
+
+    def _sorted_lines(self):
+        lines = self._lines
+        self._lines = []
+        self._size = 0
+        lines.sort(key=self.key)
+        return lines
+
+    def _spill(self):
+        self._raise_error()
+        lines = self._sorted_lines()
+        if self._thread is None:
+            self._dirname = tempfile.mkdtemp(
+                prefix='cliapp-sort-', dir=self.tempdir)
+            # Only one run waits while another one is being written,
+            # to bound memory use.
+            self._queue = Queue.Queue(maxsize=1)
+            self._thread = threading.Thread(target=self._write_runs)
+            self._thread.daemon = True
+            self._thread.start()
+        self._queue.put(lines)
+
+    def _finish_spilling(self):
+        if self._thread is not None:
+            self._queue.put(None)
+            self._thread.join(_forever)
+            self._thread = None
+        self._raise_error()
+
+    def _raise_error(self):
+        if self._error is not None:
+            raise self._error[0], self._error[1], self._error[2]
+
+    def _write_runs(self):
+        while True:
+            lines = self._queue.get(timeout=_forever)
+            if lines is None:
+                return
+            # After an error, the rest of the runs are dropped.
+            if self._error is None:
+                try:
+                    self.runs.append(self._write_run(lines))
+                except Exception:
+                    self._error = sys.exc_info()
+
+    def _run_name(self):
+        return os.path.join(self._dirname, 'run%06d' % next(self._numbers))
+
+    def _open_run(self, name):
+        if self.compress:
+            return cliapp.compression.open_compressed(name, self.compress, 1)
+        return open(name, 'wb')
+
+    def _write_run(self, lines):
+        name = self._run_name()
+        with self._open_run(name) as f:
+            _write_lines(f, lines)
+        return name
+
+    def _read_run(self, name):
+        f = open(name, 'rb')
+        if self.compress:
+            f = cliapp.compression.open_decompressed(f, self.compress)
+        with f:
+            for line in f:
+                yield line
+
+    def _merge(self, iterables):
+        # heapq.merge has no key argument in Python 2, so lines are
+        # decorated with their key, and the number of their run, which
+        # keeps lines with equal keys in the order they were added.
+        decorated = [_decorate(lines, self.key, i)
+                     for i, lines in enumerate(iterables)]
+        index = 0 if self.key is None else 2
+        for item in heapq.merge(*decorated):
+            yield item[index]
+
+    def _merge_runs(self):
+        # Merge the oldest runs into one, keeping the order of runs.
+        names = self.runs[:self.fan_in]
+        merged = self._run_name()
+        with self._open_run(merged) as f:
+            _write_lines(
+                f, self._merge([self._read_run(name) for name in names]))
+        for name in names:
+            os.remove(name)
+        self.runs[:self.fan_in] = [merged]
+
+    def _unique(self, lines):
+        if not self.unique:
+            return lines
+        return self._unique_lines(lines)
+
+    def _unique_lines(self, lines):
+        key = self.key or (lambda line: line)
+        previous = object()
+        for line in lines:
+            k = key(line)
+            if k != previous:
+                previous = k
+                yield line
+
+
+def _decorate(lines, key, number):
+    if key is None:
+        for line in lines:
+            yield line, number
+    else:
+        for line in lines:
+            yield key(line), number, line
+
+
+def _write_lines(f, lines):
+    # Write in large blocks, but without keeping all lines in memory.
+    lines = iter(lines)
+    while True:
+        batch = list(itertools.islice(lines, 10000))
+        if not batch:
+            break
+        f.write(''.join(batch))
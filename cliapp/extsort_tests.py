@@ -0,0 +1,121 @@
+# Copyright (C) 2016  Lars Wirzenius
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along
+# with this program; if not, write to the Free Software Foundation, Inc.,
+# 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+
+
+import os
+import random
+import shutil
+import StringIO
+import tempfile
+import unittest
+
+import cliapp
+import cliapp.extsort
+
+
+class FieldKeyTests(unittest.TestCase):
+
+    def test_whole_line_needs_no_key(self):
+        self.assertEqual(cliapp.extsort.field_key(0), None)
+
+    def test_returns_field(self):
+        key = cliapp.extsort.field_key(2)
+        self.assertEqual(key('a  b c\n'), 'b')
+        self.assertEqual(key('a\n'), '')
+
+    def test_returns_number(self):
+        key = cliapp.extsort.field_key(1, numeric=True)
+        self.assertEqual(key('12.5 x\n'), 12.5)
+        self.assertEqual(key('x\n'), 0.0)
+        self.assertEqual(cliapp.extsort.field_key(0, True)('7\n'), 7.0)
+
+
+class ExternalSorterTests(unittest.TestCase):
+
+    def setUp(self):
+        self.tempdir = tempfile.mkdtemp()
+        rand = random.Random(0)
+        self.lines = ['%d %d\n' % (rand.randint(0, 500), i)
+                      for i in range(3000)]
+
+    def tearDown(self):
+        shutil.rmtree(self.tempdir)
+
+    def sort(self, lines, **kwargs):
+        kwargs.setdefault('tempdir', self.tempdir)
+        with cliapp.ExternalSorter(**kwargs) as sorter:
+            sorter.extend(lines)
+            f = StringIO.StringIO()
+            sorter.write(f)
+            runs = len(sorter.runs)
+        self.assertEqual(os.listdir(self.tempdir), [])
+        return f.getvalue().splitlines(True), runs
+
+    def test_sorts_in_memory(self):
+        result, runs = self.sort(self.lines)
+        self.assertEqual(result, sorted(self.lines))
+        self.assertEqual(runs, 0)
+
+    def test_sorts_with_temporary_files(self):
+        result, runs = self.sort(self.lines, memory=10000)
+        self.assertEqual(result, sorted(self.lines))
+        self.assertTrue(runs > 1)
+
+    def test_merges_many_runs_in_several_passes(self):
+        result, runs = self.sort(self.lines, memory=10000, fan_in=3)
+        self.assertEqual(result, sorted(self.lines))
+        self.assertTrue(runs < 3)
+
+    def test_compresses_temporary_files(self):
+        result, runs = self.sort(self.lines, memory=10000, compress='gzip')
+        self.assertEqual(result, sorted(self.lines))
+        self.assertTrue(runs > 1)
+
+    def test_sort_is_stable(self):
+        key = cliapp.extsort.field_key(1, numeric=True)
+        expected = sorted(self.lines, key=key)
+        for memory in [10**6, 10000]:
+            self.assertEqual(self.sort(self.lines, key=key, memory=memory)[0],
+                             expected)
+
+    def test_keeps_only_first_of_equal_keys(self):
+        key = cliapp.extsort.field_key(1)
+        expected = []
+        seen = set()
+        for line in sorted(self.lines, key=key):
+            if key(line) not in seen:
+                seen.add(key(line))
+                expected.append(line)
+        for memory in [10**6, 10000]:
+            self.assertEqual(
+                self.sort(self.lines, key=key, unique=True, memory=memory)[0],
+                expected)
+
+    def test_adds_missing_newlines(self):
+        self.assertEqual(self.sort(['b', 'a\n'])[0], ['a\n', 'b\n'])
+
+    def test_raises_spill_errors(self):
+        sorter = cliapp.ExternalSorter(memory=1000, tempdir=self.tempdir)
+        sorter._write_run = lambda lines: 1 / 0
+
+        def sort():
+            sorter.extend(self.lines)
+            list(sorter)
+
+        try:
+            self.assertRaises(ZeroDivisionError, sort)
+        finally:
+            sorter.close()
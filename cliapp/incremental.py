@@ -0,0 +1,170 @@
+# Copyright (C) 2016  Lars Wirzenius
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along
+# with this program; if not, write to the Free Software Foundation, Inc.,
+# 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+
+
+import errno
+import hashlib
+import json
+import logging
+import os
+
+from cliapp.checkpoint import write_atomically
+
+
+class InputIndex(object):
+
+    '''Remember which input files have been processed, and the results.
+
+    The index is a file with one JSON list per line, one line per
+    input file: the absolute path, size, modification time, inode
+    number, content hash (or null), number of lines, and a result
+    supplied by the application. New entries are appended, and a later
+    line for the same path replaces an earlier one, so saving an entry
+    is cheap even for a huge index. When more than half of the lines
+    are out of date, the file is rewritten by ``close``. A truncated
+    last line, from a crash, is ignored, and removed before new
+    entries are appended.
+
+    A file is unchanged if its size, modification time, and inode
+    number are as recorded. If ``use_hash`` is true, a file whose
+    size is as recorded is also unchanged if its contents have the
+    same SHA-1 hash as before, even if it has been touched.
+
+    '''
+
+    def __init__(self, filename, use_hash=False):
+        self.filename = filename
+        self.use_hash = use_hash
+        self._entries = {}
+        self._lines = 0
+        self._file = None
+
+    def load(self):
+        '''Load the index from its file, if it exists.'''
+
+        self._entries = {}
+        self._lines = 0
+        try:
+            f = open(self.filename)
+        except IOError as e:
+            if e.errno == errno.ENOENT:
+                return
+            raise
+        with f:
+            for line in f:
+                self._lines += 1
+                try:
+                    entry = json.loads(line)
+                except ValueError:
+                    logging.warning(
+                        '%s: ignoring bad line %d', self.filename, self._lines)
+                    continue
+                self._entries[entry[0]] = entry
+
+    def __len__(self):
+        return len(self._entries)
+
+    def lookup(self, name):
+        '''Return (lines, result) for an unchanged file, or None.
+
+        A stat result for the file is also returned, to give to
+        ``record`` if the file needs to be processed.
+
+        '''
+
+        path = os.path.abspath(name)
+        st = os.stat(path)
+        entry = self._entries.get(path)
+        if entry is None:
+            return None, st
+        _, size, mtime, inode, digest, lines, result = entry
+        if (size, mtime, inode) == (st.st_size, st.st_mtime, st.st_ino):
+            return (lines, result), st
+        if self.use_hash and size == st.st_size and digest is not None:
+            if self.hash_file(path) == digest:
+                # Remember the new timestamps, to avoid hashing again.
+                self.record(name, st, lines, result)
+                return (lines, result), st
+        return None, st
+
+    def record(self, name, st, lines, result):
+        '''Record that a file has been processed.
+
+        ``st`` is the stat result of the file before it was processed,
+        as returned by ``lookup``. ``result`` must be something that
+        can be stored as JSON.
+
+        '''
+
+        path = os.path.abspath(name)
+        digest = self.hash_file(path) if self.use_hash else None
+        entry = [path, st.st_size, st.st_mtime, st.st_ino, digest, lines,
+                 result]
+        self._entries[path] = entry
+        if self._file is None:
+            self._file = self._open_for_append()
+        self._file.write(json.dumps(entry) + '\n')
+        self._lines += 1
+
+    def _open_for_append(self):
+        f = open(self.filename, 'a+')
+        f.seek(0, os.SEEK_END)
+        size = f.tell()
+        end = size
+        # Find the end of the last complete line, reading backwards.
+        while end > 0:
+            start = max(end - 64 * 1024, 0)
+            f.seek(start)
+            data = f.read(end - start)
+            if data.endswith('\n') and end == size:
+                break
+            newline = data.rfind('\n')
+            if newline >= 0:
+                end = start + newline + 1
+                break
+            end = start
+        if end < size:
+            # The last line was cut short by a crash. Remove it, so
+            # that the next entry starts on a line of its own.
+            f.truncate(end)
+            self._lines = max(self._lines - 1, 0)
+        f.seek(0, os.SEEK_END)
+        return f
+
+    def hash_file(self, path):
+        '''Return the SHA-1 hash of the contents of a file.'''
+
+        h = hashlib.sha1()
+        with open(path, 'rb') as f:
+            while True:
+                data = f.read(1024**2)
+                if not data:
+                    break
+                h.update(data)
+        return h.hexdigest()
+
+    def close(self):
+        '''Finish writing the index, compacting it if worthwhile.'''
+
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+        if self._lines > 2 * len(self._entries):
+            write_atomically(
+                self.filename,
+                ''.join(json.dumps(entry) + '\n'
+                        for entry in self._entries.itervalues()))
+            self._lines = len(self._entries)
@@ -0,0 +1,113 @@
+# Copyright (C) 2016  Lars Wirzenius
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along
+# with this program; if not, write to the Free Software Foundation, Inc.,
+# 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+
+
+import os
+import shutil
+import tempfile
+import unittest
+
+import cliapp
+
+
+class InputIndexTests(unittest.TestCase):
+
+    def setUp(self):
+        self.tempdir = tempfile.mkdtemp()
+        self.filename = os.path.join(self.tempdir, 'index')
+        self.input = os.path.join(self.tempdir, 'input')
+        self.write_input('foo\n')
+
+    def tearDown(self):
+        shutil.rmtree(self.tempdir)
+
+    def write_input(self, data, mtime=1000):
+        with open(self.input, 'w') as f:
+            f.write(data)
+        os.utime(self.input, (mtime, mtime))
+
+    def reopen(self, use_hash=False):
+        index = cliapp.InputIndex(self.filename, use_hash=use_hash)
+        index.load()
+        return index
+
+    def record(self, index, lines, result):
+        cached, st = index.lookup(self.input)
+        index.record(self.input, st, lines, result)
+        index.close()
+
+    def test_new_file_is_not_in_index(self):
+        index = self.reopen()
+        self.assertEqual(index.lookup(self.input)[0], None)
+
+    def test_remembers_unchanged_file(self):
+        self.record(self.reopen(), 1, {'foo': 1})
+        self.assertEqual(
+            self.reopen().lookup(self.input)[0], (1, {'foo': 1}))
+
+    def test_notices_changed_file(self):
+        self.record(self.reopen(), 1, None)
+        self.write_input('bar\n', mtime=2000)
+        self.assertEqual(self.reopen().lookup(self.input)[0], None)
+
+    def test_uses_hash_for_touched_file(self):
+        self.record(self.reopen(use_hash=True), 1, 'result')
+        self.write_input('foo\n', mtime=2000)
+        self.assertEqual(self.reopen().lookup(self.input)[0], None)
+        self.assertEqual(
+            self.reopen(use_hash=True).lookup(self.input)[0], (1, 'result'))
+
+    def test_latest_entry_wins_and_index_is_compacted(self):
+        for i in range(5):
+            self.record(self.reopen(), i, i)
+        self.assertEqual(self.reopen().lookup(self.input)[0], (4, 4))
+        with open(self.filename) as f:
+            self.assertTrue(len(f.readlines()) <= 2)
+
+    def test_ignores_truncated_line(self):
+        self.record(self.reopen(), 1, 'result')
+        with open(self.filename, 'a') as f:
+            f.write('["/foo", 1')
+        index = self.reopen()
+        self.assertEqual(len(index), 1)
+        self.assertEqual(index.lookup(self.input)[0], (1, 'result'))
+
+    def test_recovers_from_line_cut_short(self):
+        other = os.path.join(self.tempdir, 'other')
+        with open(other, 'w') as f:
+            f.write('bar\n')
+        index = self.reopen()
+        index.record(other, os.stat(other), 1, 'other')
+        self.record(index, 1, 'x' * 100000)
+        with open(self.filename, 'r+') as f:
+            f.truncate(os.path.getsize(self.filename) - 50000)
+
+        # The cut entry is lost, but the file is processed only once
+        # more, and the index is left with complete lines.
+        for i in range(2):
+            index = self.reopen()
+            cached, st = index.lookup(self.input)
+            if i == 0:
+                self.assertEqual(cached, None)
+                index.record(self.input, st, 2, 'again')
+            else:
+                self.assertEqual(cached, (2, 'again'))
+            index.close()
+        self.assertEqual(self.reopen().lookup(other)[0], (1, 'other'))
+        with open(self.filename) as f:
+            lines = f.readlines()
+        self.assertEqual(len(lines), 2)
+        self.assertTrue(all(line.endswith(']\n') for line in lines))
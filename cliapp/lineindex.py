@@ -0,0 +1,165 @@
+# Copyright (C) 2016  Lars Wirzenius
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along
+# with this program; if not, write to the Free Software Foundation, Inc.,
+# 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+
+
+import array
+import logging
+import os
+import struct
+import sys
+
+from cliapp.checkpoint import write_atomically
+
+
+# Header of an index file: magic, byte order of the offsets ('l' or
+# 'b'), size of each offset in bytes, size and modification time of
+# the indexed file, interval between indexed lines, and the number of
+# lines in the file.
+_magic = 'CLIAPPLX'
+_header = struct.Struct('<8scBQdQQ')
+
+
+class LineIndex(object):
+
+    '''Byte offsets of every ``every``'th line of a file.
+
+    The offsets make it possible to find a line by its number, without
+    reading the file from the beginning. The index is kept in a
+    sidecar file, named after the file with ``.lineidx`` appended,
+    which stores the offsets as a compact binary array. It is only
+    used if the size and modification time of the file are the same
+    as when the index was made.
+
+    Use ``LineIndex.open`` to load an index, or make it if necessary.
+
+    '''
+
+    suffix = '.lineidx'
+
+    def __init__(self, filename, every, offsets, lines, size, mtime):
+        self.filename = filename
+        self.every = every
+        self.offsets = offsets
+        self.lines = lines
+        self.size = size
+        self.mtime = mtime
+
+    @classmethod
+    def open(cls, filename, every=10000):
+        '''Return the index of a file, making it if necessary.
+
+        If the sidecar file is missing or out of date, the index is
+        made by reading the file, and saved, if possible.
+
+        '''
+
+        index = cls.load(filename)
+        if index is None:
+            index = cls.build(filename, every)
+            try:
+                index.save()
+            except (IOError, OSError) as e:
+                logging.debug(
+                    'could not save line index for %s: %s', filename, e)
+        return index
+
+    @classmethod
+    def load(cls, filename):
+        '''Load the index of a file, or return None if it is not valid.'''
+
+        st = os.stat(filename)
+        try:
+            with open(filename + cls.suffix, 'rb') as f:
+                header = f.read(_header.size)
+                if len(header) != _header.size:
+                    return None
+                (magic, byteorder, itemsize, size, mtime, every,
+                 lines) = _header.unpack(header)
+                offsets = array.array('L')
+                if (magic != _magic or itemsize != offsets.itemsize or
+                        (size, mtime) != (st.st_size, st.st_mtime)):
+                    return None
+                count = (lines + every - 1) // every or 1
+                offsets.fromfile(f, count)
+        except (IOError, EOFError, struct.error):
+            return None
+        if byteorder != sys.byteorder[0]:
+            offsets.byteswap()
+        return cls(filename, every, offsets, lines, size, mtime)
+
+    @classmethod
+    def build(cls, filename, every):
+        '''Make the index of a file by reading it.'''
+
+        st = os.stat(filename)
+        offsets = array.array('L', [0])
+        lines = 0
+        # Newlines to pass until the start of the next indexed line.
+        wanted = every
+        pos = 0
+        last = '\n'
+        with open(filename, 'rb') as f:
+            while True:
+                block = f.read(1024**2)
+                if not block:
+                    break
+                newlines = block.count('\n')
+                lines += newlines
+                last = block[-1]
+                i = 0
+                while newlines >= wanted:
+                    # Skip quickly to the part of the block with the
+                    # newline we want, then find it exactly.
+                    while True:
+                        count = block.count('\n', i, i + 4096)
+                        if count >= wanted:
+                            break
+                        wanted -= count
+                        newlines -= count
+                        i += 4096
+                    for _ in xrange(wanted):
+                        i = block.find('\n', i) + 1
+                    newlines -= wanted
+                    offsets.append(pos + i)
+                    wanted = every
+                wanted -= newlines
+                pos += len(block)
+        if last != '\n':
+            lines += 1
+        # There is no line at the very end of the file.
+        if len(offsets) > 1 and offsets[-1] == pos:
+            offsets.pop()
+        return cls(filename, every, offsets, lines, st.st_size, st.st_mtime)
+
+    def save(self):
+        '''Write the index to its sidecar file.'''
+
+        header = _header.pack(
+            _magic, sys.byteorder[0], self.offsets.itemsize, self.size,
+            self.mtime, self.every, self.lines)
+        write_atomically(self.filename + self.suffix,
+                         header + self.offsets.tostring())
+
+    def find(self, lineno):
+        '''Return offset and number of the nearest indexed line.
+
+        The indexed line is at or before line ``lineno``. Lines are
+        numbered from 1.
+
+        '''
+
+        i = min(max(lineno - 1, 0) // self.every, len(self.offsets) - 1)
+        return self.offsets[i], i * self.every + 1
@@ -0,0 +1,88 @@
+# Copyright (C) 2016  Lars Wirzenius
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along
+# with this program; if not, write to the Free Software Foundation, Inc.,
+# 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+
+
+import os
+import shutil
+import tempfile
+import unittest
+
+import cliapp
+
+
+class LineIndexTests(unittest.TestCase):
+
+    def setUp(self):
+        self.tempdir = tempfile.mkdtemp()
+        self.filename = os.path.join(self.tempdir, 'input')
+        self.lines = ['line %d %s\n' % (i, 'x' * (i % 5000))
+                      for i in range(1, 2001)]
+        self.write(''.join(self.lines))
+
+    def tearDown(self):
+        shutil.rmtree(self.tempdir)
+
+    def write(self, data, mtime=1000):
+        with open(self.filename, 'w') as f:
+            f.write(data)
+        os.utime(self.filename, (mtime, mtime))
+
+    def line_at(self, offset):
+        with open(self.filename) as f:
+            f.seek(offset)
+            return f.readline()
+
+    def test_finds_indexed_lines(self):
+        index = cliapp.LineIndex.build(self.filename, 7)
+        self.assertEqual(index.lines, 2000)
+        for lineno in [1, 7, 8, 9, 1000, 1996, 1997, 2000, 5000]:
+            offset, indexed = index.find(lineno)
+            self.assertTrue(indexed <= lineno)
+            self.assertTrue(lineno < indexed + 7 or indexed == 1996)
+            self.assertEqual(self.line_at(offset), self.lines[indexed - 1])
+
+    def test_handles_edge_cases(self):
+        for data, lines in [('', 0), ('foo', 1), ('a\nb\n', 2),
+                            ('a\nb', 2)]:
+            self.write(data)
+            index = cliapp.LineIndex.build(self.filename, 1)
+            self.assertEqual(index.lines, lines)
+            self.assertEqual(len(index.offsets), max(lines, 1))
+
+    def test_saves_and_loads_index(self):
+        index = cliapp.LineIndex.open(self.filename, 100)
+        self.assertTrue(os.path.exists(self.filename + '.lineidx'))
+        loaded = cliapp.LineIndex.load(self.filename)
+        self.assertEqual(loaded.offsets, index.offsets)
+        self.assertEqual(loaded.lines, 2000)
+        self.assertEqual(loaded.every, 100)
+
+    def test_ignores_out_of_date_index(self):
+        cliapp.LineIndex.open(self.filename, 100)
+        self.write('foo\n', mtime=2000)
+        self.assertEqual(cliapp.LineIndex.load(self.filename), None)
+        self.assertEqual(cliapp.LineIndex.open(self.filename).lines, 1)
+
+    def test_application_opens_input_at_line(self):
+        app = cliapp.Application()
+        app.settings['line-index-interval'] = 64
+        for lineno in [1, 64, 65, 1234, 2000]:
+            f = app.open_input_at_line(self.filename, lineno)
+            self.assertEqual(f.readline(), self.lines[lineno - 1])
+            f.close()
+        f = app.open_input_at_line(self.filename, 2001)
+        self.assertEqual(f.read(), '')
+        f.close()
@@ -0,0 +1,160 @@
+# Copyright (C) 2016  Lars Wirzenius
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along
+# with this program; if not, write to the Free Software Foundation, Inc.,
+# 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+
+
+import cPickle
+import heapq
+import itertools
+import os
+import tempfile
+
+
+# Pairs are pickled in chunks of this many, so that a batch can be
+# read back a little at a time.
+_chunk_size = 1000
+
+
+def write_batch(filename, pairs):
+    '''Write a batch of key/value pairs to a file.
+
+    The pairs must be sorted by key. They are pickled in chunks, with
+    the most compact pickle protocol.
+
+    '''
+
+    with open(filename, 'wb') as f:
+        pairs = iter(pairs)
+        while True:
+            chunk = list(itertools.islice(pairs, _chunk_size))
+            if not chunk:
+                break
+            cPickle.dump(chunk, f, cPickle.HIGHEST_PROTOCOL)
+
+
+def read_batch(filename):
+    '''Generate the key/value pairs in a file written by write_batch.'''
+
+    with open(filename, 'rb') as f:
+        while True:
+            try:
+                chunk = cPickle.load(f)
+            except EOFError:
+                break
+            for pair in chunk:
+                yield pair
+
+
+def merge_batches(filenames, fan_in=64):
+    '''Generate keys and lists of their values from batch files.
+
+    The batches are merged, with ``heapq.merge``, so that each key is
+    generated once, in sorted order, with the values it has in all
+    batches, in the order of the files. Only a few pairs from each
+    file are kept in memory at a time.
+
+    At most ``fan_in`` files are open at once; if there are more, the
+    first ones are merged into fewer, larger batches, in the directory
+    of the first file, which are removed afterwards.
+
+    '''
+
+    filenames = list(filenames)
+    fan_in = max(fan_in, 2)
+    temporary = set()
+    try:
+        while len(filenames) > fan_in:
+            fd, merged = tempfile.mkstemp(
+                dir=os.path.dirname(filenames[0]) or os.curdir)
+            os.close(fd)
+            temporary.add(merged)
+            write_batch(merged, _merge_pairs(filenames[:fan_in]))
+            for name in filenames[:fan_in]:
+                if name in temporary:
+                    os.remove(name)
+                    temporary.remove(name)
+            filenames[:fan_in] = [merged]
+
+        merged = _merge_pairs(filenames)
+        for key, group in itertools.groupby(merged, key=lambda pair: pair[0]):
+            yield key, [value for _, value in group]
+    finally:
+        for name in temporary:
+            os.remove(name)
+
+
+def _merge_pairs(filenames):
+    # Pairs are decorated with the number of their file, so that
+    # values are never compared, and keep the order of the files. A
+    # merged batch may have several pairs with the same key.
+    batches = [_decorate(read_batch(name), i)
+               for i, name in enumerate(filenames)]
+    for key, _, value in heapq.merge(*batches):
+        yield key, value
+
+
+def _decorate(pairs, number):
+    for key, value in pairs:
+        yield key, number, value
+
+
+class Partials(object):
+
+    '''Partial aggregates of the values of keys, in a worker.
+
+    Values are added with ``add``. When a key has ``combine_every``
+    values, they are replaced by ``combine(key, values)``. When there
+    are ``max_keys`` keys, all values are combined, and written to a
+    new batch file, named by calling ``new_filename``. The names of
+    the batch files are in ``filenames``.
+
+    '''
+
+    def __init__(self, combine, new_filename, max_keys=100000,
+                 combine_every=64):
+        self._combine = combine
+        self._new_filename = new_filename
+        self.max_keys = max(max_keys, 1)
+        self.combine_every = max(combine_every, 2)
+        self.filenames = []
+        self._values = {}
+
+    def add(self, pairs):
+        '''Add key/value pairs.'''
+        values = self._values
+        for key, value in pairs:
+            key_values = values.get(key)
+            if key_values is None:
+                values[key] = [value]
+                if len(values) >= self.max_keys:
+                    self.flush()
+                    values = self._values
+            else:
+                key_values.append(value)
+                if len(key_values) >= self.combine_every:
+                    values[key] = [self._combine(key, key_values)]
+
+    def flush(self):
+        '''Write the values so far to a new batch file.'''
+        if not self._values:
+            return
+        values = self._values
+        self._values = {}
+        combine = self._combine
+        pairs = ((key, combine(key, v) if len(v) > 1 else v[0])
+                 for key, v in sorted(values.iteritems()))
+        filename = self._new_filename()
+        write_batch(filename, pairs)
+        self.filenames.append(filename)
@@ -0,0 +1,102 @@
+# Copyright (C) 2016  Lars Wirzenius
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along
+# with this program; if not, write to the Free Software Foundation, Inc.,
+# 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+
+
+import os
+import shutil
+import tempfile
+import unittest
+
+import cliapp
+import cliapp.mapreduce
+
+
+class BatchTests(unittest.TestCase):
+
+    def setUp(self):
+        self.tempdir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.tempdir)
+
+    def filename(self, name):
+        return os.path.join(self.tempdir, name)
+
+    def test_reads_what_was_written(self):
+        pairs = [(i, 'value %d' % i) for i in range(2500)]
+        cliapp.write_batch(self.filename('a'), pairs)
+        self.assertEqual(list(cliapp.read_batch(self.filename('a'))), pairs)
+
+    def test_reads_empty_batch(self):
+        cliapp.write_batch(self.filename('a'), [])
+        self.assertEqual(list(cliapp.read_batch(self.filename('a'))), [])
+
+    def test_merges_batches_by_key(self):
+        cliapp.write_batch(self.filename('a'), [('a', 1), ('c', [3])])
+        cliapp.write_batch(self.filename('b'), [('b', 2), ('c', [1])])
+        cliapp.write_batch(self.filename('c'), [])
+        merged = cliapp.merge_batches(
+            [self.filename(x) for x in 'abc'])
+        self.assertEqual(list(merged),
+                         [('a', [1]), ('b', [2]), ('c', [[3], [1]])])
+
+    def test_merges_many_batches_a_few_at_a_time(self):
+        names = [self.filename('batch%d' % i) for i in range(10)]
+        for i, name in enumerate(names):
+            cliapp.write_batch(name, [('a', i), ('b%d' % (i % 3), i)])
+        merged = cliapp.merge_batches(names, fan_in=3)
+        self.assertEqual(list(merged),
+                         [('a', range(10)),
+                          ('b0', [0, 3, 6, 9]),
+                          ('b1', [1, 4, 7]),
+                          ('b2', [2, 5, 8])])
+        self.assertEqual(sorted(os.listdir(self.tempdir)),
+                         sorted(os.path.basename(name) for name in names))
+
+
+class PartialsTests(unittest.TestCase):
+
+    def setUp(self):
+        self.tempdir = tempfile.mkdtemp()
+        self.combined = []
+
+    def tearDown(self):
+        shutil.rmtree(self.tempdir)
+
+    def combine(self, key, values):
+        self.combined.append(len(values))
+        return sum(values)
+
+    def new_filename(self):
+        fd, filename = tempfile.mkstemp(dir=self.tempdir)
+        os.close(fd)
+        return filename
+
+    def test_combines_values_and_writes_batches(self):
+        partials = cliapp.mapreduce.Partials(
+            self.combine, self.new_filename, max_keys=10, combine_every=4)
+        partials.add((i // 40, 1) for i in range(1000))
+        partials.flush()
+        self.assertTrue(len(partials.filenames) > 1)
+        self.assertEqual(max(self.combined), 4)
+        merged = cliapp.merge_batches(partials.filenames)
+        self.assertEqual([(key, sum(values)) for key, values in merged],
+                         [(key, 40) for key in range(25)])
+
+    def test_writes_nothing_without_values(self):
+        partials = cliapp.mapreduce.Partials(self.combine, self.new_filename)
+        partials.flush()
+        self.assertEqual(partials.filenames, [])
@@ -0,0 +1,357 @@
+# Copyright (C) 2016  Lars Wirzenius
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along
+# with this program; if not, write to the Free Software Foundation, Inc.,
+# 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+
+
+import os
+import Queue
+import sys
+import threading
+
+
+class OutputWriter(object):
+
+    '''A file-like object that writes to another file in large blocks.
+
+    Writes are collected in memory until there are at least
+    ``buffer_size`` bytes, and then written to ``f`` with one call.
+    This makes writing many small records much cheaper.
+
+    If ``threaded`` is true, the blocks are written by a background
+    thread instead, so that the caller does not wait for a slow disk
+    or pipe, unless there are already ``queue_size`` blocks waiting
+    to be written. An error in the background thread is raised by the
+    next call to ``write``, ``flush``, or ``close``.
+
+    Closing the writer flushes it, and closes ``f`` as well, unless
+    ``close_file`` is false. Other attributes, such as ``name`` and
+    ``fileno``, are those of ``f``.
+
+    '''
+
+    def __init__(self, f, buffer_size=1024**2, threaded=False, queue_size=8,
+                 close_file=True):
+        self._file = f
+        self.buffer_size = buffer_size
+        self._close_file = close_file
+        self._chunks = []
+        self._buffered = 0
+        self._error = None
+        self.closed = False
+
+        self._queue = None
+        self._thread = None
+        if threaded:
+            self._queue = Queue.Queue(maxsize=max(queue_size, 1))
+            self._thread = threading.Thread(target=self._write_blocks)
+            self._thread.daemon = True
+            self._thread.start()
+
+    def __getattr__(self, attr):
+        return getattr(self._file, attr)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def write(self, data):
+        self._chunks.append(data)
+        self._buffered += len(data)
+        if self._buffered >= self.buffer_size:
+            self._write_buffer()
+
+    def writelines(self, seq):
+        for data in seq:
+            self._chunks.append(data)
+            self._buffered += len(data)
+        if self._buffered >= self.buffer_size:
+            self._write_buffer()
+
+    write_many = writelines
+
+    def flush(self):
+        self._write_buffer()
+        if self._queue is not None:
+            self._queue.join()
+            self._raise_error()
+        self._file.flush()
+
+    def close(self):
+        if self.closed:
+            return
+        self.closed = True
+        try:
+            self.flush()
+        finally:
+            if self._thread is not None:
+                self._queue.put(None)
+                self._thread.join()
+            if self._close_file:
+                self._file.close()
+
+    def discard(self):
+        '''Forget data that has not been written yet.
+
+        This is useful when the output is known to be broken, for
+        example after the reader of a pipe has gone away. If ``f`` has
+        a ``discard`` method, it is called as well.
+
+        '''
+
+        self._chunks = []
+        self._buffered = 0
+        discard = getattr(self._file, 'discard', None)
+        if discard is not None:
+            discard()
+
+    def _write_buffer(self):
+        if not self._chunks:
+            return
+        data = ''.join(self._chunks)
+        self._chunks = []
+        self._buffered = 0
+        if self._queue is None:
+            self._file.write(data)
+        else:
+            self._raise_error()
+            self._queue.put(data)
+
+    def _raise_error(self):
+        if self._error is not None:
+            raise self._error[0], self._error[1], self._error[2]
+
+    def _write_blocks(self):
+        while True:
+            data = self._queue.get()
+            try:
+                if data is None:
+                    return
+                # After an error, the rest of the output is dropped.
+                if self._error is None:
+                    self._file.write(data)
+            except Exception:
+                self._error = sys.exc_info()
+            finally:
+                self._queue.task_done()
+
+
+class ChunkedOutput(object):
+
+    '''A file-like object that splits output into numbered files.
+
+    The output is written to files named after ``filename``, with a
+    chunk number before the extension: ``report.txt`` becomes
+    ``report.00001.txt``, ``report.00002.txt``, and so on. A new chunk
+    is started when the current one has ``max_bytes`` bytes or
+    ``max_records`` lines, or more; zero means no limit. Chunks are
+    only ever split between lines.
+
+    Each chunk is written under a temporary name and renamed when it
+    is complete, so that other programs may start processing it while
+    the next one is being written. When the output is closed, a
+    manifest is written to ``filename`` with ``.manifest`` appended:
+    one line per chunk with its filename, its size in bytes, and its
+    number of lines, separated by spaces. The manifest thus means that
+    all chunks are complete: a manifest left by an earlier run is
+    removed when the first chunk is started, and none is written if
+    ``discard`` is called before closing, as is done when the
+    application fails.
+
+    ``open_chunk`` is called with a filename to open each chunk for
+    writing; it defaults to the built-in ``open``.
+
+    '''
+
+    def __init__(self, filename, max_bytes=0, max_records=0,
+                 open_chunk=None):
+        self.name = filename
+        self.max_bytes = max_bytes
+        self.max_records = max_records
+        self._open_chunk = open_chunk or (lambda name: open(name, 'w'))
+        self.chunks = []
+        self.closed = False
+        self.discarded = False
+
+        self._file = None
+        self._chunk_name = None
+        self._bytes = 0
+        self._records = 0
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def chunk_name(self, number):
+        '''Return the filename of a chunk, given its number.'''
+        root, ext = os.path.splitext(self.name)
+        return '%s.%05d%s' % (root, number, ext)
+
+    def write(self, data):
+        if not data:
+            return
+        if self._file is None:
+            self._start_chunk()
+        newlines = data.count('\n')
+        if not self._would_fill(len(data), newlines):
+            self._write(data, newlines)
+            return
+
+        # Slow path: find the line after which the chunk is full.
+        start = 0
+        while start < len(data):
+            end = data.find('\n', start)
+            if end < 0:
+                self._write(data[start:], 0)
+                break
+            end += 1
+            self._write(data[start:end], 1)
+            start = end
+            if self._is_full():
+                self._end_chunk()
+                if start < len(data):
+                    self._start_chunk()
+
+    def writelines(self, seq):
+        for data in seq:
+            self.write(data)
+
+    def flush(self):
+        if self._file is not None:
+            self._file.flush()
+
+    def state(self):
+        '''Return the state of the output, for continuing it later.
+
+        The state can be stored as JSON, and given to ``resume``. The
+        output should be flushed first.
+
+        '''
+
+        current = self._file is not None
+        return {
+            'chunks': [[os.path.basename(name), size, records]
+                       for name, size, records in self.chunks],
+            'bytes': self._bytes if current else 0,
+            'records': self._records if current else 0,
+        }
+
+    def resume(self, state):
+        '''Continue output from a state returned by ``state``.
+
+        The chunk that was being written when the state was saved is
+        truncated to where it was then, and written further. Chunks
+        written after it are removed. The chunk is reopened as a plain
+        file, so this does not work if ``open_chunk`` compresses
+        chunks.
+
+        '''
+
+        dirname = os.path.dirname(self.name)
+        self.chunks = [(os.path.join(dirname, basename), size, records)
+                       for basename, size, records in state['chunks']]
+        number = len(self.chunks) + 1
+        if state['bytes'] > 0:
+            name = self.chunk_name(number)
+            temp = self._temp_name(name)
+            if not os.path.exists(temp):
+                # The chunk was finished after the state was saved.
+                os.rename(name, temp)
+            self._file = open(temp, 'r+')
+            self._file.truncate(state['bytes'])
+            self._file.seek(state['bytes'])
+            self._chunk_name = name
+            self._bytes = state['bytes']
+            self._records = state['records']
+            number += 1
+        while True:
+            names = [self.chunk_name(number)]
+            names.append(self._temp_name(names[0]))
+            names = [name for name in names if os.path.exists(name)]
+            if not names:
+                break
+            for name in names:
+                os.remove(name)
+            number += 1
+
+    def discard(self):
+        '''Mark the output as incomplete.
+
+        Closing it after this leaves the current chunk under its
+        temporary name, and writes no manifest.
+
+        '''
+
+        self.discarded = True
+
+    def close(self):
+        if self.closed:
+            return
+        self.closed = True
+        if self.discarded:
+            if self._file is not None:
+                self._file.close()
+                self._file = None
+            return
+        if self._file is not None:
+            self._end_chunk()
+        manifest = self._manifest_name()
+        temp = self._temp_name(manifest)
+        with open(temp, 'w') as f:
+            for name, size, records in self.chunks:
+                f.write('%s %d %d\n' % (os.path.basename(name), size, records))
+        os.rename(temp, manifest)
+
+    def _would_fill(self, size, newlines):
+        return ((self.max_bytes and self._bytes + size >= self.max_bytes) or
+                (self.max_records and
+                 self._records + newlines >= self.max_records))
+
+    def _is_full(self):
+        return self._would_fill(0, 0)
+
+    def _write(self, data, newlines):
+        self._file.write(data)
+        self._bytes += len(data)
+        self._records += newlines
+
+    def _temp_name(self, name):
+        # Keep the extension, so that it can still be used to choose
+        # a compression format.
+        dirname, basename = os.path.split(name)
+        return os.path.join(dirname, '.tmp-' + basename)
+
+    def _manifest_name(self):
+        return self.name + '.manifest'
+
+    def _start_chunk(self):
+        if not self.chunks and os.path.exists(self._manifest_name()):
+            os.remove(self._manifest_name())
+        self._chunk_name = self.chunk_name(len(self.chunks) + 1)
+        self._file = self._open_chunk(self._temp_name(self._chunk_name))
+        self._bytes = 0
+        self._records = 0
+
+    def _end_chunk(self):
+        f = self._file
+        self._file = None
+        f.close()
+        os.rename(self._temp_name(self._chunk_name), self._chunk_name)
+        self.chunks.append(
+            (self._chunk_name, os.path.getsize(self._chunk_name),
+             self._records))
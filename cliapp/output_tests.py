@@ -0,0 +1,215 @@
+# Copyright (C) 2016  Lars Wirzenius
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along
+# with this program; if not, write to the Free Software Foundation, Inc.,
+# 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+
+
+import errno
+import os
+import shutil
+import StringIO
+import tempfile
+import unittest
+
+import cliapp
+
+
+class RecordingFile(StringIO.StringIO):
+
+    def __init__(self):
+        StringIO.StringIO.__init__(self)
+        self.writes = 0
+        self.contents = None
+
+    def write(self, data):
+        self.writes += 1
+        StringIO.StringIO.write(self, data)
+
+    def close(self):
+        self.contents = self.getvalue()
+        StringIO.StringIO.close(self)
+
+
+class BrokenFile(StringIO.StringIO):
+
+    def write(self, data):
+        raise IOError(errno.EPIPE, 'Broken pipe')
+
+
+class OutputWriterTests(unittest.TestCase):
+
+    def test_collects_small_writes_into_blocks(self):
+        f = RecordingFile()
+        w = cliapp.OutputWriter(f, buffer_size=100)
+        for i in range(100):
+            w.write('x' * 10)
+        w.close()
+        self.assertEqual(f.contents, 'x' * 1000)
+        self.assertEqual(f.writes, 10)
+
+    def test_writelines_and_write_many(self):
+        f = RecordingFile()
+        w = cliapp.OutputWriter(f, buffer_size=100)
+        w.writelines(['foo\n', 'bar\n'])
+        w.write_many(['foobar\n'])
+        self.assertEqual(f.writes, 0)
+        w.flush()
+        self.assertEqual(f.getvalue(), 'foo\nbar\nfoobar\n')
+        self.assertEqual(f.writes, 1)
+
+    def test_threaded_writer_writes_everything_in_order(self):
+        f = RecordingFile()
+        w = cliapp.OutputWriter(f, buffer_size=10, threaded=True,
+                                queue_size=2)
+        for i in range(1000):
+            w.write('%d\n' % i)
+        w.close()
+        self.assertEqual(f.contents, ''.join('%d\n' % i for i in range(1000)))
+
+    def test_threaded_writer_raises_error_from_thread(self):
+        w = cliapp.OutputWriter(BrokenFile(), buffer_size=1, threaded=True)
+        w.write('foo')
+        self.assertRaises(IOError, w.flush)
+        self.assertRaises(IOError, w.close)
+        self.assertTrue(w.closed)
+
+    def test_does_not_close_file_if_told_not_to(self):
+        f = RecordingFile()
+        w = cliapp.OutputWriter(f, close_file=False)
+        w.write('foo')
+        w.close()
+        self.assertEqual(f.getvalue(), 'foo')
+
+    def test_discard_forgets_buffered_data(self):
+        f = RecordingFile()
+        w = cliapp.OutputWriter(f)
+        w.write('foo')
+        w.discard()
+        w.close()
+        self.assertEqual(f.contents, '')
+
+    def test_delegates_other_attributes(self):
+        f = RecordingFile()
+        f.name = 'foo'
+        w = cliapp.OutputWriter(f)
+        self.assertEqual(w.name, 'foo')
+
+
+class ChunkedOutputTests(unittest.TestCase):
+
+    def setUp(self):
+        self.tempdir = tempfile.mkdtemp()
+        self.filename = os.path.join(self.tempdir, 'report.txt')
+
+    def tearDown(self):
+        shutil.rmtree(self.tempdir)
+
+    def read(self, basename):
+        with open(os.path.join(self.tempdir, basename)) as f:
+            return f.read()
+
+    def test_names_chunks_before_extension(self):
+        out = cliapp.ChunkedOutput(self.filename)
+        self.assertEqual(out.chunk_name(12),
+                         os.path.join(self.tempdir, 'report.00012.txt'))
+
+    def test_splits_by_records(self):
+        out = cliapp.ChunkedOutput(self.filename, max_records=2)
+        out.write('1\n2\n3\n')
+        out.writelines(['4\n', '5'])
+        out.close()
+        self.assertEqual(self.read('report.00001.txt'), '1\n2\n')
+        self.assertEqual(self.read('report.00002.txt'), '3\n4\n')
+        self.assertEqual(self.read('report.00003.txt'), '5')
+        self.assertEqual(
+            self.read('report.txt.manifest'),
+            'report.00001.txt 4 2\n'
+            'report.00002.txt 4 2\n'
+            'report.00003.txt 1 0\n')
+
+    def test_splits_by_bytes_only_between_lines(self):
+        out = cliapp.ChunkedOutput(self.filename, max_bytes=5)
+        out.write('foo')
+        out.write('bar\nx\n')
+        out.write('foobar\n')
+        out.close()
+        self.assertEqual(self.read('report.00001.txt'), 'foobar\n')
+        self.assertEqual(self.read('report.00002.txt'), 'x\nfoobar\n')
+        self.assertFalse(os.path.exists(
+            os.path.join(self.tempdir, 'report.00003.txt')))
+
+    def test_renames_chunk_only_when_complete(self):
+        out = cliapp.ChunkedOutput(self.filename, max_records=1)
+        out.write('foo')
+        self.assertEqual(os.listdir(self.tempdir), ['.tmp-report.00001.txt'])
+        out.write('\n')
+        self.assertEqual(os.listdir(self.tempdir), ['report.00001.txt'])
+        out.close()
+
+    def test_writes_no_manifest_when_discarded(self):
+        out = cliapp.ChunkedOutput(self.filename, max_records=1)
+        out.write('1\n2')
+        out.discard()
+        out.close()
+        self.assertEqual(sorted(os.listdir(self.tempdir)),
+                         ['.tmp-report.00002.txt', 'report.00001.txt'])
+
+    def test_application_writes_no_manifest_after_error(self):
+        with open(self.filename + '.manifest', 'w') as f:
+            f.write('report.00001.txt 2 1\n')
+
+        def process_args(args):
+            app.output.write('x\n' * 10)
+            raise cliapp.AppException('failing on purpose')
+
+        app = cliapp.Application()
+        app.process_args = process_args
+        self.assertRaises(
+            SystemExit, app.run,
+            args=['--output', self.filename, '--log=none',
+                  '--output-chunk-records=4', '--output-buffer-size=3'],
+            stderr=StringIO.StringIO())
+        self.assertFalse(os.path.exists(self.filename + '.manifest'))
+
+    def test_resumes_from_saved_state(self):
+        out = cliapp.ChunkedOutput(self.filename, max_records=2)
+        out.write('1\n2\n3\n')
+        out.flush()
+        state = out.state()
+        out.write('4\n5\n6\n7\n')
+        out.discard()
+        out.close()
+
+        out = cliapp.ChunkedOutput(self.filename, max_records=2)
+        out.resume(state)
+        out.write('four\n')
+        out.close()
+        self.assertEqual(sorted(os.listdir(self.tempdir)),
+                         ['report.00001.txt', 'report.00002.txt',
+                          'report.txt.manifest'])
+        self.assertEqual(self.read('report.00002.txt'), '3\nfour\n')
+        self.assertEqual(
+            self.read('report.txt.manifest'),
+            'report.00001.txt 4 2\n'
+            'report.00002.txt 7 2\n')
+
+    def test_application_splits_output(self):
+        app = cliapp.Application()
+        app.process_args = lambda args: app.output.write('x\n' * 10)
+        app.run(args=['--output', self.filename,
+                      '--output-chunk-records=4', '--output-buffer-size=3'])
+        self.assertEqual(self.read('report.txt.manifest'),
+                         'report.00001.txt 8 4\n'
+                         'report.00002.txt 8 4\n'
+                         'report.00003.txt 4 2\n')
@@ -0,0 +1,290 @@
+# Copyright (C) 2016  Lars Wirzenius
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along
+# with this program; if not, write to the Free Software Foundation, Inc.,
+# 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+
+
+import gc
+import itertools
+import logging
+import multiprocessing
+import signal
+import threading
+import traceback
+
+import cliapp
+
+
+# Functions run by the workers of each ForkPool, by pool key. The
+# workers are forked after a function is added here, so they find it
+# without it having to be pickled.
+_funcs = {}
+_keys = itertools.count()
+
+# The semaphore and event that ForkPool.broadcast uses to make every
+# worker take exactly one call, by pool key.
+_barriers = {}
+
+# In Python 2, waiting without a timeout in AsyncResult.get,
+# Queue.get, or Thread.join can't be interrupted with Ctrl-C, so
+# cliapp always gives this one.
+_forever = 365 * 24 * 60 * 60
+
+
+def _init_worker(log_queue=None):
+    # The parent handles Ctrl-C, and terminates the workers.
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    if log_queue is not None:
+        logger = logging.getLogger()
+        for handler in logger.handlers[:]:
+            logger.removeHandler(handler)
+        logger.addHandler(_QueueHandler(log_queue))
+
+
+def _call(key, arg):
+    try:
+        return 'ok', _funcs[key](arg)
+    except cliapp.AppException as e:
+        return 'app-error', str(e)
+    except Exception:
+        return 'error', traceback.format_exc()
+
+
+def _call_once(key, arg):
+    # A worker that is done waits for the others, so that it doesn't
+    # take a second call meant for another worker.
+    arrived, done = _barriers[key]
+    try:
+        return _call(key, arg)
+    finally:
+        arrived.release()
+        done.wait(_forever)
+
+
+def _call_chunk(item):
+    key, args = item
+    return [_call(key, arg) for arg in args]
+
+
+def _chunks(args, size):
+    args = iter(args)
+    while True:
+        chunk = list(itertools.islice(args, size))
+        if not chunk:
+            return
+        yield chunk
+
+
+class _QueueHandler(logging.Handler):
+
+    # Send log records from a worker to the parent, which logs them
+    # with its own handlers. Arguments and exceptions are formatted
+    # here, since they may not be picklable.
+
+    def __init__(self, queue):
+        logging.Handler.__init__(self)
+        self._queue = queue
+
+    def emit(self, record):
+        try:
+            record.msg = record.getMessage()
+            record.args = None
+            if record.exc_info:
+                record.exc_text = logging.Formatter().formatException(
+                    record.exc_info)
+                record.exc_info = None
+            self._queue.put(record)
+        except Exception:
+            self.handleError(record)
+
+
+def _forward_logs(queue):
+    while True:
+        record = queue.get()
+        if record is None:
+            return
+        logging.getLogger(record.name).handle(record)
+
+
+def _unwrap(result):
+    status, value = result
+    if status == 'app-error':
+        raise cliapp.AppException(value)
+    elif status == 'error':
+        raise Exception('Worker process failed:\n%s' % value)
+    return value
+
+
+def cpu_count():
+    '''Return number of CPUs, or 1 if it can't be determined.'''
+    try:
+        return multiprocessing.cpu_count()
+    except NotImplementedError:  # pragma: no cover
+        return 1
+
+
+class ForkPool(object):
+
+    '''A pool of worker processes that call a function.
+
+    The workers are forked when the pool is created, and inherit the
+    state of the parent process as it is at that moment: settings,
+    open files, loaded plugins, and so on. Thus ``func`` does not need
+    to be picklable: it may be a bound method or a closure. Only its
+    arguments and return values are pickled.
+
+    ``jobs`` is the number of workers; zero means one per CPU.
+
+    On Pythons that have ``gc.freeze``, the garbage collector is told
+    to leave alone the objects that exist when the workers are forked,
+    so that it doesn't write to, and thereby copy, the memory they
+    share with the parent.
+
+    If ``log_to_parent`` is true, what the workers log is sent to the
+    parent process, and logged with its handlers, instead of being
+    written directly by the handlers the workers inherited. This
+    keeps log files from being written, or rotated, by several
+    processes at once.
+
+    If ``func`` raises ``cliapp.AppException``, the same error is
+    raised in the parent when the result is fetched. Other exceptions
+    are raised in the parent as an exception with the stack trace from
+    the worker.
+
+    '''
+
+    def __init__(self, func, jobs, log_to_parent=False):
+        self.jobs = jobs or cpu_count()
+        self._key = next(_keys)
+        _funcs[self._key] = func
+        _barriers[self._key] = (multiprocessing.Semaphore(0),
+                                multiprocessing.Event())
+
+        self._log_queue = None
+        self._log_thread = None
+        if log_to_parent:
+            self._log_queue = multiprocessing.Queue()
+            self._log_thread = threading.Thread(
+                target=_forward_logs, args=(self._log_queue,))
+            self._log_thread.daemon = True
+            self._log_thread.start()
+
+        freeze = getattr(gc, 'freeze', None)
+        if freeze is not None:  # pragma: no cover
+            freeze()
+        try:
+            self._pool = multiprocessing.Pool(
+                self.jobs, initializer=_init_worker,
+                initargs=(self._log_queue,))
+        finally:
+            if freeze is not None:  # pragma: no cover
+                gc.unfreeze()
+
+    def apply_async(self, arg):
+        '''Start calling func(arg) in a worker; return a result.
+
+        The result object has a ``get`` method, which waits for the
+        call to finish and returns its return value.
+
+        '''
+
+        return _Result(self._pool.apply_async(_call, (self._key, arg)))
+
+    def broadcast(self, arg):
+        '''Call func(arg) once in every worker; return the results.
+
+        This waits for the work that was started before, since every
+        worker has to be free. Errors are raised as by the ``get``
+        method of ``apply_async`` results.
+
+        '''
+
+        arrived, done = _barriers[self._key]
+        results = [self._pool.apply_async(_call_once, (self._key, arg))
+                   for i in range(self.jobs)]
+        for i in range(self.jobs):
+            arrived.acquire(True, _forever)
+        done.set()
+        try:
+            return [_unwrap(result.get(_forever)) for result in results]
+        finally:
+            done.clear()
+
+    def imap(self, args, chunksize=1, ordered=True):
+        '''Generate func(arg) for each arg, calling func in workers.
+
+        The args are sent to the workers ``chunksize`` at a time. If
+        ``ordered`` is false, results are generated as soon as they
+        are ready, instead of in the order of the args. Errors are
+        raised as by the ``get`` method of ``apply_async`` results.
+
+        '''
+
+        # The pool's own chunking would hide the iterator that takes a
+        # timeout, so args are sent to it in chunks instead.
+        items = itertools.izip(itertools.repeat(self._key),
+                               _chunks(args, max(chunksize, 1)))
+        if ordered:
+            results = self._pool.imap(_call_chunk, items)
+        else:
+            results = self._pool.imap_unordered(_call_chunk, items)
+        while True:
+            try:
+                chunk = results.next(_forever)
+            except StopIteration:
+                return
+            for result in chunk:
+                yield _unwrap(result)
+
+    def close(self):
+        '''Wait for workers to finish all work, then stop them.'''
+        self._pool.close()
+        self._pool.join()
+        _funcs.pop(self._key, None)
+        _barriers.pop(self._key, None)
+        self._stop_logging(_forever)
+
+    def terminate(self):
+        '''Stop workers immediately.'''
+        self._pool.terminate()
+        self._pool.join()
+        _funcs.pop(self._key, None)
+        _barriers.pop(self._key, None)
+        # A killed worker may have left a record half written, so
+        # don't wait long for the rest.
+        self._stop_logging(1)
+
+    def _stop_logging(self, timeout):
+        if self._log_thread is not None:
+            self._log_queue.put(None)
+            self._log_thread.join(timeout)
+            self._log_thread = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, tb):
+        if exc_type is None:
+            self.close()
+        else:
+            self.terminate()
+
+
+class _Result(object):
+
+    def __init__(self, async_result):
+        self._async_result = async_result
+
+    def get(self):
+        return _unwrap(self._async_result.get(_forever))
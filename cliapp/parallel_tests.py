@@ -0,0 +1,128 @@
+# Copyright (C) 2016  Lars Wirzenius
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along
+# with this program; if not, write to the Free Software Foundation, Inc.,
+# 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+
+
+import logging
+import os
+import time
+import unittest
+
+import cliapp
+
+
+class ForkPoolTests(unittest.TestCase):
+
+    def test_runs_closure_in_other_process(self):
+        offset = 10
+
+        def func(x):
+            return os.getpid(), x + offset
+
+        with cliapp.ForkPool(func, 2) as pool:
+            results = [pool.apply_async(i) for i in range(5)]
+            values = [r.get() for r in results]
+        self.assertEqual([v for pid, v in values], range(10, 15))
+        self.assertFalse(os.getpid() in [pid for pid, v in values])
+
+    def test_defaults_to_one_worker_per_cpu(self):
+        with cliapp.ForkPool(abs, 0) as pool:
+            self.assertEqual(pool.jobs, cliapp.parallel.cpu_count())
+
+    def test_raises_app_exception_from_worker(self):
+        def func(x):
+            raise cliapp.AppException('bad %s' % x)
+
+        with cliapp.ForkPool(func, 1) as pool:
+            result = pool.apply_async('thing')
+            try:
+                result.get()
+            except cliapp.AppException as e:
+                self.assertEqual(str(e), 'bad thing')
+            else:
+                self.fail('no exception raised')
+
+    def test_raises_other_exceptions_from_worker_with_stack_trace(self):
+        def func(x):
+            raise ValueError('bad %s' % x)
+
+        with cliapp.ForkPool(func, 1) as pool:
+            result = pool.apply_async('thing')
+            try:
+                result.get()
+            except cliapp.AppException:
+                self.fail('wrong exception raised')
+            except Exception as e:
+                self.assertTrue('ValueError: bad thing' in str(e))
+
+    def test_broadcasts_to_every_worker_once(self):
+        def func(x):
+            time.sleep(0.01)
+            return os.getpid(), x
+
+        with cliapp.ForkPool(func, 3) as pool:
+            results = [pool.apply_async(i) for i in range(10)]
+            pids = [pid for pid, x in pool.broadcast('all')]
+            self.assertEqual(len(set(pids)), 3)
+            self.assertEqual([r.get()[1] for r in results], range(10))
+            self.assertEqual(sorted(pid for pid, x in pool.broadcast('again')),
+                             sorted(pids))
+
+    def test_maps_items_in_order(self):
+        with cliapp.ForkPool(lambda x: x * 2, 3) as pool:
+            self.assertEqual(list(pool.imap(xrange(100), chunksize=7)),
+                             range(0, 200, 2))
+
+    def test_maps_items_in_any_order(self):
+        with cliapp.ForkPool(lambda x: x * 2, 3) as pool:
+            self.assertEqual(sorted(pool.imap(xrange(100), ordered=False)),
+                             range(0, 200, 2))
+
+    def test_raises_error_from_map(self):
+        def func(x):
+            if x == 5:
+                raise cliapp.AppException('bad %s' % x)
+            return x
+
+        with cliapp.ForkPool(func, 2) as pool:
+            self.assertRaises(cliapp.AppException, list,
+                              pool.imap(range(10)))
+
+    def test_sends_logs_to_parent(self):
+        records = []
+
+        class Handler(logging.Handler):
+
+            def emit(self, record):
+                records.append(record)
+
+        def func(x):
+            logging.warning('item %s', x)
+            return x
+
+        logger = logging.getLogger()
+        level = logger.level
+        handler = Handler()
+        logger.addHandler(handler)
+        logger.setLevel(logging.INFO)
+        try:
+            with cliapp.ForkPool(func, 2, log_to_parent=True) as pool:
+                self.assertEqual(list(pool.imap(range(5))), range(5))
+        finally:
+            logger.removeHandler(handler)
+            logger.setLevel(level)
+        self.assertEqual(sorted(r.getMessage() for r in records),
+                         ['item %d' % i for i in range(5)])
+        self.assertFalse(os.getpid() in [r.process for r in records])
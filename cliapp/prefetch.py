@@ -0,0 +1,122 @@
+# Copyright (C) 2016  Lars Wirzenius
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along
+# with this program; if not, write to the Free Software Foundation, Inc.,
+# 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+
+
+import logging
+import os
+import Queue
+import sys
+import threading
+
+from cliapp.parallel import _forever
+
+
+class Prefetcher(object):
+
+    '''Warm up input files before they are needed.
+
+    Iterating over a Prefetcher gives the names from ``names``, in
+    order. Meanwhile, a background thread reads ahead up to ``depth``
+    files beyond the one the caller is working on, so that they are
+    in the kernel's page cache by the time the caller opens them.
+    This overlaps slow I/O, such as from network filesystems or
+    spinning disks, with the caller's processing.
+
+    At most ``max_bytes`` are read ahead in total, split evenly
+    between the files, so that the read-ahead does not push out of
+    the cache data that is still needed. Only regular files are read
+    ahead; other names are just passed through.
+
+    ``names`` may be any iterable, and is consumed lazily, in the
+    background thread.
+
+    Call ``stop`` if iteration is abandoned before the end.
+
+    '''
+
+    chunk_size = 1024**2
+
+    def __init__(self, names, depth, max_bytes):
+        self._names = names
+        self._limit = max(max_bytes // max(depth, 1), 0)
+        self._queue = Queue.Queue(maxsize=max(depth, 1))
+        self._stopping = False
+        self._thread = threading.Thread(target=self._prefetch)
+        self._thread.daemon = True
+        self._thread.start()
+
+    def __iter__(self):
+        try:
+            while True:
+                kind, value = self._queue.get(True, _forever)
+                if kind == 'end':
+                    break
+                elif kind == 'error':
+                    raise value[0], value[1], value[2]
+                yield value
+        finally:
+            self.stop()
+
+    def stop(self):
+        '''Stop reading ahead.'''
+        self._stopping = True
+        while self._thread.is_alive():
+            try:
+                self._queue.get(True, 0.1)
+            except Queue.Empty:
+                pass
+        self._thread.join()
+
+    def _prefetch(self):
+        try:
+            for name in self._names:
+                if self._stopping:
+                    return
+                self._put(('name', name))
+                self.warm(name)
+        except BaseException:
+            self._put(('error', sys.exc_info()))
+            return
+        self._put(('end', None))
+
+    def _put(self, item):
+        while not self._stopping:
+            try:
+                self._queue.put(item, True, 0.1)
+                return
+            except Queue.Full:
+                pass
+
+    def warm(self, name):
+        '''Get the start of a file into the page cache.'''
+
+        if not self._limit or name == '-' or not os.path.isfile(name):
+            return
+        try:
+            with open(name, 'rb') as f:
+                if hasattr(os, 'posix_fadvise'):  # pragma: no cover
+                    os.posix_fadvise(
+                        f.fileno(), 0, self._limit, os.POSIX_FADV_WILLNEED)
+                    return
+                remaining = self._limit
+                while remaining > 0 and not self._stopping:
+                    data = f.read(min(self.chunk_size, remaining))
+                    if not data:
+                        break
+                    remaining -= len(data)
+        except (IOError, OSError) as e:
+            # The caller will get the error when it opens the file.
+            logging.debug('could not read ahead %s: %s', name, e)
@@ -0,0 +1,90 @@
+# Copyright (C) 2016  Lars Wirzenius
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along
+# with this program; if not, write to the Free Software Foundation, Inc.,
+# 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+
+
+import os
+import shutil
+import tempfile
+import threading
+import unittest
+
+import cliapp
+
+
+class RecordingPrefetcher(cliapp.Prefetcher):
+
+    def __init__(self, *args, **kwargs):
+        self.warmed = []
+        self.lock = threading.Lock()
+        cliapp.Prefetcher.__init__(self, *args, **kwargs)
+
+    def warm(self, name):
+        with self.lock:
+            self.warmed.append(name)
+        cliapp.Prefetcher.warm(self, name)
+
+
+class PrefetcherTests(unittest.TestCase):
+
+    def setUp(self):
+        self.tempdir = tempfile.mkdtemp()
+        self.names = []
+        for i in range(10):
+            name = os.path.join(self.tempdir, str(i))
+            with open(name, 'w') as f:
+                f.write('x' * 1000)
+            self.names.append(name)
+
+    def tearDown(self):
+        shutil.rmtree(self.tempdir)
+
+    def test_returns_names_in_order(self):
+        names = self.names + ['-', '/nonexistent']
+        p = cliapp.Prefetcher(iter(names), 3, 1024)
+        self.assertEqual(list(p), names)
+
+    def test_stays_at_most_depth_files_ahead(self):
+        p = RecordingPrefetcher(self.names, 2, 1024)
+        for i, name in enumerate(p):
+            with p.lock:
+                self.assertTrue(len(p.warmed) <= i + 4)
+        self.assertEqual(p.warmed, self.names)
+
+    def test_can_be_abandoned_early(self):
+        p = cliapp.Prefetcher(self.names, 2, 1024)
+        for name in p:
+            break
+        p.stop()
+
+    def test_raises_errors_from_names_iterator(self):
+        def names():
+            yield 'foo'
+            raise cliapp.AppException('bad list')
+
+        p = cliapp.Prefetcher(names(), 2, 1024)
+        self.assertRaises(cliapp.AppException, list, p)
+
+    def test_application_processes_all_prefetched_inputs(self):
+        names = []
+
+        class App(cliapp.Application):
+
+            def process_input(self, name):
+                names.append(name)
+
+        app = App()
+        app.run(args=['--prefetch-files=3'] + self.names)
+        self.assertEqual(names, self.names)
@@ -0,0 +1,159 @@
+# Copyright (C) 2016  Lars Wirzenius
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along
+# with this program; if not, write to the Free Software Foundation, Inc.,
+# 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+
+
+import struct
+
+import cliapp
+
+
+class RecordReader(object):
+
+    '''Read binary records from a file, in large blocks.
+
+    ``mode`` is one of:
+
+    * ``fixed``: every record is ``size`` bytes long
+    * ``length32``: every record is preceded by its length, as a
+      4-byte unsigned integer, big-endian unless ``byteorder`` is
+      ``little``
+    * ``varint``: every record is preceded by its length, as an
+      unsigned base-128 varint (as in Protocol Buffers)
+    * ``delimited``: records are separated by ``delimiter``, which is
+      not included in the records
+
+    The file is read in blocks of about ``block_size`` bytes (larger
+    if a record doesn't fit), and records are returned as
+    ``memoryview`` slices of each block, without copying them. A
+    record stays valid after the next block has been read; use its
+    ``tobytes`` method to get a string.
+
+    ``offset`` is the number of bytes read from the file for the
+    records returned so far.
+
+    '''
+
+    def __init__(self, f, mode, size=0, delimiter='\n', byteorder='big',
+                 block_size=1024**2):
+        self._file = f
+        self._split = getattr(self, '_split_' + mode)
+        self.mode = mode
+        self.size = size
+        self.delimiter = delimiter
+        self._length = struct.Struct('<I' if byteorder == 'little' else '>I')
+        self.block_size = block_size
+        self.offset = 0
+        if mode == 'fixed' and size <= 0:
+            raise cliapp.AppException(
+                'Size of fixed-size records must be positive')
+        if mode == 'delimited' and not delimiter:
+            raise cliapp.AppException('Record delimiter must not be empty')
+
+    def blocks(self):
+        '''Generate lists of records, one list per block read.'''
+
+        carry = ''
+        needed = 0
+        while True:
+            size = max(self.block_size, len(carry) + needed)
+            buf = bytearray(size)
+            buf[:len(carry)] = carry
+            n = len(carry) + self._read_into(buf, len(carry))
+            at_end = n == len(carry)
+            records, used, needed = self._split(buf, n, at_end)
+            if used == 0 and at_end:
+                if n > 0:
+                    raise cliapp.AppException(
+                        '%s: truncated record at end of file' %
+                        getattr(self._file, 'name', 'input'))
+                return
+            carry = buf[used:n]
+            self.offset += used
+            if records:
+                yield records
+
+    def _read_into(self, buf, start):
+        view = memoryview(buf)[start:]
+        if hasattr(self._file, 'readinto'):
+            return self._file.readinto(view)
+        data = self._file.read(len(view))
+        view[:len(data)] = data
+        return len(data)
+
+    # Each _split_* method returns the records in buf[:n], the number
+    # of bytes they used, and how many more bytes are needed to get
+    # the next record, if known.
+
+    def _split_fixed(self, buf, n, at_end):
+        view = memoryview(buf)
+        size = self.size
+        used = n - n % size
+        records = [view[i:i + size] for i in xrange(0, used, size)]
+        return records, used, size
+
+    def _split_length32(self, buf, n, at_end):
+        view = memoryview(buf)
+        records = []
+        pos = 0
+        unpack_from = self._length.unpack_from
+        while pos + 4 <= n:
+            length = unpack_from(buf, pos)[0]
+            end = pos + 4 + length
+            if end > n:
+                return records, pos, end - pos
+            records.append(view[pos + 4:end])
+            pos = end
+        return records, pos, 4
+
+    def _split_varint(self, buf, n, at_end):
+        view = memoryview(buf)
+        records = []
+        pos = 0
+        while pos < n:
+            length = 0
+            shift = 0
+            i = pos
+            while i < n:
+                byte = buf[i]
+                i += 1
+                length |= (byte & 0x7f) << shift
+                shift += 7
+                if not byte & 0x80:
+                    break
+            else:
+                return records, pos, 10
+            if i + length > n:
+                return records, pos, i + length - pos
+            records.append(view[i:i + length])
+            pos = i + length
+        return records, pos, 10
+
+    def _split_delimited(self, buf, n, at_end):
+        view = memoryview(buf)
+        records = []
+        delimiter = self.delimiter
+        pos = 0
+        while True:
+            end = buf.find(delimiter, pos, n)
+            if end < 0:
+                break
+            records.append(view[pos:end])
+            pos = end + len(delimiter)
+        if at_end and pos < n:
+            records.append(view[pos:n])
+            pos = n
+        # The next record may be longer than a block.
+        return records, pos, (n - pos) * 2
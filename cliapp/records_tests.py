@@ -0,0 +1,109 @@
+# Copyright (C) 2016  Lars Wirzenius
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along
+# with this program; if not, write to the Free Software Foundation, Inc.,
+# 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+
+
+import StringIO
+import struct
+import unittest
+
+import cliapp
+
+
+class RecordReaderTests(unittest.TestCase):
+
+    def setUp(self):
+        self.records = ['', 'a', 'foo bar', 'x' * 300, 'last']
+
+    def read(self, data, mode, block_sizes=(1, 3, 7, 100, 4096), **kwargs):
+        result = None
+        for block_size in block_sizes:
+            reader = cliapp.RecordReader(
+                StringIO.StringIO(data), mode, block_size=block_size,
+                **kwargs)
+            records = []
+            for block in reader.blocks():
+                for record in block:
+                    self.assertEqual(type(record), memoryview)
+                    records.append(record.tobytes())
+            self.assertEqual(reader.offset, len(data))
+            if result is not None:
+                self.assertEqual(records, result)
+            result = records
+        return result
+
+    def varint(self, n):
+        result = ''
+        while n > 0x7f:
+            result += chr(n & 0x7f | 0x80)
+            n >>= 7
+        return result + chr(n)
+
+    def test_reads_fixed_size_records(self):
+        self.assertEqual(self.read('abcdefghi', 'fixed', size=3),
+                         ['abc', 'def', 'ghi'])
+
+    def test_reads_records_with_32_bit_lengths(self):
+        data = ''.join(struct.pack('>I', len(r)) + r for r in self.records)
+        self.assertEqual(self.read(data, 'length32'), self.records)
+
+    def test_reads_little_endian_lengths(self):
+        data = ''.join(struct.pack('<I', len(r)) + r for r in self.records)
+        self.assertEqual(self.read(data, 'length32', byteorder='little'),
+                         self.records)
+
+    def test_reads_records_with_varint_lengths(self):
+        data = ''.join(self.varint(len(r)) + r for r in self.records)
+        self.assertEqual(self.read(data, 'varint'), self.records)
+
+    def test_reads_delimited_records(self):
+        data = '\0\0'.join(self.records)
+        self.assertEqual(self.read(data, 'delimited', delimiter='\0\0'),
+                         self.records)
+        self.assertEqual(self.read(data + '\0\0', 'delimited',
+                                   delimiter='\0\0'),
+                         self.records)
+
+    def test_reads_empty_file(self):
+        for mode in ['fixed', 'length32', 'varint', 'delimited']:
+            self.assertEqual(self.read('', mode, size=1), [])
+
+    def test_records_stay_valid_after_next_block(self):
+        reader = cliapp.RecordReader(
+            StringIO.StringIO('abcdefgh'), 'fixed', size=2, block_size=4)
+        records = [r for block in reader.blocks() for r in block]
+        self.assertEqual([r.tobytes() for r in records],
+                         ['ab', 'cd', 'ef', 'gh'])
+
+    def test_reads_real_files_into_buffers(self):
+        with open(__file__, 'rb') as f:
+            reader = cliapp.RecordReader(f, 'delimited', block_size=64)
+            records = [r.tobytes() for b in reader.blocks() for r in b]
+        with open(__file__, 'rb') as f:
+            self.assertEqual(records, f.read().split('\n')[:-1])
+
+    def test_raises_error_for_truncated_record(self):
+        for data, mode in [('abcd', 'fixed'),
+                           (struct.pack('>I', 5) + 'abc', 'length32'),
+                           ('\x85', 'varint'),
+                           ('\x05abc', 'varint')]:
+            self.assertRaises(cliapp.AppException, self.read, data, mode,
+                              size=3)
+
+    def test_rejects_bad_parameters(self):
+        self.assertRaises(cliapp.AppException, cliapp.RecordReader,
+                          StringIO.StringIO(''), 'fixed', size=0)
+        self.assertRaises(cliapp.AppException, cliapp.RecordReader,
+                          StringIO.StringIO(''), 'delimited', delimiter='')
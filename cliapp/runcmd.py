@@ -16,12 +16,22 @@
 # 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
 
 
+import collections
+import ctypes
+import ctypes.util
 import errno
 import fcntl
 import logging
+import multiprocessing.pool
 import os
+import platform
+import resource
 import select
+import signal
+import struct
 import subprocess
+import threading
+import traceback
 
 import cliapp
 
@@ -38,8 +48,19 @@ def runcmd(argv, *args, **kwargs):
     non-zero exit code. ``*args`` and ``**kwargs`` are passed
     onto ``subprocess.Popen``.
 
+    It is safe to call ``runcmd`` from several threads at once. The
+    pipes it creates are close-on-exec, and are only ever inherited
+    by the processes in the pipeline they were created for.
+
     '''
 
+    opts = _pop_check_options(kwargs)
+    exit_code, out, err = runcmd_unchecked(argv, *args, **kwargs)
+    _check_exit(argv, exit_code, out, err, opts)
+    return out
+
+
+def _pop_check_options(kwargs):
     our_options = (
         ('ignore_fail', False),
         ('log_error', True),
@@ -50,10 +71,12 @@ def runcmd(argv, *args, **kwargs):
         if name in kwargs:
             opts[name] = kwargs[name]
             del kwargs[name]
+    return opts
 
-    exit_code, out, err = runcmd_unchecked(argv, *args, **kwargs)
+
+def _check_exit(argv, exit_code, out, err, opts):
     if exit_code != 0:
-        msg = 'Command failed: %s\n%s\n%s' % (' '.join(argv), out, err)
+        msg = 'Command failed: %s\n%s\n%s' % (_format_argv(argv), out, err)
         if opts['ignore_fail']:
             if opts['log_error']:
                 logging.info(msg)
@@ -61,7 +84,6 @@ def runcmd(argv, *args, **kwargs):
             if opts['log_error']:
                 logging.error(msg)
             raise cliapp.AppException(msg)
-    return out
 
 
 def runcmd_unchecked(argv, *argvs, **kwargs):
@@ -70,12 +92,41 @@ def runcmd_unchecked(argv, *argvs, **kwargs):
     Return the exit code, and contents of standard output and error
     of the command.
 
+    The following keyword arguments set up each external command in
+    the pipeline, in the child process, before it is executed:
+
+    * ``rlimits`` is a dict of resource limits, for example
+      ``{'cpu': 60, 'as': 2**30, 'nofile': 1024}``. The keys are
+      names of ``RLIMIT_*`` constants in the ``resource`` module, in
+      lower case, without the prefix. The values are either the soft
+      limit (keeping the current hard limit) or a tuple of soft and
+      hard limit.
+    * ``nice`` is added to the nice level of the child.
+    * ``ionice_class`` is the I/O scheduling class: one of ``none``,
+      ``realtime``, ``best-effort``, ``idle``; ``ionice_priority`` is
+      the priority within the class, from 0 (highest) to 7.
+    * ``cpu_affinity`` is a list of CPU numbers, or a string such as
+      ``0-3,6``, to which the child is restricted.
+
+    If ``admission`` is set to a ``cliapp.AdmissionController``, the
+    pipeline is started only once the controller admits it, and holds
+    one of its slots while it runs.
+
     See also ``runcmd``.
 
     '''
 
     argvs = [argv] + list(argvs)
-    logging.debug('run external command: %r', argvs)
+    # The module-level logging functions take the logging module lock
+    # (to call basicConfig if there are no handlers) even when the
+    # message is not wanted, and writing a record takes the handler
+    # locks, which every thread running commands would contend for.
+    # So only log when the record will be written. Nothing is logged
+    # while _fork_lock is held, or in the child before it executes
+    # the command, so a logging lock held by another thread at fork
+    # time can't deadlock the child.
+    if logging.getLogger().isEnabledFor(logging.DEBUG):
+        logging.debug('run external command: %r', argvs)
 
     def pop_kwarg(name, default):
         if name in kwargs:
@@ -95,21 +146,362 @@ def runcmd_unchecked(argv, *argvs, **kwargs):
     stdout_callback = pop_kwarg('stdout_callback', noop)
     stderr_callback = pop_kwarg('stderr_callback', noop)
 
-    try:
-        pipeline = _build_pipeline(argvs,
-                                   pipe_stdin,
-                                   pipe_stdout,
-                                   pipe_stderr,
-                                   kwargs)
-        return _run_pipeline(pipeline, feed_stdin, pipe_stdin,
-                             pipe_stdout, pipe_stderr,
-                             stdout_callback, stderr_callback)
-    except OSError, e:  # pragma: no cover
-        if e.errno == errno.ENOENT and e.filename is None:
-            e.filename = argv[0]
-            raise e
+    child_setup = _ChildSetup(
+        rlimits=pop_kwarg('rlimits', None),
+        nice=pop_kwarg('nice', 0),
+        ionice_class=pop_kwarg('ionice_class', None),
+        ionice_priority=pop_kwarg('ionice_priority', None),
+        cpu_affinity=pop_kwarg('cpu_affinity', None))
+    if child_setup.needed():
+        kwargs['preexec_fn'] = child_setup.make_preexec_fn(
+            kwargs.get('preexec_fn'))
+
+    admission = pop_kwarg('admission', None)
+
+    def run():
+        try:
+            pipeline = _build_pipeline(argvs,
+                                       pipe_stdin,
+                                       pipe_stdout,
+                                       pipe_stderr,
+                                       kwargs)
+            return _run_pipeline(pipeline, feed_stdin, pipe_stdin,
+                                 pipe_stdout, pipe_stderr,
+                                 stdout_callback, stderr_callback)
+        except OSError, e:  # pragma: no cover
+            if e.errno == errno.ENOENT and e.filename is None:
+                e.filename = _format_argv(argv)
+                raise e
+            else:
+                raise
+
+    if admission is None:
+        return run()
+    with admission.admit():
+        return run()
+
+
+class _ChildSetup(object):
+
+    '''Resource limits and scheduling for a child process.
+
+    Everything is computed and checked in the parent. The function
+    returned by ``make_preexec_fn`` runs in the child between fork and
+    exec, where it must not take locks, import modules, or log, since
+    another thread may have held a lock at the time of the fork.
+
+    '''
+
+    ionice_classes = {
+        'none': 0,
+        'realtime': 1,
+        'best-effort': 2,
+        'idle': 3,
+    }
+
+    # Linux system call numbers for ioprio_set, which has no wrapper
+    # in the C library or in Python.
+    ioprio_set_syscalls = {
+        'x86_64': 251,
+        'i386': 289,
+        'i686': 289,
+        'aarch64': 30,
+        'riscv64': 30,
+        'armv7l': 314,
+        'ppc64': 273,
+        'ppc64le': 273,
+        's390x': 282,
+    }
+
+    def __init__(self, rlimits=None, nice=0, ionice_class=None,
+                 ionice_priority=None, cpu_affinity=None):
+        self.rlimits = self._parse_rlimits(rlimits or {})
+        self.nice = nice
+        self.ioprio = self._parse_ionice(ionice_class, ionice_priority)
+        self.cpus = self._parse_cpu_list(cpu_affinity)
+        self._libc = None
+        if self.ioprio is not None or self.cpus is not None:
+            self._libc = self._load_libc()
+
+    def needed(self):
+        return bool(self.rlimits or self.nice or self.ioprio is not None or
+                    self.cpus is not None)
+
+    def _parse_rlimits(self, rlimits):
+        parsed = []
+        for name, value in sorted(rlimits.items()):
+            const_name = 'RLIMIT_%s' % name.upper()
+            if not hasattr(resource, const_name):
+                raise cliapp.AppException(
+                    'Unknown resource limit %s' % name)
+            which = getattr(resource, const_name)
+            if isinstance(value, tuple):
+                soft, hard = value
+            else:
+                soft = value
+                _, hard = resource.getrlimit(which)
+            parsed.append((which, (soft, hard)))
+        return parsed
+
+    def _parse_ionice(self, ionice_class, ionice_priority):
+        if ionice_class is None and ionice_priority is None:
+            return None
+        if ionice_class is None:
+            ionice_class = 'best-effort'
+        if ionice_class not in self.ionice_classes:
+            raise cliapp.AppException(
+                'Unknown I/O scheduling class %s' % ionice_class)
+        klass = self.ionice_classes[ionice_class]
+        if klass == 0:
+            return None
+        if ionice_priority is None:
+            ionice_priority = 4
+        if not 0 <= ionice_priority <= 7:
+            raise cliapp.AppException(
+                'I/O scheduling priority must be 0 to 7, not %s' %
+                ionice_priority)
+        return (klass << 13) | (ionice_priority if klass != 3 else 0)
+
+    def _parse_cpu_list(self, cpu_affinity):
+        if cpu_affinity is None or cpu_affinity == '':
+            return None
+        if not isinstance(cpu_affinity, basestring):
+            return sorted(set(int(cpu) for cpu in cpu_affinity))
+        cpus = set()
+        try:
+            for part in cpu_affinity.split(','):
+                if '-' in part:
+                    first, last = part.split('-', 1)
+                    cpus.update(range(int(first), int(last) + 1))
+                else:
+                    cpus.add(int(part))
+        except ValueError:
+            raise cliapp.AppException(
+                'Malformed CPU list %s' % cpu_affinity)
+        return sorted(cpus)
+
+    def _load_libc(self):
+        if platform.system() != 'Linux':  # pragma: no cover
+            raise cliapp.AppException(
+                'I/O scheduling and CPU affinity for child processes are '
+                'only supported on Linux')
+        return ctypes.CDLL(ctypes.util.find_library('c'), use_errno=True)
+
+    def make_preexec_fn(self, other_preexec_fn):
+        rlimits = self.rlimits
+        nice = self.nice
+        libc = self._libc
+
+        ioprio_args = None
+        if self.ioprio is not None:
+            syscall = self.ioprio_set_syscalls.get(platform.machine())
+            if syscall is None:  # pragma: no cover
+                raise cliapp.AppException(
+                    'Setting I/O scheduling class is not supported on %s' %
+                    platform.machine())
+            ioprio_who_process = 1
+            ioprio_args = (syscall, ioprio_who_process, 0, self.ioprio)
+
+        affinity_args = None
+        if self.cpus is not None:
+            bits = 8 * ctypes.sizeof(ctypes.c_ulong)
+            mask = (ctypes.c_ulong * (max(self.cpus) // bits + 1))()
+            for cpu in self.cpus:
+                mask[cpu // bits] |= 1 << (cpu % bits)
+            affinity_args = (0, ctypes.sizeof(mask), ctypes.byref(mask))
+
+        def check(result):
+            if result != 0:
+                e = ctypes.get_errno()
+                raise OSError(e, os.strerror(e))
+
+        def preexec_fn():
+            for which, limits in rlimits:
+                resource.setrlimit(which, limits)
+            if nice:
+                os.nice(nice)
+            if ioprio_args is not None:
+                check(libc.syscall(*ioprio_args))
+            if affinity_args is not None:
+                check(libc.sched_setaffinity(*affinity_args))
+            if other_preexec_fn is not None:
+                other_preexec_fn()
+
+        return preexec_fn
+
+
+def _format_argv(argv):
+    if isinstance(argv, PyStage):
+        return str(argv)
+    return ' '.join(argv)
+
+
+class PyStage(object):
+
+    '''A pipeline stage run as Python code, in a thread.
+
+    Example: ``runcmd(['producer'], PyStage(func), ['consumer'])``
+
+    ``func`` is a generator function. It gets called with an iterator
+    over the lines of its standard input as the first argument, and
+    ``*args`` and ``**kwargs`` as the rest. It should yield strings,
+    which are written to its standard output. The stage runs in a
+    thread in the calling process, connected to the rest of the
+    pipeline with OS pipes, so data is streamed through it and a slow
+    consumer slows down the producer, as with external commands.
+
+    If the function returns normally, the exit code of the stage is
+    zero. If it raises an exception, the exit code is one, and the
+    stack trace is written to the standard error of the pipeline. If
+    the next stage stops reading, the stage stops, as if killed by
+    ``SIGPIPE``.
+
+    '''
+
+    def __init__(self, func, *args, **kwargs):
+        self.func = func
+        self.args = args
+        self.kwargs = kwargs
+
+    def __str__(self):
+        return 'PyStage(%s)' % getattr(self.func, '__name__', repr(self.func))
+
+
+class _PyStageProcess(object):
+
+    '''Run a PyStage in a thread, with a subprocess.Popen-like interface.
+
+    ``stdin``, ``stdout``, and ``stderr`` are interpreted as for
+    ``subprocess.Popen``, except that a file object for stdin is taken
+    over by the stage and closed once it is done.
+
+    '''
+
+    def __init__(self, stage, stdin, stdout, stderr):
+        self.stage = stage
+        self.returncode = None
+        self.stdin = None
+        self.stdout = None
+        self.stderr = None
+
+        if stdin == subprocess.PIPE:
+            r, w = _cloexec_pipe()
+            self._input = os.fdopen(r, 'rb')
+            self.stdin = os.fdopen(w, 'wb')
+        elif isinstance(stdin, file):
+            self._input = stdin
+        else:
+            self._input = os.fdopen(_dup_fd(stdin, 0), 'rb')
+
+        if stdout == subprocess.PIPE:
+            r, w = _cloexec_pipe()
+            self.stdout = os.fdopen(r, 'rb')
+            self._output = os.fdopen(w, 'wb')
+        else:
+            self._output = os.fdopen(_dup_fd(stdout, 1), 'wb')
+
+        if stderr == subprocess.STDOUT:
+            self._errors = None
         else:
-            raise
+            self._errors = os.fdopen(_dup_fd(stderr, 2), 'wb')
+
+        self._thread = threading.Thread(target=self._run)
+        self._thread.daemon = True
+        self._thread.start()
+
+    def _run(self):
+        try:
+            lines = iter(self._input.readline, '')
+            for data in self.stage.func(
+                    lines, *self.stage.args, **self.stage.kwargs):
+                self._output.write(data)
+            self._output.flush()
+            returncode = 0
+        except IOError, e:
+            if e.errno != errno.EPIPE:
+                returncode = self._report_exception()
+            else:
+                returncode = -signal.SIGPIPE
+        except BaseException:
+            returncode = self._report_exception()
+
+        for f in [self._input, self._output, self._errors]:
+            if f is not None:
+                try:
+                    f.close()
+                except IOError:  # pragma: no cover
+                    pass
+
+        self.returncode = returncode
+
+    def _report_exception(self):
+        f = self._errors or self._output
+        try:
+            f.write('%s failed:\n%s' % (self.stage, traceback.format_exc()))
+            f.flush()
+        except IOError:  # pragma: no cover
+            pass
+        return 1
+
+    def poll(self):
+        return self.returncode
+
+    def wait(self):
+        self._thread.join()
+        return self.returncode
+
+
+def _dup_fd(f, default):
+    '''Return a duplicate of the file descriptor of a Popen argument.'''
+    if f is None:
+        fd = default
+    elif isinstance(f, (int, long)):
+        fd = f
+    else:
+        fd = f.fileno()
+    with _fork_lock:
+        new_fd = os.dup(fd)
+        _set_cloexec(new_fd)
+    return new_fd
+
+
+# runcmd may be called from many threads at once. Every file descriptor
+# it creates is marked close-on-exec, and creating descriptors and
+# starting child processes are serialized with this lock, so that a
+# child started by another thread never inherits the end of a pipe
+# meant for some other pipeline. If it did, the other pipeline would
+# never see end of file, and would hang until the unrelated child
+# exits. Only this fork-critical section is serialized: reading and
+# writing the pipes, and waiting for children, run in parallel.
+#
+# Where os.pipe2 exists, new pipes are close-on-exec atomically, which
+# also protects against processes forked by code other than cliapp.
+_fork_lock = threading.Lock()
+
+
+def _set_cloexec(fd):
+    flags = fcntl.fcntl(fd, fcntl.F_GETFD)
+    fcntl.fcntl(fd, fcntl.F_SETFD, flags | fcntl.FD_CLOEXEC)
+
+
+def _cloexec_pipe():
+    if hasattr(os, 'pipe2'):  # pragma: no cover
+        return os.pipe2(os.O_CLOEXEC)
+    with _fork_lock:
+        r, w = os.pipe()
+        _set_cloexec(r)
+        _set_cloexec(w)
+    return r, w
+
+
+def _popen(argv, **kwargs):
+    '''Start a child process, without leaking pipes to other children.'''
+    with _fork_lock:
+        p = subprocess.Popen(argv, **kwargs)
+        for f in [p.stdin, p.stdout, p.stderr]:
+            if f is not None:
+                _set_cloexec(f.fileno())
+    return p
 
 
 def _build_pipeline(argvs, pipe_stdin, pipe_stdout, pipe_stderr, kwargs):
@@ -117,7 +509,7 @@ def _build_pipeline(argvs, pipe_stdin, pipe_stdout, pipe_stderr, kwargs):
 
     if pipe_stderr == subprocess.PIPE:
         # Make pipe for all subprocesses to share
-        rpipe, wpipe = os.pipe()
+        rpipe, wpipe = _cloexec_pipe()
         stderr = wpipe
     else:
         stderr = pipe_stderr
@@ -135,8 +527,14 @@ def _build_pipeline(argvs, pipe_stdin, pipe_stdout, pipe_stderr, kwargs):
         else:
             stdin = procs[-1].stdout
             stdout = subprocess.PIPE
-        p = subprocess.Popen(argv, stdin=stdin, stdout=stdout,
-                             stderr=stderr, close_fds=True, **kwargs)
+        if isinstance(argv, PyStage):
+            # The stage takes over the file it reads from, and closes
+            # it when done.
+            procs.append(_PyStageProcess(argv, stdin, stdout, stderr))
+            continue
+
+        p = _popen(argv, stdin=stdin, stdout=stdout,
+                   stderr=stderr, close_fds=True, **kwargs)
 
         if i != 0:
             # Popen leaves this fd open in the parent,
@@ -206,7 +604,7 @@ def _run_pipeline(procs, feed_stdin, pipe_stdin, pipe_stdout, pipe_stderr,
 
         if rlist or wlist:
             try:
-                r, w, _ = select.select(rlist, wlist, [])
+                r, w = _wait_for_io(rlist, wlist)
             except select.error as e:  # pragma: no cover
                 if e.args[0] == errno.EINTR:
                     break
@@ -250,6 +648,199 @@ def _run_pipeline(procs, feed_stdin, pipe_stdin, pipe_stdout, pipe_stderr,
     return errorcodes[-1], ''.join(out), ''.join(err)
 
 
+def _wait_for_io(rlist, wlist):
+    '''Wait until some files are ready for reading or writing.
+
+    Return lists of the files that are ready. This is like
+    ``select.select``, but uses ``poll`` when it is available:
+    ``select`` can't handle file descriptors above ``FD_SETSIZE``,
+    which are common in processes that run many commands concurrently.
+
+    '''
+
+    if not hasattr(select, 'poll'):  # pragma: no cover
+        r, w, _ = select.select(rlist, wlist, [])
+        return r, w
+
+    done = select.POLLHUP | select.POLLERR | select.POLLNVAL
+    poller = select.poll()
+    files = {}
+    for f in rlist:
+        poller.register(f, select.POLLIN | select.POLLPRI)
+        files[f.fileno()] = f
+    for f in wlist:
+        poller.register(f, select.POLLOUT)
+        files[f.fileno()] = f
+
+    r = []
+    w = []
+    for fd, event in poller.poll():
+        f = files[fd]
+        if f in rlist and event & (select.POLLIN | select.POLLPRI | done):
+            r.append(f)
+        if f in wlist and event & (select.POLLOUT | done):
+            w.append(f)
+    return r, w
+
+
+# Bytes of headroom left unused when filling a command line, as
+# xargs does, so that the exec does not fail on small miscalculations.
+_arg_headroom = 2048
+
+# Each argument and environment string also costs a pointer in the
+# argv or envp array.
+_pointer_size = struct.calcsize('P')
+
+
+def runcmd_batched(argv_prefix, items, max_args=None, max_bytes=None,
+                   max_parallel=1, **kwargs):
+    '''Run a command on a list of items, in batches, like xargs.
+
+    Example: ``runcmd_batched(['rm', '-f'], filenames)``
+
+    ``items`` may be any iterable, including a generator: it is
+    consumed lazily. The items are appended to ``argv_prefix`` as
+    arguments, splitting them into as many invocations of the
+    command as needed to fit within the system's limit on the size
+    of the command line (``ARG_MAX``), taking the size of the
+    environment into account. ``max_args`` and ``max_bytes``
+    further limit the number of items and the size of the command
+    line for each batch.
+
+    If ``max_parallel`` is larger than one, that many batches are
+    run concurrently. Otherwise batches are run one after another.
+
+    Return the standard output of all batches, concatenated in the
+    order of the items. Raise ``cliapp.AppException`` if any batch
+    fails, unless ``ignore_fail`` is true, as for ``runcmd``. Other
+    keyword arguments are passed to ``runcmd_unchecked`` for each
+    batch.
+
+    '''
+
+    opts = _pop_check_options(kwargs)
+    exit_code, out, err = runcmd_batched_unchecked(
+        argv_prefix, items, max_args=max_args, max_bytes=max_bytes,
+        max_parallel=max_parallel, **kwargs)
+    _check_exit(argv_prefix, exit_code, out, err, opts)
+    return out
+
+
+def runcmd_batched_unchecked(argv_prefix, items, max_args=None,
+                             max_bytes=None, max_parallel=1, **kwargs):
+    '''Run a command on a list of items, in batches, like xargs.
+
+    Return the exit code, and the concatenated standard output and
+    error of all batches. The exit code is that of the last batch
+    that failed, or zero if all succeeded.
+
+    See also ``runcmd_batched``.
+
+    '''
+
+    limit = _local_arg_max(kwargs.get('env'))
+    if max_bytes is not None:
+        limit = min(limit, max_bytes)
+
+    def run_batch(batch):
+        return runcmd_unchecked(argv_prefix + batch, **kwargs)
+
+    batches = _split_batches(
+        argv_prefix, items, limit, max_args, _local_arg_size)
+    return _aggregate_results(_map_batches(run_batch, batches, max_parallel))
+
+
+def _local_arg_max(env):
+    '''Return number of bytes available for argv on this system.'''
+
+    try:
+        arg_max = os.sysconf('SC_ARG_MAX')
+    except (ValueError, OSError):  # pragma: no cover
+        arg_max = 128 * 1024
+    if arg_max <= 0:  # pragma: no cover
+        arg_max = 128 * 1024
+
+    if env is None:
+        env = os.environ
+    env_size = sum(_local_arg_size('%s=%s' % (k, v)) for k, v in env.items())
+
+    return arg_max - env_size - _arg_headroom
+
+
+def _local_arg_size(arg):
+    return len(arg) + 1 + _pointer_size
+
+
+def _split_batches(argv_prefix, items, limit, max_args, arg_size):
+    '''Split items into lists that fit on a command line.
+
+    The command line consists of ``argv_prefix``, followed by the
+    items in a batch. ``arg_size`` returns the number of bytes one
+    argument takes of ``limit``.
+
+    '''
+
+    prefix_size = sum(arg_size(arg) for arg in argv_prefix)
+
+    batch = []
+    size = prefix_size
+    for item in items:
+        item_size = arg_size(item)
+        if prefix_size + item_size > limit:
+            raise cliapp.AppException(
+                'Argument too long for command line: %s %.64s...' %
+                (' '.join(argv_prefix), item))
+        full = max_args is not None and len(batch) >= max_args
+        if batch and (full or size + item_size > limit):
+            yield batch
+            batch = []
+            size = prefix_size
+        batch.append(item)
+        size += item_size
+    if batch:
+        yield batch
+
+
+def _map_batches(func, batches, max_parallel):
+    '''Call func for each batch, yield results in order of batches.
+
+    At most ``max_parallel`` calls run at the same time. Batches are
+    generated only a little ahead of the results being consumed, so
+    that huge lists of items are never all in memory at once.
+
+    '''
+
+    if max_parallel <= 1:
+        for batch in batches:
+            yield func(batch)
+        return
+
+    pool = multiprocessing.pool.ThreadPool(max_parallel)
+    try:
+        pending = collections.deque()
+        for batch in batches:
+            pending.append(pool.apply_async(func, (batch,)))
+            if len(pending) >= 2 * max_parallel:
+                yield pending.popleft().get()
+        while pending:
+            yield pending.popleft().get()
+    finally:
+        pool.close()
+        pool.join()
+
+
+def _aggregate_results(results):
+    exit_code = 0
+    out = []
+    err = []
+    for batch_exit, batch_out, batch_err in results:
+        if batch_exit != 0:
+            exit_code = batch_exit
+        out.append(batch_out)
+        err.append(batch_err)
+    return exit_code, ''.join(out), ''.join(err)
+
+
 def shell_quote(s):
     '''Return a shell-quoted version of s.'''
 
@@ -313,6 +904,67 @@ def ssh_runcmd(target, argv, **kwargs):  # pragma: no cover
 
     '''
 
+    ssh_argv = _ssh_argv(target, kwargs)
+    local_argv = ssh_argv + map(shell_quote, argv)
+    return runcmd(local_argv, **kwargs)
+
+
+def ssh_runcmd_batched(target, argv_prefix, items, max_args=None,
+                       max_bytes=None, max_parallel=1,
+                       remote_arg_max=None, **kwargs):  # pragma: no cover
+    '''Run a command on remote host on a list of items, in batches.
+
+    This is to ``ssh_runcmd`` what ``runcmd_batched`` is to
+    ``runcmd``. The batches are sized to fit the command line limit
+    on the remote host, as well as the local one. The remote command
+    line is passed to the remote shell as a single string, so its
+    size is also limited by the maximum length of a single argument
+    (``MAX_ARG_STRLEN``, 128 KiB on Linux).
+
+    The remote limit is queried with ``getconf ARG_MAX`` over ssh,
+    unless given with ``remote_arg_max``.
+
+    The ``tty``, ``ssh_options``, and ``remote_cwd`` keyword arguments
+    work as for ``ssh_runcmd``.
+
+    '''
+
+    opts = _pop_check_options(kwargs)
+    ssh_argv = _ssh_argv(target, kwargs)
+
+    if remote_arg_max is None:
+        out = runcmd(ssh_argv + ['getconf', 'ARG_MAX'])
+        remote_arg_max = int(out.strip())
+    remote_limit = min(remote_arg_max, 128 * 1024) - _arg_headroom
+
+    limit = min(_local_arg_max(kwargs.get('env')), remote_limit)
+    if max_bytes is not None:
+        limit = min(limit, max_bytes)
+
+    quoted_prefix = ssh_argv + map(shell_quote, argv_prefix)
+
+    def remote_arg_size(item):
+        return _local_arg_size(shell_quote(item))
+
+    def run_batch(batch):
+        return runcmd_unchecked(
+            quoted_prefix + map(shell_quote, batch), **kwargs)
+
+    batches = _split_batches(
+        quoted_prefix, items, limit, max_args, remote_arg_size)
+    exit_code, out, err = _aggregate_results(
+        _map_batches(run_batch, batches, max_parallel))
+    _check_exit(quoted_prefix, exit_code, out, err, opts)
+    return out
+
+
+def _ssh_argv(target, kwargs):  # pragma: no cover
+    '''Return argv prefix for running a command with ssh.
+
+    The ssh related keyword arguments are removed from kwargs.
+
+    '''
+
     ssh_argv = ['ssh']
 
     tty = kwargs.pop('tty', None)
@@ -334,5 +986,4 @@ def ssh_runcmd(target, argv, **kwargs):  # pragma: no cover
             '-',
             remote_cwd]))
 
-    local_argv = ssh_argv + map(shell_quote, argv)
-    return runcmd(local_argv, **kwargs)
+    return ssh_argv
@@ -16,6 +16,8 @@
 # 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
 
 
+import fcntl
+import multiprocessing.pool
 import os
 import subprocess
 import tempfile
@@ -161,6 +163,232 @@ class RuncmdTests(unittest.TestCase):
         self.assertEqual(''.join(msgs), err)
 
 
+def upcase(lines):
+    for line in lines:
+        yield line.upper()
+
+
+def count_lines(lines):
+    yield '%d\n' % len(list(lines))
+
+
+def endless(lines):
+    while True:
+        yield 'yes\n'
+
+
+def explode(lines):
+    for line in lines:
+        yield line
+    raise Exception('kaboom')
+
+
+class PyStageTests(unittest.TestCase):
+
+    def test_runs_stage_between_commands(self):
+        self.assertEqual(
+            cliapp.runcmd(
+                ['printf', 'a\\nb\\n'], cliapp.PyStage(upcase), ['cat']),
+            'A\nB\n')
+
+    def test_runs_stage_first_with_fed_stdin(self):
+        self.assertEqual(
+            cliapp.runcmd(
+                cliapp.PyStage(upcase), ['cat'], feed_stdin='foo\nbar\n'),
+            'FOO\nBAR\n')
+
+    def test_runs_stage_last(self):
+        self.assertEqual(
+            cliapp.runcmd(['seq', '1000'], cliapp.PyStage(count_lines)),
+            '1000\n')
+
+    def test_runs_consecutive_stages(self):
+        self.assertEqual(
+            cliapp.runcmd(
+                ['seq', '10'], cliapp.PyStage(upcase),
+                cliapp.PyStage(count_lines)),
+            '10\n')
+
+    def test_streams_lots_of_data(self):
+        data = 'x' * 1000 + '\n'
+        self.assertEqual(
+            cliapp.runcmd(
+                ['cat'], cliapp.PyStage(upcase), ['cat'],
+                feed_stdin=data * 1000),
+            data.upper() * 1000)
+
+    def test_stops_when_consumer_stops(self):
+        exit_code, out, _ = cliapp.runcmd_unchecked(
+            cliapp.PyStage(endless), ['head', '-n1'])
+        self.assertEqual(out, 'yes\n')
+        self.assertNotEqual(exit_code, 0)
+
+    def test_reports_exception_as_failure(self):
+        exit_code, out, err = cliapp.runcmd_unchecked(
+            ['echo', 'foo'], cliapp.PyStage(explode), ['cat'])
+        self.assertEqual(exit_code, 1)
+        self.assertEqual(out, 'foo\n')
+        self.assertTrue('kaboom' in err)
+
+    def test_runcmd_raises_error_for_failing_stage(self):
+        self.assertRaises(
+            cliapp.AppException, cliapp.runcmd,
+            cliapp.PyStage(explode), feed_stdin='foo\n', log_error=False)
+
+
+def open_fds():
+    return set(int(x) for x in os.listdir('/proc/self/fd'))
+
+
+@unittest.skipUnless(os.path.isdir('/proc/self/fd'), 'needs /proc/self/fd')
+class RuncmdThreadSafetyTests(unittest.TestCase):
+
+    def test_parent_ends_of_pipes_are_close_on_exec(self):
+        flags = []
+
+        def check_fds(data):
+            for fd in open_fds() - set([0, 1, 2]):
+                try:
+                    target = os.readlink('/proc/self/fd/%d' % fd)
+                except OSError:
+                    continue
+                if target.startswith('pipe:'):
+                    flags.append(fcntl.fcntl(fd, fcntl.F_GETFD))
+
+        cliapp.runcmd(
+            ['echo', 'foo'], cliapp.PyStage(upcase), ['cat'],
+            stdout_callback=check_fds)
+        self.assertNotEqual(flags, [])
+        for value in flags:
+            self.assertTrue(value & fcntl.FD_CLOEXEC)
+
+    def test_unrelated_child_does_not_inherit_pipes(self):
+        inherited = []
+
+        def list_child_fds(data):
+            out = subprocess.check_output(
+                ['ls', '/proc/self/fd'], close_fds=False)
+            inherited.extend(int(x) for x in out.split() if int(x) > 3)
+
+        cliapp.runcmd(
+            ['echo', 'foo'], ['cat'], stdout_callback=list_child_fds)
+        self.assertEqual(inherited, [])
+
+    def test_runs_many_pipelines_concurrently(self):
+        def run(i):
+            if i % 3 == 0:
+                return cliapp.runcmd(
+                    ['echo', str(i)], cliapp.PyStage(upcase), ['cat'])
+            elif i % 3 == 1:
+                return cliapp.runcmd(['cat'], ['cat'], feed_stdin='%d\n' % i)
+            else:
+                return cliapp.runcmd(
+                    ['sh', '-c', 'echo $0 >&2; echo $0', str(i)])
+
+        fds_before = open_fds()
+        pool = multiprocessing.pool.ThreadPool(32)
+        try:
+            results = pool.map_async(run, range(300)).get(timeout=300)
+        finally:
+            pool.close()
+            pool.join()
+        self.assertEqual(results, ['%d\n' % i for i in range(300)])
+        self.assertEqual(open_fds(), fds_before)
+
+
+class RuncmdChildSetupTests(unittest.TestCase):
+
+    def test_sets_resource_limit(self):
+        self.assertEqual(
+            cliapp.runcmd(['sh', '-c', 'ulimit -n'], rlimits={'nofile': 100}),
+            '100\n')
+
+    def test_sets_resource_limits_for_every_command_in_pipeline(self):
+        self.assertEqual(
+            cliapp.runcmd(
+                ['sh', '-c', 'ulimit -n'], ['sh', '-c', 'cat; ulimit -n'],
+                rlimits={'nofile': 100}),
+            '100\n100\n')
+
+    def test_raises_error_for_unknown_resource_limit(self):
+        self.assertRaises(
+            cliapp.AppException,
+            cliapp.runcmd, ['true'], rlimits={'nosuchlimit': 1})
+
+    def test_sets_nice_level(self):
+        before = int(cliapp.runcmd(['nice']))
+        self.assertEqual(int(cliapp.runcmd(['nice'], nice=3)), before + 3)
+
+    @unittest.skipUnless(os.path.exists('/proc/self/status'), 'needs /proc')
+    def test_sets_cpu_affinity(self):
+        out = cliapp.runcmd(
+            ['grep', 'Cpus_allowed_list', '/proc/self/status'],
+            cpu_affinity='0')
+        self.assertEqual(out.split(), ['Cpus_allowed_list:', '0'])
+
+    def test_raises_error_for_malformed_cpu_list(self):
+        self.assertRaises(
+            cliapp.AppException,
+            cliapp.runcmd, ['true'], cpu_affinity='0-x')
+
+    @unittest.skipUnless(os.path.exists('/usr/bin/ionice'), 'needs ionice')
+    def test_sets_io_scheduling_class(self):
+        self.assertEqual(
+            cliapp.runcmd(
+                ['ionice'], ionice_class='best-effort', ionice_priority=6),
+            'best-effort: prio 6\n')
+
+    def test_raises_error_for_unknown_io_scheduling_class(self):
+        self.assertRaises(
+            cliapp.AppException,
+            cliapp.runcmd, ['true'], ionice_class='fastest')
+
+
+class RuncmdBatchedTests(unittest.TestCase):
+
+    def test_runs_command_once_for_few_items(self):
+        self.assertEqual(
+            cliapp.runcmd_batched(['echo'], ['a', 'b', 'c']),
+            'a b c\n')
+
+    def test_runs_nothing_for_no_items(self):
+        self.assertEqual(cliapp.runcmd_batched(['echo'], []), '')
+
+    def test_splits_by_max_args(self):
+        self.assertEqual(
+            cliapp.runcmd_batched(['echo'], iter('abcde'), max_args=2),
+            'a b\nc d\ne\n')
+
+    def test_splits_by_max_bytes(self):
+        out = cliapp.runcmd_batched(
+            ['echo'], ['x' * 100] * 4, max_bytes=200)
+        self.assertEqual(out.splitlines(), ['x' * 100] * 4)
+
+    def test_keeps_order_when_run_in_parallel(self):
+        items = [str(i) for i in range(100)]
+        out = cliapp.runcmd_batched(
+            ['echo'], items, max_args=3, max_parallel=4)
+        self.assertEqual(out.split(), items)
+
+    def test_raises_error_if_any_batch_fails(self):
+        self.assertRaises(
+            cliapp.AppException,
+            cliapp.runcmd_batched, ['test', '-e'], ['/', '/notexist', '/'],
+            max_args=1, log_error=False)
+
+    def test_unchecked_returns_last_failing_exit_code(self):
+        exit_code, out, err = cliapp.runcmd_batched_unchecked(
+            ['sh', '-c', 'echo $1; exit $1', '-'], ['0', '3', '0'],
+            max_args=1)
+        self.assertEqual(exit_code, 3)
+        self.assertEqual(out, '0\n3\n0\n')
+
+    def test_raises_error_for_item_longer_than_limit(self):
+        self.assertRaises(
+            cliapp.AppException,
+            cliapp.runcmd_batched, ['echo'], ['x' * 1000], max_bytes=100)
+
+
 class ShellQuoteTests(unittest.TestCase):
 
     def test_returns_empty_string_for_empty_string(self):
@@ -32,6 +32,7 @@ else:  # pragma: no cover
 
 import cliapp
 from cliapp.genman import ManpageGenerator
+from cliapp.argfile import expand_response_files, split_options, LazyArgs
 
 
 log_group_name = 'Logging'
@@ -254,6 +255,20 @@ class IntegerSetting(Setting):
         self._string_value = str(value)
 
 
+class FloatSetting(Setting):
+
+    type = 'float'
+
+    def default_metavar(self):
+        return self.names[0].upper()
+
+    def get_value(self):
+        return float(self._string_value)
+
+    def set_value(self, value):
+        self._string_value = str(value)
+
+
 class FormatHelpParagraphs(optparse.IndentedHelpFormatter):
 
     def _format_text(self, text):  # pragma: no cover
@@ -290,7 +305,8 @@ class Settings(object):
     ``optparse`` decides (i.e., name of option).
 
     Use ``load_configs`` to read configuration files, and
-    ``parse_args`` to parse command line arguments.
+    ``parse_args`` to parse command line arguments. Set
+    ``response_files`` to False to not expand ``@FILE`` arguments.
 
     The current value of a setting can be accessed by indexing
     the settings class::
@@ -308,6 +324,8 @@ class Settings(object):
         self._settingses = dict()
         self._all_config_data = {}
         self._canonical_names = list()
+        self.response_files = True
+        self._expanded_args = None
 
         self.version = version
         self.progname = progname
@@ -326,6 +344,125 @@ class Settings(object):
                     'write output to FILE, instead of standard output',
                     metavar='FILE')
 
+        self.choice(['input-compression'],
+                    ['none', 'auto', 'gzip', 'bzip2', 'xz'],
+                    'decompress input files compressed with METHOD, which '
+                    'is one of: none, auto (recognize gzip, bzip2, and xz '
+                    'from contents of file), gzip, bzip2, or xz '
+                    '(default: %default)',
+                    metavar='METHOD')
+
+        self.choice(['output-compression'],
+                    ['none', 'auto', 'gzip', 'bzip2', 'xz'],
+                    'compress the file named with --output with METHOD, '
+                    'which is one of: none, auto (choose gzip, bzip2, or '
+                    'xz from the .gz, .bz2, or .xz filename extension), '
+                    'gzip, bzip2, or xz (default: %default)',
+                    metavar='METHOD')
+        self.integer(['output-compression-level'],
+                     'compress output at LEVEL, from 1 (fastest) to 9 '
+                     '(smallest); 0 means the default of the compression '
+                     'program (default: %default)',
+                     metavar='LEVEL',
+                     default=0)
+
+        self.integer(['sort-key'],
+                     'sort collected lines by whitespace-separated field '
+                     'N, counting from 1; 0 means the whole line '
+                     '(default: %default)',
+                     metavar='N',
+                     default=0)
+        self.boolean(['sort-numeric'],
+                     'compare sort keys as numbers')
+        self.boolean(['sort-unique'],
+                     'keep only the first of sorted lines with equal keys')
+
+        self.bytesize(['output-chunk-size'],
+                      'split output into numbered files of about SIZE '
+                      'bytes each, named after the --output file; a '
+                      'manifest is written at the end (default: do not '
+                      'split)',
+                      metavar='SIZE',
+                      default=0)
+        self.integer(['output-chunk-records'],
+                     'split output into numbered files of N lines each, '
+                     'like --output-chunk-size',
+                     metavar='N',
+                     default=0)
+
+        self.string(['checkpoint'],
+                    'save progress through input files to FILE regularly, '
+                    'so that an interrupted run can be resumed with '
+                    '--resume',
+                    metavar='FILE')
+        self.integer(['checkpoint-lines'],
+                     'save a checkpoint every N lines (default: %default)',
+                     metavar='N',
+                     default=0)
+        self.integer(['checkpoint-interval'],
+                     'save a checkpoint every SECONDS seconds '
+                     '(default: %default)',
+                     metavar='SECONDS',
+                     default=60)
+        self.boolean(['resume'],
+                     'continue an interrupted run from the file given with '
+                     '--checkpoint')
+
+        self.string(['incremental-index'],
+                    'remember processed input files in FILE, and skip '
+                    'those that have not changed since',
+                    metavar='FILE')
+        self.boolean(['incremental-hash'],
+                     'with --incremental-index, also skip files whose '
+                     'contents are unchanged even if their timestamps '
+                     'have changed (slower)')
+
+        self.string(['files-from'],
+                    'read names of input files from FILE, one per line, '
+                    'in addition to those on the command line; "-" means '
+                    'standard input',
+                    metavar='FILE')
+        self.boolean(['null'],
+                     'with --files-from, names are separated by NUL bytes '
+                     'instead of newlines, as from "find -print0"')
+
+        self.boolean(['recursive-inputs'],
+                     'process all files in directories named as inputs, '
+                     'recursively')
+        self.string_list(['input-include'],
+                         'with --recursive-inputs, only process files '
+                         'whose names match the shell glob PATTERN; may '
+                         'be used several times',
+                         metavar='PATTERN')
+        self.string_list(['input-exclude'],
+                         'with --recursive-inputs, skip files and '
+                         'directories whose names match the shell glob '
+                         'PATTERN; may be used several times',
+                         metavar='PATTERN')
+
+        self.choice(['input-records'],
+                    ['lines', 'fixed', 'length32', 'varint', 'delimited'],
+                    'read input files as MODE: text lines, binary '
+                    'records of --input-record-size bytes, records '
+                    'prefixed by their length as a 4-byte or varint '
+                    'integer, or records separated by '
+                    '--input-record-delimiter (default: %default)',
+                    metavar='MODE')
+        self.integer(['input-record-size'],
+                     'size of fixed-size input records, in bytes',
+                     metavar='N')
+        self.string(['input-record-delimiter'],
+                    'separator of delimited input records; Python '
+                    'escapes such as \\0 and \\x1e may be used '
+                    '(default: newline)',
+                    metavar='BYTES',
+                    default='\\n')
+        self.choice(['input-record-byteorder'],
+                    ['big', 'little'],
+                    'byte order of 4-byte record lengths, big or '
+                    'little (default: %default)',
+                    metavar='ORDER')
+
         self.string(['log'],
                     'write log entries to FILE (default is to not write log '
                     'files at all); use "syslog" to log to system log, '
@@ -361,6 +498,170 @@ class Settings(object):
                      default=300,
                      group=perf_group_name)
 
+        self.integer(['jobs'],
+                     'process inputs using N worker processes; '
+                     'zero means one per CPU (default: %default)',
+                     metavar='N',
+                     default=1,
+                     group=perf_group_name)
+
+        self.integer(['input-shards'],
+                     'split each large input file into N parts, and '
+                     'process them in parallel (default: %default)',
+                     metavar='N',
+                     default=1,
+                     group=perf_group_name)
+        self.bytesize(['input-shard-min-size'],
+                      'with --input-shards, only split input files of '
+                      'at least SIZE bytes (default: %default)',
+                      metavar='SIZE',
+                      default=16 * 1024**2,
+                      group=perf_group_name)
+
+        self.bytesize(['output-buffer-size'],
+                      'collect output in memory and write it in blocks '
+                      'of SIZE bytes (default: use a normal file)',
+                      metavar='SIZE',
+                      default=0,
+                      group=perf_group_name)
+        self.boolean(['output-thread'],
+                     'write output in a background thread, so that '
+                     'processing does not wait for slow disks or pipes',
+                     group=perf_group_name)
+
+        self.boolean(['input-filter-grep'],
+                     'use grep to find lines of input files that match '
+                     'the input filter of the application, if possible',
+                     group=perf_group_name)
+
+        self.integer(['line-index-interval'],
+                     'record the position of every Nth line in line '
+                     'indexes of input files (default: %default)',
+                     metavar='N',
+                     default=10000,
+                     group=perf_group_name)
+
+        self.integer(['walk-jobs'],
+                     'with --recursive-inputs, read up to N directories '
+                     'at once, in threads (default: %default)',
+                     metavar='N',
+                     default=1,
+                     group=perf_group_name)
+
+        self.integer(['prefetch-files'],
+                     'read up to N input files ahead of the one being '
+                     'processed (default: %default)',
+                     metavar='N',
+                     default=0,
+                     group=perf_group_name)
+        self.bytesize(['prefetch-max'],
+                      'read at most SIZE bytes of input files ahead '
+                      '(default: %default)',
+                      metavar='SIZE',
+                      default=64 * 1024**2,
+                      group=perf_group_name)
+
+        self.integer(['map-reduce-keys'],
+                     'keep partial results for up to N keys in memory in '
+                     'each worker, when aggregating with map_line '
+                     '(default: %default)',
+                     metavar='N',
+                     default=100000,
+                     group=perf_group_name)
+
+        self.bytesize(['sort-memory'],
+                      'sort lines in memory up to SIZE bytes, and spill '
+                      'the rest to temporary files (default: %default)',
+                      metavar='SIZE',
+                      default=256 * 1024**2,
+                      group=perf_group_name)
+        self.choice(['sort-compress'],
+                    ['none', 'gzip', 'bzip2', 'xz'],
+                    'compress temporary files of sorting with METHOD, '
+                    'one of none, gzip, bzip2, or xz (default: %default)',
+                    metavar='METHOD',
+                    group=perf_group_name)
+        self.string(['sort-tempdir'],
+                    'put temporary files of sorting in DIR (default: '
+                    'the system default)',
+                    metavar='DIR',
+                    group=perf_group_name)
+
+        self.boolean(['mmap-input'],
+                     'read regular input files via memory mappings',
+                     group=perf_group_name)
+
+        self.integer(['child-nice'],
+                     'add N to the nice level of external commands '
+                     '(default: %default)',
+                     metavar='N',
+                     default=0,
+                     group=perf_group_name)
+        self.choice(['child-ionice-class'],
+                    ['none', 'idle', 'best-effort', 'realtime'],
+                    'run external commands in I/O scheduling CLASS, which '
+                    'is one of: none, idle, best-effort, or realtime '
+                    '(default: %default)',
+                    metavar='CLASS',
+                    group=perf_group_name)
+        self.integer(['child-ionice-priority'],
+                     'run external commands with I/O scheduling priority N '
+                     'within their class, from 0 (highest) to 7 '
+                     '(default: %default)',
+                     metavar='N',
+                     default=4,
+                     group=perf_group_name)
+        self.string(['child-cpu-affinity'],
+                    'run external commands only on CPUS, a list such as '
+                    '"0-3,6" (default: any CPU)',
+                    metavar='CPUS',
+                    group=perf_group_name)
+        self.integer(['child-max-cpu-time'],
+                     'limit CPU time of each external command to SECONDS, '
+                     'zero for no limit (default: %default)',
+                     metavar='SECONDS',
+                     default=0,
+                     group=perf_group_name)
+        self.bytesize(['child-max-memory'],
+                      'limit address space of each external command to '
+                      'SIZE, zero for no limit (default: %default)',
+                      metavar='SIZE',
+                      default=0,
+                      group=perf_group_name)
+        self.integer(['child-max-open-files'],
+                     'limit number of open files of each external command '
+                     'to N, zero for no limit (default: %default)',
+                     metavar='N',
+                     default=0,
+                     group=perf_group_name)
+
+        self.integer(['max-host-commands'],
+                     'run at most N external commands at once on this '
+                     'host, counting all instances of this program; zero '
+                     'for no limit (default: %default)',
+                     metavar='N',
+                     default=0,
+                     group=perf_group_name)
+        self.float(['max-host-load'],
+                   'delay starting external commands while the load '
+                   'average is above LOAD, such as 1.5; zero for no '
+                   'limit (default: %default)',
+                   metavar='LOAD',
+                   default=0.0,
+                   group=perf_group_name)
+        self.integer(['max-memory-pressure'],
+                     'delay starting external commands while memory '
+                     'pressure is above PERCENT; zero for no limit '
+                     '(default: %default)',
+                     metavar='PERCENT',
+                     default=0,
+                     group=perf_group_name)
+        self.string(['admission-dir'],
+                    'keep lock files for --max-host-commands in DIR '
+                    '(default: $XDG_RUNTIME_DIR or /run/lock)',
+                    metavar='DIR',
+                    group=perf_group_name)
+
     def _add_setting(self, setting):
         '''Add a setting to self._cp.'''
 
@@ -413,6 +714,10 @@ class Settings(object):
         '''Add an integer setting.'''
         self._add_setting(IntegerSetting(names, default, help_text, **kwargs))
 
+    def float(self, names, help_text, default=0.0, **kwargs):
+        '''Add a setting with a floating point value.'''
+        self._add_setting(FloatSetting(names, default, help_text, **kwargs))
+
     def __getitem__(self, name):
         return self._settingses[name].value
 
@@ -707,8 +1012,23 @@ class Settings(object):
         Return list of non-option arguments. ``args`` would usually
         be ``sys.argv[1:]``.
 
+        If ``response_files`` is true (the default), arguments of the
+        form ``@FILE`` are replaced by the arguments in FILE (see
+        ``cliapp.argfile.expand_response_files``). If there are
+        arguments after a ``--`` in a response file, they are not read
+        until they are needed: a ``cliapp.argfile.LazyArgs`` is
+        returned instead of a list.
+
+        Response files are read only once: the arguments expanded by a
+        ``configs_only`` parse are used by the next parse of the same
+        arguments, since a response file may be a pipe.
+
         '''
 
+        rest = None
+        if self.response_files and self._has_response_files(args):
+            args, rest = self._expand_response_files(args, configs_only)
+
         deferred_last = []
 
         p = parser or self.build_parser(configs_only=configs_only,
@@ -725,8 +1045,31 @@ class Settings(object):
             compute_setting_values(self)
         for callback in deferred_last:  # pragma: no cover
             callback()
+        if rest is not None:
+            return LazyArgs(args, rest)
         return args
 
+    def _expand_response_files(self, args, configs_only):
+        # Application parses the command line twice, first to find
+        # config files. The arguments after a --, which are read only
+        # when needed, are left unread for the second parse to return.
+        cached, self._expanded_args = self._expanded_args, None
+        if cached is not None and cached[0] == list(args):
+            head, rest = cached[1:]
+        else:
+            head, rest = split_options(expand_response_files(args))
+        if configs_only:
+            self._expanded_args = (list(args), head, rest)
+        return list(head), rest
+
+    def _has_response_files(self, args):
+        for arg in args:
+            if arg == '--':
+                return False
+            if arg.startswith('@'):
+                return True
+        return False
+
     @property
     def default_config_files(self):
         '''Return list of default config files to read.
@@ -247,6 +247,19 @@ class SettingsTests(unittest.TestCase):
         self.settings.parse_args(args=['--foo=123'])
         self.assertEqual(self.settings['foo'], 123)
 
+    def test_parses_float_option(self):
+        self.settings.float(['foo'], 'foo help', default=1.5)
+
+        self.settings.parse_args(args=[])
+        self.assertEqual(self.settings['foo'], 1.5)
+
+        self.settings.parse_args(args=['--foo=0.25'])
+        self.assertEqual(self.settings['foo'], 0.25)
+
+    def test_parses_fractional_max_host_load(self):
+        self.settings.parse_args(args=['--max-host-load=1.5'])
+        self.assertEqual(self.settings['max-host-load'], 1.5)
+
     def test_has_list_of_default_config_files(self):
         defaults = self.settings.default_config_files
         self.assert_(isinstance(defaults, list))
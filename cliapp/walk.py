@@ -0,0 +1,210 @@
+# Copyright (C) 2016  Lars Wirzenius
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along
+# with this program; if not, write to the Free Software Foundation, Inc.,
+# 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+
+
+import collections
+import fnmatch
+import logging
+import multiprocessing.pool
+import os
+import stat
+
+try:
+    from os import scandir as _scandir
+except ImportError:
+    try:
+        from scandir import scandir as _scandir
+    except ImportError:  # pragma: no cover
+        _scandir = None
+
+from cliapp.argfile import read_separated
+from cliapp.parallel import _forever
+
+
+class _Entry(object):
+
+    # A minimal stand-in for the DirEntry objects of scandir, for when
+    # it is not available. It costs an lstat per entry.
+
+    def __init__(self, dirname, name):
+        self.name = name
+        self.path = os.path.join(dirname, name)
+        self._mode = os.lstat(self.path).st_mode
+
+    def is_dir(self, follow_symlinks=True):
+        if stat.S_ISLNK(self._mode) and follow_symlinks:
+            return os.path.isdir(self.path)
+        return stat.S_ISDIR(self._mode)
+
+    def is_file(self, follow_symlinks=True):
+        if stat.S_ISLNK(self._mode) and follow_symlinks:
+            return os.path.isfile(self.path)
+        return stat.S_ISREG(self._mode)
+
+
+# Whether the lack of scandir has been logged.
+_fallback_logged = False
+
+
+def _entries(dirname):
+    global _fallback_logged
+    if _scandir is not None:
+        return _scandir(dirname)
+    if not _fallback_logged:
+        _fallback_logged = True
+        logging.info(
+            'scandir is not available: directories are walked with a '
+            'stat call per entry; install the scandir module to avoid it')
+    return [_Entry(dirname, name) for name in os.listdir(dirname)]
+
+
+class _Matcher(object):
+
+    def __init__(self, include, exclude):
+        self.include = include
+        self.exclude = exclude
+
+    def _matches_any(self, name, patterns):
+        for pattern in patterns:
+            if fnmatch.fnmatch(name, pattern):
+                return True
+        return False
+
+    def wants_file(self, name):
+        if self.include and not self._matches_any(name, self.include):
+            return False
+        return not self._matches_any(name, self.exclude)
+
+    def wants_dir(self, name):
+        return not self._matches_any(name, self.exclude)
+
+
+def _list_dir(dirname, matcher):
+    files = []
+    dirs = []
+    for entry in _entries(dirname):
+        # The file type usually comes from the directory entry itself,
+        # so that no stat call is needed. Symlinks to directories are
+        # not followed, to avoid loops.
+        if entry.is_dir(follow_symlinks=False):
+            if matcher.wants_dir(entry.name):
+                dirs.append(entry.path)
+        elif entry.is_file() and matcher.wants_file(entry.name):
+            files.append(entry.path)
+    files.sort()
+    dirs.sort()
+    return files, dirs
+
+
+def walk_files(roots, include=None, exclude=None, jobs=1):
+    '''Generate names of files in directory trees.
+
+    ``roots`` is a list of names. Directories are walked recursively,
+    and the regular files in them are generated, in sorted order,
+    files in a directory before those in its subdirectories. Other
+    names are generated as is. Names are generated as soon as they are
+    found, not after the whole walk.
+
+    ``include`` and ``exclude`` are lists of shell glob patterns that
+    are matched against the basenames of files found in directories.
+    If ``include`` is given, only matching files are generated.
+    Matching files are not generated, and matching directories are
+    not walked, if they match an ``exclude`` pattern. Symbolic links
+    to directories are not followed.
+
+    Directories are read with ``os.scandir``, or the ``scandir``
+    module, so that most file types come from directory entries
+    without a separate stat call. Python 2 has no ``os.scandir``:
+    without the ``scandir`` module, every entry is stat'ed, which is
+    much slower on large trees, and this is logged once.
+
+    If ``jobs`` is larger than one, directories are read ahead by
+    that many threads, while the names from earlier directories are
+    still being generated, but at most ``2 * jobs`` directories ahead
+    of the caller. The order of the names stays the same.
+
+    '''
+
+    matcher = _Matcher(include or [], exclude or [])
+    pool = None
+    if jobs > 1:
+        pool = multiprocessing.pool.ThreadPool(jobs)
+    limit = 2 * jobs
+    started = 0
+
+    try:
+        for root in roots:
+            if root == '-' or not os.path.isdir(root):
+                yield root
+                continue
+            stack = collections.deque([_Pending(root)])
+            while stack:
+                pending = stack.pop()
+                if pending.result is None:
+                    files, dirs = _list_dir(pending.dirname, matcher)
+                else:
+                    started -= 1
+                    files, dirs = pending.result.get(_forever)
+                # Walk subdirectories in order: the first one is
+                # popped from the stack first.
+                stack.extend(reversed([_Pending(d) for d in dirs]))
+                if pool is not None:
+                    started = _read_ahead(pool, matcher, stack, started,
+                                          limit)
+                for name in files:
+                    yield name
+    finally:
+        if pool is not None:
+            pool.terminate()
+            pool.join()
+
+
+class _Pending(object):
+
+    # A directory to be walked, and the result of reading it in the
+    # pool, once that has been started.
+
+    def __init__(self, dirname):
+        self.dirname = dirname
+        self.result = None
+
+
+def _read_ahead(pool, matcher, stack, started, limit):
+    # Start reading the directories that will be walked next, from the
+    # top of the stack, until limit directories are being read or have
+    # been read without being walked yet. Return the new count.
+    i = len(stack) - 1
+    while started < limit and i >= 0:
+        pending = stack[i]
+        if pending.result is None:
+            pending.result = pool.apply_async(
+                _list_dir, (pending.dirname, matcher))
+            started += 1
+        i -= 1
+    return started
+
+
+def read_names(f, null=False):
+    '''Generate names from a file, one per line.
+
+    If ``null`` is true, names are separated by NUL bytes instead, as
+    written by ``find -print0``. Empty names are skipped. The file is
+    read lazily, in blocks, so memory use does not depend on the
+    number of names.
+
+    '''
+
+    return read_separated(f, '\0' if null else '\n')
@@ -0,0 +1,171 @@
+# Copyright (C) 2016  Lars Wirzenius
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along
+# with this program; if not, write to the Free Software Foundation, Inc.,
+# 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+
+
+import logging
+import os
+import shutil
+import StringIO
+import tempfile
+import time
+import unittest
+
+import cliapp
+import cliapp.walk
+
+
+class WalkFilesTests(unittest.TestCase):
+
+    def setUp(self):
+        self.tempdir = tempfile.mkdtemp()
+        for name in ['b.txt', 'a.log', 'sub/c.txt', 'sub/deeper/d.txt',
+                     'skip/e.txt', 'sub2/f.txt']:
+            filename = os.path.join(self.tempdir, name)
+            if not os.path.exists(os.path.dirname(filename)):
+                os.makedirs(os.path.dirname(filename))
+            with open(filename, 'w'):
+                pass
+        os.symlink(self.tempdir, os.path.join(self.tempdir, 'sub', 'loop'))
+
+    def tearDown(self):
+        shutil.rmtree(self.tempdir)
+
+    def walk(self, roots=None, **kwargs):
+        if roots is None:
+            roots = [self.tempdir]
+        return [os.path.relpath(name, self.tempdir)
+                for name in cliapp.walk_files(roots, **kwargs)]
+
+    def test_walks_in_sorted_depth_first_order(self):
+        self.assertEqual(
+            self.walk(),
+            ['a.log', 'b.txt', 'skip/e.txt', 'sub/c.txt',
+             'sub/deeper/d.txt', 'sub2/f.txt'])
+
+    def test_parallel_walk_gives_same_order(self):
+        self.assertEqual(self.walk(jobs=4), self.walk())
+
+    def test_parallel_walk_reads_only_a_few_directories_ahead(self):
+        for i in range(50):
+            dirname = os.path.join(self.tempdir, 'many', 'd%02d' % i)
+            os.makedirs(dirname)
+            with open(os.path.join(dirname, 'x'), 'w'):
+                pass
+        listed = []
+        saved = cliapp.walk._list_dir
+
+        def list_dir(dirname, matcher):
+            listed.append(dirname)
+            return saved(dirname, matcher)
+
+        cliapp.walk._list_dir = list_dir
+        try:
+            names = cliapp.walk_files(
+                [os.path.join(self.tempdir, 'many')], jobs=2)
+            self.assertTrue(next(names).endswith('d00/x'))
+            # Give the threads time to read whatever they have been
+            # asked to.
+            time.sleep(0.2)
+            self.assertTrue(len(listed) <= 1 + 1 + 2 * 2)
+            self.assertEqual(len(list(names)), 49)
+        finally:
+            cliapp.walk._list_dir = saved
+
+    def test_walks_without_scandir(self):
+        expected = self.walk()
+        messages = []
+
+        class Handler(logging.Handler):
+
+            def emit(self, record):
+                messages.append(record.getMessage())
+
+        logger = logging.getLogger()
+        level = logger.level
+        handler = Handler()
+        logger.addHandler(handler)
+        logger.setLevel(logging.INFO)
+        saved = cliapp.walk._scandir
+        cliapp.walk._scandir = None
+        cliapp.walk._fallback_logged = False
+        try:
+            self.assertEqual(self.walk(), expected)
+            self.assertEqual(self.walk(), expected)
+        finally:
+            cliapp.walk._scandir = saved
+            logger.removeHandler(handler)
+            logger.setLevel(level)
+        self.assertEqual(
+            len([m for m in messages if 'scandir is not available' in m]), 1)
+
+    def test_filters_with_include_and_exclude(self):
+        self.assertEqual(
+            self.walk(include=['*.txt'], exclude=['skip', 'c.*']),
+            ['b.txt', 'sub/deeper/d.txt', 'sub2/f.txt'])
+
+    def test_passes_other_names_through(self):
+        self.assertEqual(
+            list(cliapp.walk_files(['-', '/nonexistent'])),
+            ['-', '/nonexistent'])
+
+    def test_application_walks_directories(self):
+        names = []
+
+        class App(cliapp.Application):
+
+            def process_input(self, name):
+                names.append(os.path.relpath(name, tempdir))
+
+        tempdir = self.tempdir
+        App().run(args=['--recursive-inputs', '--input-include=*.txt',
+                        '--input-exclude=sub*', tempdir])
+        self.assertEqual(names, ['b.txt', 'skip/e.txt'])
+
+
+class ReadNamesTests(unittest.TestCase):
+
+    def test_reads_lines(self):
+        f = StringIO.StringIO('foo\n\nbar baz\nlast')
+        self.assertEqual(list(cliapp.read_names(f)),
+                         ['foo', 'bar baz', 'last'])
+
+    def test_reads_nul_separated_names(self):
+
+        class SmallReads(StringIO.StringIO):
+
+            def read(self, size):
+                return StringIO.StringIO.read(self, 3)
+
+        f = SmallReads('foo\0new\nline\0\0bar\0')
+        self.assertEqual(list(cliapp.read_names(f, null=True)),
+                         ['foo', 'new\nline', 'bar'])
+
+    def test_application_reads_files_from(self):
+        tempdir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, tempdir)
+        listname = os.path.join(tempdir, 'list')
+        with open(listname, 'w') as f:
+            f.write('foo\0bar\0')
+        names = []
+
+        class App(cliapp.Application):
+
+            def process_input(self, name):
+                self.fileno += 1
+                names.append((self.fileno, name))
+
+        App().run(args=['--files-from', listname, '--null', 'first'])
+        self.assertEqual(names, [(1, 'first'), (2, 'foo'), (3, 'bar')])